@@ -1,53 +1,39 @@
-from flask import Flask, jsonify, request
+import hmac
+import logging
+from flask import Flask, Response, jsonify, request, stream_with_context
 #LIBRERIAS PARA ENVIAR MENSAJES VIA WHTSAPP
-import requests
-import json
-import pandas as pd
-from chatbot_script import interactuar
-import os
+from cliente_whatsapp import WhatsAppError
+from remitentes_whatsapp import RemitentesWhatsApp
+from chatbot_script import candados_telefono, crear_conexion, interactuar
+from sesiones import crear_almacen_sesiones
+from cola_mensajes import ColaMensajes
+from deduplicacion import Deduplicador
+from perezoso import Perezoso
+from eventos_webhook import leer_entrega, trae_mensajes
+from exportacion import EXPORTAR_TOKEN, Exportacion, FiltroInvalido, exportaciones_en_curso
+from instrumentacion import configurar_logging, metricas
+configurar_logging()
+logger = logging.getLogger(__name__)
 app = Flask(__name__)
+#UN CLIENTE POR NUMERO DE WHATSAPP_NUMBERS, CADA UNO CON SU TOKEN, SU POOL Y SU LIMITE DE MENSAJES POR SEGUNDO
+remitentes = RemitentesWhatsApp()
+metricas.registrar_fuente("whatsapp", remitentes.metricas)
+
 #EJECUTAMOS ESTE CODIGO CUANDO SE INGRESE A LA RUTA ENVIAR
 @app.route("/enviar/", methods=["POST", "GET"])
-def enviar(phone=None, message=None):
-  # Tus credenciales de WhatsApp Business API
-  access_token = os.environ.get("ACCESS_TOKEN")
-  if access_token is None:
-    raise ValueError("The WHATSAPP_ACCESS_TOKEN environment variable is not set.")
-  phone_number_id = '309696275570080'
-  recipient_phone_number = '584248365294'  # Número de teléfono del destinatario
-
-  # URL de la API de WhatsApp
-  url = f"https://graph.facebook.com/v19.0/{phone_number_id}/messages"
-
-  # Encabezados de la solicitud
-  headers = {
-      'Authorization': f'Bearer {access_token}',
-      'Content-Type': 'application/json'
-  }
-  # Datos del mensaje
-  payload = {
-    "messaging_product": "whatsapp",
-    "recipient_type": "individual",
-    "to": phone,
-    "type": "text",
-    "text": {
-      "preview_url": True,
-      "body": message
-    }
-  }
-    
-  # Enviar el mensaje
-  response = requests.post(url, headers=headers, data=json.dumps(payload))
+def enviar(phone=None, message=None, numero=None):
+  # Enviar el mensaje por el numero al que escribio el cliente, o por el que le asigna el anillo
+  try:
+    with metricas.medir("enviar"):
+      remitentes.enviar_texto(phone, message, numero)
+  except WhatsAppError as e:
+    logger.error("Error al enviar el mensaje: %s %s", e.status_code, e.texto)
+    return None
+  return "Mensaje enviado exitosamente. osi osi"
 
-  # Verificar el resultado
-  if response.status_code == 200:
-    return "Mensaje enviado exitosamente. osi osi"
-  else:
-    print(f"Error al enviar el mensaje: {response.status_code}")
-    print(response.text)
-
-df = pd.DataFrame({'telefono': [], 'mensaje': [], 'fecha': [], 'step': []})
-f = []
+sesiones = crear_almacen_sesiones()
+#EL ARCHIVO SQLITE DE DEDUPLICACION SE ABRE EN LA PRIMERA ENTREGA DE CADA WORKER, NO AL IMPORTAR
+deduplicador = Perezoso(Deduplicador)
 steps = ['Non_step', 'respuestamensajeinicial', 'final']
 
 @app.route("/webhook/", methods=["POST", "GET"])
@@ -61,34 +47,95 @@ def webhook_whatsapp():
         else:
             #SI NO SON IGUALES RETORNAMOS UN MENSAJE DE ERROR
           return "Error de autentificacion."
+    #LAS NOTIFICACIONES DE ESTADO (sent/delivered/read) SE DESCARTAN SIN PARSEAR EL JSON
+    if not trae_mensajes(request.get_data(cache=True)):
+      return jsonify({'status': 'ignorado'}), 200
     #RECIBIMOS TODOS LOS DATOS ENVIADO VIA JSON
-    data=request.get_json()
-    #EXTRAEMOS EL NUMERO DE TELEFONO Y EL MANSAJE
-    telefono = data['entry'][0]['changes'][0]['value']['messages'][0]['from']
-    mensaje = data['entry'][0]['changes'][0]['value']['messages'][0]['text']['body']
-    timestamp = data['entry'][0]['changes'][0]['value']['messages'][0]['timestamp']
+    data=request.get_json(silent=True)
+    #EXTRAEMOS TODOS LOS MENSAJES NUEVOS, AGRUPADOS POR TELEFONO (LOS REINTENTOS DE META SE DESCARTAN)
+    entrega = leer_entrega(data, deduplicador.obtener().registrar)
+    if not entrega.turnos:
+      return jsonify({'status': 'ignorado', 'estados': entrega.estados, 'duplicados': entrega.duplicados}), 200
+
+    #ENCOLAMOS UN TURNO POR TELEFONO Y RESPONDEMOS A META DE INMEDIATO
+    rechazados = encolar_turnos(cola.encolar, entrega)
+    if rechazados:
+      return jsonify({'status': 'ocupado', 'rechazados': rechazados}), 503
+    return jsonify({'status': 'recibido', 'mensajes': entrega.mensajes, 'turnos': len(entrega.turnos)}), 200
 
-    # Obtener respuesta del chatbot
-    respuesta_chatbot = interactuar(mensaje, telefono)
+def encolar_turnos(encolar, entrega):
+    # Devuelve cuantos turnos no entraron en la cola; sus ids se olvidan para aceptar el reintento
+    rechazados = 0
+    for turno in entrega.turnos:
+      if not encolar(turno.telefono, turno.mensaje, turno.timestamp, turno.numero):
+        rechazados += 1
+        deduplicador.obtener().olvidar(turno.ids)
+    return rechazados
 
-    # Enviar la respuesta al usuario
-    enviar(telefono, respuesta_chatbot)
+def procesar_mensaje(telefono, mensaje, timestamp, numero=None):
+    # Obtener respuesta del chatbot; sale hacia el usuario en cuanto se conoce, antes de guardar el turno
+    enviadas = []
+    def responder(texto):
+        enviadas.append(texto)
+        enviar(telefono, texto, numero)
+    respuesta_chatbot = interactuar(mensaje, telefono, al_responder=responder)
 
-    # Escribimos el número de teléfono y el mensaje en el archivo texto
-    if (telefono not in df['telefono'].values) or (list(df['step'][df['telefono'] == telefono][-1:])[0] == 'final'):
-      df.loc[len(df),:] = {'telefono':telefono , 'mensaje': mensaje, 'fecha': timestamp, 'step': 'Non_step'}
-      enviar(telefono, 'Non_step')
+    # Enviar la respuesta al usuario si no salio antes (p. ej. un mensaje de error)
+    if not enviadas:
+        enviar(telefono, respuesta_chatbot, numero)
 
-    else:
-      df.loc[len(df),:] = {'telefono':telefono , 'mensaje': mensaje, 'fecha': timestamp, 'step': steps[(steps.index(list(df['step'][df['telefono'] == telefono][-1:])[0]) + 1)]}
-      enviar(telefono, list(df['step'][df['telefono'] == telefono][-1:])[0])
-    #RETORNAMOS EL STATUS EN UN JSON
-    return str(respuesta_chatbot)
+    # Registramos el mensaje en la sesion del telefono y avanzamos su step
+    nuevo_step = avanzar_sesion(telefono, mensaje, timestamp)
+    enviar(telefono, nuevo_step, numero)
+
+def avanzar_sesion(telefono, mensaje, timestamp):
+    # Avanza el step de la sesion del telefono y lo devuelve; leer y escribir el step bajo el candado del telefono
+    with candados_telefono.bloquear(telefono):
+      ultimo_step = sesiones.obtener_step(telefono)
+      if ultimo_step is None or ultimo_step == 'final':
+        nuevo_step = 'Non_step'
+      else:
+        nuevo_step = steps[steps.index(ultimo_step) + 1]
+      sesiones.registrar(telefono, mensaje, timestamp, nuevo_step)
+    return nuevo_step
+
+cola = ColaMensajes(procesar_mensaje)
+metricas.registrar_fuente("cola", cola.metricas)
+metricas.registrar_fuente("deduplicacion", lambda: deduplicador.obtener().estadisticas() if deduplicador.creado() else {})
+
+@app.route("/metrics", methods=["GET"])
+def exportar_metricas():
+    #HISTOGRAMAS POR ETAPA Y CONTADORES DE CADA COMPONENTE EN FORMATO PROMETHEUS
+    return Response(metricas.exportar(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/cola/", methods=["GET"])
+def metricas_cola():
+    return jsonify({**cola.metricas(), 'deduplicacion': deduplicador.obtener().estadisticas(),
+                    'candados': candados_telefono.estadisticas()})
 
 @app.route("/recibir/", methods=["POST", "GET"])
 def recibir():
-    
-    return str(list(df.values))
+    #PAGINAMOS LAS SESIONES ACTIVAS EN LUGAR DE DEVOLVER TODO EL HISTORIAL
+    pagina = max(request.args.get('pagina', 1, type=int), 1)
+    por_pagina = min(max(request.args.get('por_pagina', 50, type=int), 1), 500)
+    mensajes, total = sesiones.listar((pagina - 1) * por_pagina, por_pagina)
+    return jsonify({'pagina': pagina, 'por_pagina': por_pagina, 'total_sesiones': total, 'mensajes': mensajes})
+
+@app.route("/exportar/<tabla>", methods=["GET"])
+def exportar(tabla):
+    #EXPORTAMOS message_log, clientes O recordatorios EN STREAMING (NDJSON O CSV), SOLO CON EXPORT_TOKEN
+    autorizacion = request.headers.get('Authorization', '')
+    if not EXPORTAR_TOKEN or not hmac.compare_digest(autorizacion.encode(), f"Bearer {EXPORTAR_TOKEN}".encode()):
+        return jsonify({'error': 'No autorizado'}), 403
+    try:
+        exportacion = Exportacion.desde_argumentos(tabla, request.args)
+    except FiltroInvalido as e:
+        return jsonify({'error': str(e)}), 400
+    if not exportaciones_en_curso.acquire(blocking=False):
+        return jsonify({'error': 'Hay demasiadas exportaciones en curso'}), 503
+    respuesta = Response(stream_with_context(exportacion.exportar(crear_conexion)), content_type=exportacion.tipo_contenido)
+    respuesta.call_on_close(exportaciones_en_curso.release)
+    return respuesta
 #INICIAMSO FLASK
 if __name__ == "__main__":
   app.run(debug=True)
@@ -0,0 +1,200 @@
+"""
+Punto de entrada ASGI con la ruta asyncio de /webhook/ y /enviar/.
+Cada mensaje se procesa en una tarea del event loop (aiomysql, ainvoke y
+httpx), asi un solo proceso mantiene cientos de conversaciones en vuelo.
+Las demas rutas se delegan a la app Flask.
+
+Uso:
+    uvicorn asgi:aplicacion --workers 2
+"""
+
+import asyncio
+import json
+import logging
+import os
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import app, avanzar_sesion, candados_telefono, deduplicador, encolar_turnos, remitentes
+from chatbot_script import cerrar_pool_async, interactuar_async
+from cliente_whatsapp import WhatsAppError
+from eventos_webhook import leer_entrega, trae_mensajes
+import instrumentacion
+
+logger = logging.getLogger(__name__)
+
+ASYNC_MAX_CONVERSACIONES = int(os.environ.get("ASYNC_MAX_CONVERSATIONS", "500"))
+VERIFY_TOKEN = "takataka"
+
+aplicacion_flask = WsgiToAsgi(app)
+
+
+class ProcesadorAsync:
+    """Procesa mensajes como tareas; en orden por telefono y con un tope de conversaciones en vuelo"""
+
+    def __init__(self, max_conversaciones=ASYNC_MAX_CONVERSACIONES):
+        self.max_conversaciones = max_conversaciones
+        # telefono -> [lock, tareas que lo tienen o lo esperan]
+        self._locks = {}
+        self._tareas = set()
+        self.procesados = 0
+        self.errores = 0
+        self.rechazados = 0
+
+    def encolar(self, telefono, mensaje, timestamp, numero=None):
+        """Programa el mensaje; devuelve False si ya hay demasiadas conversaciones en vuelo"""
+        if len(self._tareas) >= self.max_conversaciones:
+            self.rechazados += 1
+            return False
+        tarea = asyncio.create_task(self._procesar(telefono, mensaje, timestamp, numero))
+        self._tareas.add(tarea)
+        tarea.add_done_callback(self._tareas.discard)
+        return True
+
+    async def _procesar(self, telefono, mensaje, timestamp, numero):
+        # locked() sigue en False hasta que corre la tarea despertada: se cuenta quién lo espera
+        entrada = self._locks.setdefault(telefono, [asyncio.Lock(), 0])
+        entrada[1] += 1
+        lock = entrada[0]
+        try:
+            async with lock:
+                enviadas = []
+
+                async def responder(texto):
+                    enviadas.append(texto)
+                    await self.enviar(telefono, texto, numero)
+
+                respuesta_chatbot = await interactuar_async(mensaje, telefono, al_responder=responder)
+                if not enviadas:
+                    await self.enviar(telefono, respuesta_chatbot, numero)
+                nuevo_step = await asyncio.to_thread(avanzar_sesion, telefono, mensaje, timestamp)
+                await self.enviar(telefono, nuevo_step, numero)
+            self.procesados += 1
+        except Exception as e:
+            self.errores += 1
+            logger.error("Error al procesar el mensaje de %s: %s", telefono, e)
+        finally:
+            entrada[1] -= 1
+            if not entrada[1]:
+                del self._locks[telefono]
+
+    async def enviar(self, telefono, mensaje, numero=None):
+        """Envia un mensaje por el número del cliente; devuelve False si la Graph API lo rechaza"""
+        try:
+            with instrumentacion.metricas.medir("enviar"):
+                await remitentes.enviar_texto_async(telefono, mensaje, numero)
+        except WhatsAppError as e:
+            logger.error("Error al enviar el mensaje: %s %s", e.status_code, e.texto)
+            return False
+        return True
+
+    def metricas(self):
+        """Devuelve tareas en vuelo, procesadas, errores y rechazadas"""
+        return {
+            "en_vuelo": len(self._tareas),
+            "procesados": self.procesados,
+            "errores": self.errores,
+            "rechazados": self.rechazados,
+        }
+
+    async def detener(self):
+        """Espera las tareas pendientes y cierra los clientes HTTP y el pool aiomysql"""
+        if self._tareas:
+            await asyncio.gather(*self._tareas, return_exceptions=True)
+        await remitentes.cerrar_async()
+        await cerrar_pool_async()
+
+
+procesador = ProcesadorAsync()
+instrumentacion.metricas.registrar_fuente("async", procesador.metricas)
+
+
+async def responder(send, estado, cuerpo, tipo="application/json"):
+    if isinstance(cuerpo, (dict, list)):
+        cuerpo = json.dumps(cuerpo)
+    cuerpo = cuerpo.encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": estado,
+        "headers": [(b"content-type", tipo.encode()), (b"content-length", str(len(cuerpo)).encode())],
+    })
+    await send({"type": "http.response.body", "body": cuerpo})
+
+
+async def leer_cuerpo(receive):
+    partes = []
+    while True:
+        evento = await receive()
+        partes.append(evento.get("body", b""))
+        if not evento.get("more_body"):
+            return b"".join(partes)
+
+
+async def webhook_whatsapp(scope, receive, send):
+    if scope["method"] == "GET":
+        argumentos = parse_qs(scope["query_string"].decode())
+        if argumentos.get("hub.verify_token", [None])[0] == VERIFY_TOKEN:
+            return await responder(send, 200, argumentos.get("hub.challenge", [""])[0], "text/html")
+        return await responder(send, 200, "Error de autentificacion.", "text/html")
+    cuerpo = await leer_cuerpo(receive)
+    if not trae_mensajes(cuerpo):
+        return await responder(send, 200, {"status": "ignorado"})
+    try:
+        data = json.loads(cuerpo)
+    except ValueError:
+        data = None
+    entrega = leer_entrega(data, deduplicador.obtener().registrar)
+    if not entrega.turnos:
+        return await responder(send, 200, {"status": "ignorado", "estados": entrega.estados, "duplicados": entrega.duplicados})
+    # Respondemos a Meta de inmediato; cada teléfono se procesa en su propia tarea
+    rechazados = encolar_turnos(procesador.encolar, entrega)
+    if rechazados:
+        return await responder(send, 503, {"status": "ocupado", "rechazados": rechazados})
+    return await responder(send, 200, {"status": "recibido", "mensajes": entrega.mensajes, "turnos": len(entrega.turnos)})
+
+
+async def enviar(scope, receive, send):
+    argumentos = parse_qs(scope["query_string"].decode())
+    telefono = argumentos.get("phone", [None])[0]
+    mensaje = argumentos.get("message", [None])[0]
+    if not telefono or not mensaje:
+        return await responder(send, 400, "Faltan phone y message.", "text/html")
+    if not await procesador.enviar(telefono, mensaje):
+        return await responder(send, 502, "Error al enviar el mensaje.", "text/html")
+    return await responder(send, 200, "Mensaje enviado exitosamente. osi osi", "text/html")
+
+
+async def metricas(scope, receive, send):
+    return await responder(send, 200, {**procesador.metricas(), "deduplicacion": deduplicador.obtener().estadisticas(),
+                                       "candados": candados_telefono.estadisticas()})
+
+
+RUTAS = {
+    ("/webhook/", "GET"): webhook_whatsapp,
+    ("/webhook/", "POST"): webhook_whatsapp,
+    ("/enviar/", "GET"): enviar,
+    ("/enviar/", "POST"): enviar,
+    ("/async/", "GET"): metricas,
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        evento = await receive()
+        if evento["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif evento["type"] == "lifespan.shutdown":
+            await procesador.detener()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def aplicacion(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] == "http":
+        ruta = RUTAS.get((scope["path"], scope["method"]))
+        if ruta is not None:
+            return await ruta(scope, receive, send)
+    return await aplicacion_flask(scope, receive, send)
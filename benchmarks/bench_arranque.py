@@ -0,0 +1,56 @@
+"""
+Mide el costo de importar la app en un proceso nuevo (lo que paga cada worker
+de gunicorn y cada arranque en frío) y lista los módulos que más tardan.
+
+Uso:
+    python benchmarks/bench_arranque.py --modulo app --repeticiones 10
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CODIGO = "import time; t = time.perf_counter(); import {modulo}; print(time.perf_counter() - t)"
+
+
+def medir(modulo):
+    salida = subprocess.run(
+        [sys.executable, "-c", CODIGO.format(modulo=modulo)],
+        cwd=RAIZ, capture_output=True, text=True, check=True
+    )
+    return float(salida.stdout.strip().splitlines()[-1])
+
+
+def modulos_mas_lentos(modulo, cantidad):
+    salida = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+        cwd=RAIZ, capture_output=True, text=True, check=True
+    )
+    tiempos = []
+    for linea in salida.stderr.splitlines():
+        if not linea.startswith("import time:") or "cumulative" in linea:
+            continue
+        _, acumulado, nombre = linea[len("import time:"):].split("|")
+        # Solo paquetes de primer nivel, para no contar dos veces los submódulos
+        if not nombre.startswith("  ") or nombre.startswith("   "):
+            tiempos.append((int(acumulado), nombre.strip()))
+    return sorted(tiempos, reverse=True)[:cantidad]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modulo", default="app")
+    parser.add_argument("--repeticiones", type=int, default=10)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    tiempos = [medir(args.modulo) for _ in range(args.repeticiones)]
+    print(f"import {args.modulo}: mediana {statistics.median(tiempos) * 1000:.1f} ms, "
+          f"mínimo {min(tiempos) * 1000:.1f} ms ({args.repeticiones} procesos)")
+    print("\nMódulos más lentos (acumulado):")
+    for acumulado, nombre in modulos_mas_lentos(args.modulo, args.top):
+        print(f"{acumulado / 1000:10.1f} ms  {nombre}")
@@ -0,0 +1,194 @@
+"""
+Prueba de carga de extremo a extremo sin servicios externos. Usuarios
+sintéticos conversan en paralelo con /webhook/ (un hilo por usuario, cada uno
+espera la respuesta antes de escribir de nuevo); Gemini se reemplaza por
+fake_llm.py, la Graph API por fake_graph_api.py y MySQL por fake_mysql.py.
+
+Reporta mensajes por segundo, latencia p50/p95/p99 del webhook y hasta que la
+respuesta llega al usuario, consultas a la base de datos por mensaje y
+llamadas al LLM por mensaje, y el desglose por etapa y de tokens por llamada.
+Con --numeros los usuarios escriben a varios numeros de WhatsApp y se reporta
+cuantas respuestas salieron por cada uno; --mps-graph imita el limite de
+throughput por numero de la Graph API.
+
+Uso:
+    python benchmarks/bench_carga.py --usuarios 50 --turnos 6 --latencia-llm 0.3 --tasa-429 0.05
+    python benchmarks/bench_carga.py --usuarios 200 --numeros 4 --mps-numero 20 --mps-graph 20
+    FAST_PATH=0 LLM_CACHE=0 python benchmarks/bench_carga.py   # todo pasa por el LLM
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_graph_api import FakeGraphAPI
+from fake_llm import LLMFalso
+from fake_mysql import MySQLFalso
+
+CONVERSACION = [
+    "Hola",
+    "Sí, me gustaría",
+    "Cada dos meses",
+    "Se llama Firulais",
+    "Le gusta el Royal Canin de cordero",
+    "Es un golden retriever",
+    "Muchas gracias",
+]
+
+
+def payload(telefono, texto, id_mensaje, numero="1"):
+    """Entrega del webhook con un mensaje de texto al número numero, como la envía Meta"""
+    return json.dumps({
+        "object": "whatsapp_business_account",
+        "entry": [{"id": "1", "changes": [{"field": "messages", "value": {
+            "messaging_product": "whatsapp",
+            "metadata": {"display_phone_number": "15550000000", "phone_number_id": numero},
+            "contacts": [{"profile": {"name": "Bench"}, "wa_id": telefono}],
+            "messages": [{"from": telefono, "id": id_mensaje, "timestamp": str(int(time.time())),
+                          "type": "text", "text": {"body": texto}}],
+        }}]}],
+    })
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def numeros(args):
+    return [str(i + 1) for i in range(args.numeros)]
+
+
+def configurar_entorno(args, directorio, url_graph):
+    # Los módulos leen su configuración al importarse: el entorno se fija antes de importar app
+    os.environ.update({
+        "GRAPH_API_URL": url_graph,
+        "ACCESS_TOKEN": "bench",
+        "WHATSAPP_NUMBERS": ",".join(numeros(args)),
+        "WHATSAPP_NUMBER_MPS": str(args.mps_numero),
+        "SESSION_BACKEND": "memory",
+        "WEBHOOK_WORKERS": str(args.workers),
+        "WEBHOOK_DEDUP_PATH": os.path.join(directorio, "deduplicacion.db"),
+        "LLM_CACHE_PATH": os.path.join(directorio, "cache_respuestas.db"),
+        "PHONE_LOCK_PATH": os.path.join(directorio, "candados.lock"),
+        "LLM_RPM": str(args.rpm),
+        "LLM_MAX_CONCURRENCY": str(args.concurrencia_llm),
+        "LOG_LEVEL": "CRITICAL",
+    })
+
+
+def ejecutar(args):
+    with tempfile.TemporaryDirectory() as directorio:
+        graph = FakeGraphAPI(latencia=args.latencia_graph, mps_por_numero=args.mps_graph)
+        configurar_entorno(args, directorio, graph.iniciar())
+
+        import app as modulo_app
+        import chatbot_script
+        from instrumentacion import metricas
+        from memorias import MemoriasPorCliente
+        from perezoso import Perezoso
+        from pool_db import PoolConexiones
+
+        db = MySQLFalso(os.path.join(directorio, "mysql.db"), latencia=args.latencia_db)
+        llm = LLMFalso(latencia=args.latencia_llm, tasa_429=args.tasa_429, semilla=args.semilla)
+        chatbot_script._pool = Perezoso(lambda: PoolConexiones(db.conectar, max_size=args.pool))
+        chatbot_script.memorias = MemoriasPorCliente(llm.crear_conversacion)
+
+        turnos = CONVERSACION[:args.turnos]
+        webhook, respuesta, perdidos = [], [], []
+        lock = threading.Lock()
+
+        def usuario(indice):
+            cliente = modulo_app.app.test_client()
+            telefono = f"58414{indice:07d}"
+            numero = numeros(args)[indice % args.numeros]
+            esperados = 0
+            for turno, texto in enumerate(turnos):
+                cuerpo = payload(telefono, texto, f"wamid.bench.{indice}.{turno}", numero)
+                inicio = time.perf_counter()
+                estado = cliente.post("/webhook/", data=cuerpo, content_type="application/json").status_code
+                ack = time.perf_counter() - inicio
+                if estado != 200:
+                    with lock:
+                        perdidos.append(estado)
+                    continue
+                # Cada turno envía la respuesta del chatbot y luego el step de la sesión
+                esperados += 2
+                llego = graph.esperar_mensajes(telefono, esperados - 1, args.timeout)
+                fin = time.perf_counter() - inicio
+                graph.esperar_mensajes(telefono, esperados, args.timeout)
+                with lock:
+                    webhook.append(ack)
+                    if llego:
+                        respuesta.append(fin)
+                    else:
+                        perdidos.append("timeout")
+                if args.pausa:
+                    time.sleep(args.pausa)
+
+        hilos = [threading.Thread(target=usuario, args=(i,)) for i in range(args.usuarios)]
+        inicio = time.perf_counter()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        duracion = time.perf_counter() - inicio
+        modulo_app.cola.detener()
+        graph.detener()
+
+        mensajes = len(webhook)
+        print(f"usuarios {args.usuarios}, turnos {len(turnos)}, workers {args.workers}, "
+              f"LLM {args.latencia_llm * 1000:.0f} ms / 429 {args.tasa_429:.0%}, "
+              f"Graph {args.latencia_graph * 1000:.0f} ms, DB {args.latencia_db * 1000:.1f} ms")
+        print(f"mensajes           {mensajes} en {duracion:.2f} s = {mensajes / duracion:.1f} msg/s"
+              f" ({len(perdidos)} sin respuesta)")
+        for nombre, valores in (("webhook (ack)", webhook), ("respuesta", respuesta)):
+            print(f"{nombre:<18} p50 {percentil(valores, 50) * 1000:8.1f} ms"
+                  f"   p95 {percentil(valores, 95) * 1000:8.1f} ms"
+                  f"   p99 {percentil(valores, 99) * 1000:8.1f} ms")
+        if mensajes:
+            detalle = ", ".join(f"{tipo} {n / mensajes:.2f}" for tipo, n in sorted(db.consultas.items()))
+            print(f"consultas DB/msg   {db.total_consultas() / mensajes:.2f} ({detalle})")
+            print(f"llamadas LLM/msg   {llm.llamadas / mensajes:.2f} ({llm.errores_429} con 429,"
+                  f" {chatbot_script.ruta_rapida.llm_evitadas} por ruta rápida)")
+        print(f"conexiones DB      {db.conexiones}, cola: desbalance {modulo_app.cola.metricas()['desbalance']:.2f}")
+        print(f"Graph API          {graph.errores_429} con 429")
+        for numero, valores in modulo_app.remitentes.metricas()["numeros"].items():
+            print(f"  número {numero:<10} {graph.por_numero[numero]:6d} enviados, {valores['errores']} errores,"
+                  f" {valores['esperas']} esperaron turno ({valores['espera_total_s']:.1f} s)")
+        print()
+        for etapa, valores in metricas.resumen().items():
+            print(f"{etapa:<18} {valores['cuenta']:6d} x {valores['promedio_s'] * 1000:8.2f} ms")
+        for tipo, valores in metricas.resumen_tokens().items():
+            print(f"tokens {tipo:<11} {valores['cuenta']:6d} x {valores['promedio']:8.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--usuarios", type=int, default=50)
+    parser.add_argument("--turnos", type=int, default=len(CONVERSACION), help=f"mensajes por usuario (máx. {len(CONVERSACION)})")
+    parser.add_argument("--pausa", type=float, default=0.0, help="segundos que espera el usuario antes de responder")
+    parser.add_argument("--workers", type=int, default=4, help="hilos de la cola del webhook")
+    parser.add_argument("--pool", type=int, default=10, help="conexiones máximas del pool")
+    parser.add_argument("--latencia-llm", type=float, default=0.3)
+    parser.add_argument("--tasa-429", type=float, default=0.0)
+    parser.add_argument("--rpm", type=float, default=6000, help="cuota del planificador del LLM")
+    parser.add_argument("--concurrencia-llm", type=int, default=8)
+    parser.add_argument("--latencia-graph", type=float, default=0.05)
+    parser.add_argument("--numeros", type=int, default=1, help="números de WhatsApp entre los que se reparten los usuarios")
+    parser.add_argument("--mps-numero", type=float, default=0, help="mensajes por segundo por número del limitador (0 = sin límite)")
+    parser.add_argument("--mps-graph", type=float, default=0, help="mensajes por segundo que la Graph API falsa acepta por número")
+    parser.add_argument("--latencia-db", type=float, default=0.001)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--semilla", type=int, default=1)
+    ejecutar(parser.parse_args())
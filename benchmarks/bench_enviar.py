@@ -0,0 +1,60 @@
+"""
+Compara el envio con requests.post por mensaje (enviar() original) contra
+WhatsAppClient con sesion persistente y envio concurrente, usando la Graph API falsa.
+
+Uso:
+    python benchmarks/bench_enviar.py --mensajes 500 --latencia 0.01
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cliente_whatsapp import WhatsAppClient
+from fake_graph_api import FakeGraphAPI
+
+
+def enviar_sin_pool(url, telefono, mensaje):
+    # Reproduce el enviar() original: encabezados y conexion nuevos en cada mensaje
+    headers = {
+        'Authorization': f'Bearer {os.environ.get("ACCESS_TOKEN", "bench")}',
+        'Content-Type': 'application/json'
+    }
+    payload = {"messaging_product": "whatsapp", "recipient_type": "individual", "to": telefono,
+               "type": "text", "text": {"preview_url": True, "body": mensaje}}
+    return requests.post(url, headers=headers, data=json.dumps(payload))
+
+
+def medir(nombre, funcion, n):
+    inicio = time.perf_counter()
+    funcion()
+    duracion = time.perf_counter() - inicio
+    print(f"{nombre:<28} {duracion:8.3f} s  {n / duracion:10.1f} msg/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mensajes", type=int, default=500)
+    parser.add_argument("--latencia", type=float, default=0.0)
+    args = parser.parse_args()
+
+    fake = FakeGraphAPI(latencia=args.latencia)
+    base_url = fake.iniciar()
+    cliente = WhatsAppClient(access_token="bench", base_url=base_url)
+    mensajes = [(f"58424{i:07d}", f"Mensaje {i}") for i in range(args.mensajes)]
+
+    medir("requests.post por mensaje", lambda: [enviar_sin_pool(cliente.url, t, m) for t, m in mensajes], args.mensajes)
+    conexiones = fake.conexiones
+    medir("WhatsAppClient secuencial", lambda: [cliente.enviar_texto(t, m) for t, m in mensajes], args.mensajes)
+    print(f"{'':<28} conexiones abiertas: {fake.conexiones - conexiones}")
+    medir("WhatsAppClient enviar_lote", lambda: cliente.enviar_lote(mensajes), args.mensajes)
+
+    cliente.cerrar()
+    fake.detener()
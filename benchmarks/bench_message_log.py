@@ -0,0 +1,163 @@
+"""
+Consulta de historial sobre un message_log grande, antes y después de
+particionarlo por mes y archivar los meses fuera de la retención (retencion.py).
+
+A diferencia de bench_carga.py necesita un MySQL 8 real: particiones,
+information_schema y el optimizador no se pueden imitar con SQLite. Usa la
+conexión de chatbot_script (HOST, USER, PASSWORD, PORT_DATABASE) pero en una
+base propia (--base), que se crea si no existe; las tablas de esa base se
+borran al cargar.
+
+Reporta el tamaño de message_log y la latencia p50/p95/p99 de la consulta del
+camino caliente (SQL_CLIENTE_E_HISTORIAL) para teléfonos al azar, los mismos
+antes y después, y cuánto tardan particionar y archivar.
+
+Uso:
+    python benchmarks/bench_message_log.py --filas 10000000 --meses 24 --dias 180
+    python benchmarks/bench_message_log.py --reusar     # sin volver a cargar las filas
+"""
+
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import pymysql
+
+from chatbot_script import SQL_CLIENTE_E_HISTORIAL
+from historial import HISTORIAL_MAX_MENSAJES
+from migraciones import migrar
+from pool_db import PoolConexiones
+from retencion import RetencionMessageLog
+
+LOTE_CARGA = 10000
+
+
+def conectar(base=None):
+    return pymysql.connect(
+        host=os.environ.get("HOST"),
+        user=os.environ.get("USER"),
+        port=int(os.environ.get("PORT_DATABASE", "3306")),
+        password=os.environ.get("PASSWORD"),
+        database=base,
+        cursorclass=pymysql.cursors.DictCursor
+    )
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def telefono(indice):
+    return f"58414{indice:07d}"
+
+
+def cargar(pool, args):
+    """Borra las tablas de la base del benchmark, aplica el esquema y genera --filas mensajes en los últimos --meses"""
+    with pool.conexion() as conn, conn.cursor() as cursor:
+        for tabla in ("message_log", "message_log_archivo", "clientes", "recordatorios"):
+            cursor.execute(f"DROP TABLE IF EXISTS {tabla}")
+    migrar(pool)
+
+    azar = random.Random(args.semilla)
+    ahora = datetime.datetime.now()
+    segundos = args.meses * 30 * 86400
+    inicio = time.perf_counter()
+    with pool.conexion() as conn:
+        with conn.cursor() as cursor:
+            clientes = [(telefono(i), "Bench", 0) for i in range(args.telefonos)]
+            for i in range(0, len(clientes), LOTE_CARGA):
+                cursor.executemany("INSERT INTO clientes (whatsapp, nombre, step) VALUES (%s, %s, %s)",
+                                   clientes[i:i + LOTE_CARGA])
+            conn.commit()
+            for cargadas in range(0, args.filas, LOTE_CARGA):
+                filas = []
+                for _ in range(min(LOTE_CARGA, args.filas - cargadas)):
+                    fecha = ahora - datetime.timedelta(seconds=azar.randrange(segundos))
+                    direccion = "inbound" if azar.random() < 0.5 else "outbound"
+                    filas.append((telefono(azar.randrange(args.telefonos)), fecha.strftime("%Y-%m-%d %H:%M:%S"),
+                                  "x" * azar.randrange(20, 160), direccion, "SRR", str(azar.randrange(7))))
+                cursor.executemany(
+                    "INSERT INTO message_log (telefono_cliente, fecha_mensaje, mensaje, message_direction, servicio, step) "
+                    "VALUES (%s, %s, %s, %s, %s, %s)",
+                    filas
+                )
+                conn.commit()
+                if (cargadas // LOTE_CARGA) % 100 == 0:
+                    print(f"  {cargadas + len(filas):>10} filas ({time.perf_counter() - inicio:.0f} s)", flush=True)
+    print(f"carga              {args.filas} filas en {time.perf_counter() - inicio:.0f} s")
+
+
+def medir(pool, args, etiqueta):
+    """Tamaño de message_log y latencia de la consulta de historial para los mismos teléfonos al azar"""
+    with pool.conexion() as conn, conn.cursor() as cursor:
+        cursor.execute("ANALYZE TABLE message_log")
+        cursor.fetchall()
+        cursor.execute(
+            "SELECT table_rows AS filas, (data_length + index_length) / 1048576 AS mb FROM information_schema.tables "
+            "WHERE table_schema = DATABASE() AND table_name = 'message_log'"
+        )
+        tabla = cursor.fetchone()
+
+    azar = random.Random(args.semilla)
+    telefonos = [telefono(azar.randrange(args.telefonos)) for _ in range(args.calentamiento + args.consultas)]
+    latencias = []
+    with pool.conexion() as conn, conn.cursor() as cursor:
+        for numero, whatsapp in enumerate(telefonos):
+            inicio = time.perf_counter()
+            cursor.execute(SQL_CLIENTE_E_HISTORIAL, (whatsapp, HISTORIAL_MAX_MENSAJES))
+            cursor.fetchall()
+            if numero >= args.calentamiento:
+                latencias.append(time.perf_counter() - inicio)
+    print(f"{etiqueta:<18} ~{int(tabla['filas'])} filas, {float(tabla['mb']):.0f} MB;"
+          f" historial p50 {percentil(latencias, 50) * 1000:.2f} ms"
+          f"   p95 {percentil(latencias, 95) * 1000:.2f} ms"
+          f"   p99 {percentil(latencias, 99) * 1000:.2f} ms")
+
+
+def ejecutar(args):
+    conn = conectar()
+    with conn.cursor() as cursor:
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS {args.base}")
+    conn.close()
+    pool = PoolConexiones(lambda: conectar(args.base), max_size=2, timeout=3600)
+
+    if not args.reusar:
+        cargar(pool, args)
+    medir(pool, args, "antes")
+
+    retencion = RetencionMessageLog(pool, lambda: conectar(args.base), dias=args.dias, destino=args.destino,
+                                    directorio=args.directorio)
+    inicio = time.perf_counter()
+    retencion.particionar()
+    print(f"particionar        {time.perf_counter() - inicio:.1f} s")
+    inicio = time.perf_counter()
+    resumen = retencion.mantener()
+    print(f"archivar           {time.perf_counter() - inicio:.1f} s, {len(resumen['archivadas'])} particiones,"
+          f" {retencion.filas_archivadas} filas a {args.destino}")
+    medir(pool, args, "después")
+    pool.cerrar()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base", default="bench_message_log", help="base de datos del benchmark (se borran sus tablas)")
+    parser.add_argument("--filas", type=int, default=10_000_000)
+    parser.add_argument("--telefonos", type=int, default=200_000)
+    parser.add_argument("--meses", type=int, default=24, help="antigüedad máxima de los mensajes generados")
+    parser.add_argument("--dias", type=int, default=180, help="retención de message_log")
+    parser.add_argument("--destino", choices=["tabla", "archivos"], default="tabla")
+    parser.add_argument("--directorio", default="archivo_message_log")
+    parser.add_argument("--consultas", type=int, default=2000)
+    parser.add_argument("--calentamiento", type=int, default=200)
+    parser.add_argument("--reusar", action="store_true", help="usa las filas ya cargadas en --base")
+    parser.add_argument("--semilla", type=int, default=1)
+    ejecutar(parser.parse_args())
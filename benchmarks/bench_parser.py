@@ -0,0 +1,68 @@
+"""
+Verifica parsear_respuesta() contra un corpus de respuestas reales del modelo
+(bien formadas y malformadas) y compara su velocidad con el .replace() + eval() original.
+
+Uso:
+    python benchmarks/bench_parser.py --repeticiones 20000
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from parser_respuesta import RespuestaInvalida, parsear_respuesta
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "respuestas_modelo.json")
+
+
+def parser_original(respuesta_raw):
+    # Copia del código que había en interactuar() antes del parser
+    respuesta_limpia = respuesta_raw.strip().replace("json", "", 1).replace("```", "").replace("\n", " ").replace("\r", " ").replace('   ', '').replace(" ", "", 1).replace("python", "", 1)
+    return eval(respuesta_limpia)
+
+
+def verificar(corpus):
+    fallos = 0
+    for caso in corpus:
+        try:
+            obtenido = parsear_respuesta(caso["texto"]).a_dict()
+        except RespuestaInvalida:
+            obtenido = None
+        if obtenido != caso["esperado"]:
+            fallos += 1
+            print(f"[ERROR] {caso['texto'][:60]!r}: esperado {caso['esperado']}, obtenido {obtenido}")
+    print(f"[INFO] Corpus: {len(corpus) - fallos}/{len(corpus)} casos correctos")
+    return fallos
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeticiones", type=int, default=20000)
+    args = parser.parse_args()
+
+    with open(CORPUS, encoding="utf-8") as archivo:
+        corpus = json.load(archivo)
+    fallos = verificar(corpus)
+
+    validos = [caso["texto"] for caso in corpus if caso["esperado"] is not None]
+    originales = [texto for texto in validos if "__import__" not in texto]
+    compatibles = []
+    for texto in originales:
+        try:
+            parser_original(texto)
+            compatibles.append(texto)
+        except Exception:
+            pass
+    print(f"[INFO] El parser original solo interpreta {len(compatibles)}/{len(validos)} respuestas válidas")
+
+    for nombre, funcion in (("replace + eval", parser_original), ("parsear_respuesta", parsear_respuesta)):
+        duracion = timeit.timeit(lambda: [funcion(texto) for texto in compatibles], number=args.repeticiones // 10)
+        por_llamada = duracion / (args.repeticiones // 10 * len(compatibles)) * 1e6
+        print(f"{nombre:<20} {por_llamada:8.2f} µs/respuesta")
+
+    sys.exit(1 if fallos else 0)
@@ -0,0 +1,105 @@
+"""
+Reproduce entregas grabadas del webhook (benchmarks/payloads/*.json) contra la
+app Flask. Mide el costo de /webhook/ por entrega, nueva y reentregada por Meta
+(descartada por id), y compara cuántos turnos del LLM y cuánto tiempo hacen
+falta procesando un turno por mensaje contra un turno por teléfono. El turno
+del chatbot se simula con una espera de --latencia-llm.
+
+Uso:
+    python benchmarks/bench_webhook.py --repeticiones 200 --latencia-llm 0.05
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import app as modulo_app
+from cola_mensajes import ColaMensajes
+from deduplicacion import Deduplicador
+from perezoso import Perezoso
+from eventos_webhook import leer_entrega
+
+PAYLOADS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "payloads")
+
+
+def cargar_payloads():
+    payloads = {}
+    for ruta in sorted(glob.glob(os.path.join(PAYLOADS, "*.json"))):
+        with open(ruta, "rb") as archivo:
+            payloads[os.path.splitext(os.path.basename(ruta))[0]] = archivo.read()
+    return payloads
+
+
+def extraccion_original(data):
+    # Copia de lo que hacía webhook_whatsapp() antes: solo el primer mensaje
+    mensaje_whatsapp = data['entry'][0]['changes'][0]['value']['messages'][0]
+    return mensaje_whatsapp['from'], mensaje_whatsapp['text']['body'], mensaje_whatsapp['timestamp']
+
+
+def medir_post(cliente, cuerpo, repeticiones):
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        cliente.post("/webhook/", data=cuerpo, content_type="application/json")
+    return (time.perf_counter() - inicio) / repeticiones * 1e6
+
+
+def medir_handler(cliente, payloads, repeticiones):
+    print(f"{'entrega':<24}{'mensajes':>9}{'turnos':>8}{'estados':>9}{'original':>12}{'µs nueva':>11}{'µs reintento':>14}")
+    for nombre, cuerpo in payloads.items():
+        data = json.loads(cuerpo)
+        entrega = leer_entrega(data)
+        try:
+            extraccion_original(data)
+            original = "1 mensaje"
+        except (KeyError, IndexError, TypeError):
+            original = "KeyError"
+        # TTL 0: cada entrega cuenta como nueva
+        modulo_app.deduplicador = Perezoso(lambda: Deduplicador(ttl=0, ruta=None))
+        nueva = medir_post(cliente, cuerpo, repeticiones)
+        modulo_app.deduplicador = Perezoso(lambda: Deduplicador(ruta=None))
+        reintento = medir_post(cliente, cuerpo, repeticiones)
+        print(f"{nombre:<24}{entrega.mensajes:>9}{len(entrega.turnos):>8}{entrega.estados:>9}{original:>12}{nueva:>11.1f}{reintento:>14.1f}")
+
+
+def medir_procesamiento(payloads, latencia, agrupar):
+    turnos = []
+
+    def procesar(telefono, mensaje, timestamp):
+        turnos.append(telefono)
+        time.sleep(latencia)
+
+    cola = ColaMensajes(procesar)
+    inicio = time.perf_counter()
+    for cuerpo in payloads.values():
+        for turno in leer_entrega(json.loads(cuerpo)).turnos:
+            if agrupar:
+                cola.encolar(turno.telefono, turno.mensaje, turno.timestamp)
+            else:
+                for texto in turno.textos:
+                    cola.encolar(turno.telefono, texto, turno.timestamp)
+    cola.detener()
+    return len(turnos), time.perf_counter() - inicio
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeticiones", type=int, default=200)
+    parser.add_argument("--latencia-llm", type=float, default=0.05)
+    args = parser.parse_args()
+
+    payloads = cargar_payloads()
+    # Las entregas se encolan en una cola que no procesa nada: solo se mide el handler
+    modulo_app.cola = ColaMensajes(lambda *args: None)
+    medir_handler(modulo_app.app.test_client(), payloads, args.repeticiones)
+    modulo_app.cola.detener()
+
+    print()
+    for agrupar, nombre in ((False, "un turno por mensaje"), (True, "un turno por teléfono")):
+        turnos, duracion = medir_procesamiento(payloads, args.latencia_llm, agrupar)
+        print(f"{nombre:<24} {turnos:4d} turnos LLM en {duracion:6.2f} s")
@@ -0,0 +1,150 @@
+"""
+Servidor local que imita POST /{version}/{phone_number_id}/messages de la Graph API.
+Sirve para pruebas y benchmarks de envio sin tocar la API real de WhatsApp.
+Con mps_por_numero imita el limite de throughput de cada numero: lo que pase
+de esa tasa en el ultimo segundo recibe 429 (codigo 130429).
+
+Uso:
+    python benchmarks/fake_graph_api.py --port 8081 --latencia 0.05 --tasa-429 0.1
+    GRAPH_API_URL=http://127.0.0.1:8081 ACCESS_TOKEN=x python app.py
+"""
+
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Servidor(ThreadingHTTPServer):
+    # Backlog amplio: los clientes asyncio abren cientos de conexiones a la vez
+    request_queue_size = 1024
+
+
+class FakeGraphAPI:
+    """Graph API falsa en un hilo, con latencia y errores 429 configurables"""
+
+    def __init__(self, host="127.0.0.1", port=0, latencia=0.0, tasa_429=0.0, retry_after=None, mps_por_numero=0):
+        self.latencia = latencia
+        self.tasa_429 = tasa_429
+        self.retry_after = retry_after
+        self.mps_por_numero = mps_por_numero
+        self.por_numero = Counter()
+        self._recientes = {}
+        self.mensajes = []
+        self.conexiones = 0
+        self.peticiones = 0
+        self.errores_429 = 0
+        self.por_destinatario = Counter()
+        self._ids = itertools.count(1)
+        self._lock = threading.Condition()
+        self.servidor = _Servidor((host, port), self._crear_handler())
+        self.servidor.daemon_threads = True
+        self._hilo = None
+
+    @property
+    def url(self):
+        host, port = self.servidor.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _crear_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with fake._lock:
+                    fake.conexiones += 1
+
+            def do_POST(self):
+                cuerpo = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with fake._lock:
+                    fake.peticiones += 1
+                if fake.latencia:
+                    time.sleep(fake.latencia)
+                if not self.headers.get("Authorization", "").startswith("Bearer "):
+                    return self._responder(401, {"error": {"message": "Invalid OAuth access token"}})
+                numero = self.path.strip("/").split("/")[1]
+                if (fake.tasa_429 and random.random() < fake.tasa_429) or fake._excede_limite(numero):
+                    with fake._lock:
+                        fake.errores_429 += 1
+                    return self._responder(429, {"error": {"message": "Rate limit hit", "code": 130429}})
+                payload = json.loads(cuerpo or b"{}")
+                with fake._lock:
+                    fake.mensajes.append(payload)
+                    fake.por_destinatario[payload.get("to")] += 1
+                    fake.por_numero[numero] += 1
+                    fake._lock.notify_all()
+                    mensaje_id = f"wamid.fake{next(fake._ids)}"
+                return self._responder(200, {
+                    "messaging_product": "whatsapp",
+                    "contacts": [{"input": payload.get("to"), "wa_id": payload.get("to")}],
+                    "messages": [{"id": mensaje_id}]
+                })
+
+            def _responder(self, status, datos):
+                cuerpo = json.dumps(datos).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(cuerpo)))
+                if status == 429 and fake.retry_after is not None:
+                    self.send_header("Retry-After", str(fake.retry_after))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def _excede_limite(self, numero):
+        if not self.mps_por_numero:
+            return False
+        ahora = time.monotonic()
+        with self._lock:
+            recientes = self._recientes.setdefault(numero, deque())
+            while recientes and ahora - recientes[0] > 1.0:
+                recientes.popleft()
+            if len(recientes) >= self.mps_por_numero:
+                return True
+            recientes.append(ahora)
+            return False
+
+    def esperar_mensajes(self, telefono, cantidad, timeout=None):
+        """Espera hasta que el teléfono haya recibido `cantidad` mensajes; devuelve False si vence el timeout"""
+        with self._lock:
+            return self._lock.wait_for(lambda: self.por_destinatario[telefono] >= cantidad, timeout)
+
+    def iniciar(self):
+        """Arranca el servidor en segundo plano y devuelve su URL base"""
+        self._hilo = threading.Thread(target=self.servidor.serve_forever, daemon=True)
+        self._hilo.start()
+        return self.url
+
+    def detener(self):
+        """Detiene el servidor"""
+        self.servidor.shutdown()
+        self.servidor.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Graph API falsa para pruebas locales")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latencia", type=float, default=0.0, help="segundos de latencia por peticion")
+    parser.add_argument("--tasa-429", type=float, default=0.0, help="fraccion de peticiones que responden 429")
+    parser.add_argument("--retry-after", type=float, default=None)
+    parser.add_argument("--mps-por-numero", type=float, default=0, help="mensajes por segundo aceptados por numero (0 = sin limite)")
+    args = parser.parse_args()
+    fake = FakeGraphAPI(args.host, args.port, args.latencia, args.tasa_429, args.retry_after, args.mps_por_numero)
+    print(f"[INFO] Graph API falsa escuchando en {fake.url}")
+    try:
+        fake.servidor.serve_forever()
+    except KeyboardInterrupt:
+        fake.detener()
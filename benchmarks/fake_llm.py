@@ -0,0 +1,160 @@
+"""
+Modelo falso que imita la Conversacion de Gemini usada por chatbot_script.
+Responde en JSON siguiendo los pasos del flujo de recordatorios, con latencia
+configurable y una fraccion de llamadas que fallan con 429 como la API real.
+En streaming (llm.stream) la latencia se reparte entre los fragmentos.
+
+Uso (dentro de un benchmark):
+    llm = LLMFalso(latencia=0.3, tasa_429=0.05)
+    chatbot_script.memorias = MemoriasPorCliente(llm.crear_conversacion)
+"""
+
+import asyncio
+import json
+import random
+import threading
+import time
+
+RESPUESTAS = {
+    1: "¡Hola! Soy el asistente de la tienda de mascotas, ¿Le gustaría que le programemos un recordatorio para su próxima compra?",
+    2: "¡Perfecto! ¿En cuantas semanas le gustaria recibir un recordatorio de su proxima compra?",
+    3: "¡Genial! ¿Cuál es el nombre de su mascota?",
+    4: "¡Excelente! ¿Qué alimentos le gustan a su mascota?",
+    5: "¡Maravilloso! ¿Y cuál es la raza de su mascota?",
+    6: "¡Excelente! Le recordaré su próxima compra de alimento para su mascota.",
+}
+
+
+class ErrorCuota(Exception):
+    """Imita el error de google.api_core cuando Gemini responde 429"""
+
+    def __init__(self):
+        super().__init__("429 Resource has been exhausted (e.g. check quota).")
+
+
+class _Mensaje:
+    __slots__ = ("type", "content")
+
+    def __init__(self, type, content):
+        self.type = type
+        self.content = content
+
+
+class _ChatMemoria:
+    def __init__(self):
+        self.messages = []
+
+    def add_user_message(self, mensaje):
+        self.messages.append(_Mensaje("human", mensaje))
+
+    def add_ai_message(self, mensaje):
+        self.messages.append(_Mensaje("ai", mensaje))
+
+
+class _Memoria:
+    # Lo mínimo de ConversationBufferWindowMemory que usan Turno y crear_conversacion
+    def __init__(self):
+        self.chat_memory = _ChatMemoria()
+
+    def save_context(self, entradas, salidas):
+        self.chat_memory.add_user_message(entradas["input"])
+        self.chat_memory.add_ai_message(salidas["response"])
+
+
+class _Fragmento:
+    __slots__ = ("content",)
+
+    def __init__(self, content):
+        self.content = content
+
+
+class _ModeloFalso:
+    # Lo que usa chatbot_script: invoke/stream y sus versiones asyncio sobre un prompt ya armado
+    def __init__(self, conversacion):
+        self.conversacion = conversacion
+
+    def invoke(self, prompt):
+        self.conversacion.fabrica._llamada()
+        time.sleep(self.conversacion.fabrica.latencia)
+        return _Fragmento(self.conversacion._generar())
+
+    async def ainvoke(self, prompt):
+        self.conversacion.fabrica._llamada()
+        await asyncio.sleep(self.conversacion.fabrica.latencia)
+        return _Fragmento(self.conversacion._generar())
+
+    def _fragmentos(self):
+        texto = self.conversacion._generar()
+        tamano = self.conversacion.fabrica.tamano_fragmento
+        return [texto[i:i + tamano] for i in range(0, len(texto), tamano)]
+
+    def stream(self, prompt):
+        self.conversacion.fabrica._llamada()
+        fragmentos = self._fragmentos()
+        for fragmento in fragmentos:
+            time.sleep(self.conversacion.fabrica.latencia / len(fragmentos))
+            yield _Fragmento(fragmento)
+
+    async def astream(self, prompt):
+        self.conversacion.fabrica._llamada()
+        fragmentos = self._fragmentos()
+        for fragmento in fragmentos:
+            await asyncio.sleep(self.conversacion.fabrica.latencia / len(fragmentos))
+            yield _Fragmento(fragmento)
+
+
+class ConversacionFalsa:
+    """Conversación de un cliente: avanza un paso por cada respuesta del asistente guardada en su memoria"""
+
+    def __init__(self, fabrica):
+        self.fabrica = fabrica
+        self.memory = _Memoria()
+        self.llm = _ModeloFalso(self)
+
+    def _generar(self):
+        pasos = sum(1 for mensaje in self.memory.chat_memory.messages if mensaje.type == "ai")
+        step = min(pasos + 1, 6)
+        respuesta = {"respuesta": RESPUESTAS[step], "step": step}
+        if step == 3:
+            respuesta["intervalo"] = 8
+        elif step == 4:
+            respuesta["Nombre_mascota"] = "Firulais"
+        elif step == 5:
+            respuesta["preferencia"] = "Royal Canin"
+        elif step == 6:
+            respuesta["raza_mascota"] = "Golden Retriever"
+        return json.dumps(respuesta, ensure_ascii=False)
+
+
+class LLMFalso:
+    """Fábrica de conversaciones falsas que cuenta las llamadas al modelo"""
+
+    def __init__(self, latencia=0.0, tasa_429=0.0, semilla=None, tamano_fragmento=16):
+        self.latencia = latencia
+        self.tamano_fragmento = tamano_fragmento
+        self.tasa_429 = tasa_429
+        self._azar = random.Random(semilla)
+        self._lock = threading.Lock()
+        self.llamadas = 0
+        self.errores_429 = 0
+        self.conversaciones = 0
+
+    def crear_conversacion(self, message_history):
+        """Reemplazo de chatbot_script.crear_conversacion"""
+        conversacion = ConversacionFalsa(self)
+        for message in message_history:
+            if message["message_direction"] == "outbound":
+                conversacion.memory.chat_memory.add_ai_message(message["mensaje"])
+            else:
+                conversacion.memory.chat_memory.add_user_message(message["mensaje"])
+        with self._lock:
+            self.conversaciones += 1
+        return conversacion
+
+    def _llamada(self):
+        with self._lock:
+            self.llamadas += 1
+            falla = self.tasa_429 and self._azar.random() < self.tasa_429
+            self.errores_429 += bool(falla)
+        if falla:
+            raise ErrorCuota()
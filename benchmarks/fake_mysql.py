@@ -0,0 +1,198 @@
+"""
+Base de datos falsa para benchmarks: conexiones con la interfaz de pymysql
+(DictCursor, %s, commit/rollback/ping) sobre un archivo SQLite, con el mismo
+esquema que migraciones.py. Traduce lo poco de MySQL que usa el chatbot
+(ON DUPLICATE KEY UPDATE, LAST_INSERT_ID, FOR UPDATE) y cuenta las consultas.
+
+Uso (dentro de un benchmark):
+    db = MySQLFalso("/tmp/bench.db", latencia=0.001)
+    chatbot_script._pool = Perezoso(lambda: PoolConexiones(db.conectar, max_size=10))
+"""
+
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+ESQUEMA = """
+    CREATE TABLE IF NOT EXISTS message_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        telefono_cliente TEXT,
+        fecha_mensaje TEXT,
+        mensaje TEXT,
+        message_direction TEXT,
+        servicio TEXT,
+        step TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_message_log_telefono_fecha ON message_log (telefono_cliente, fecha_mensaje);
+    CREATE TABLE IF NOT EXISTS recordatorios (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        usuario TEXT,
+        fecha_recordatorio TEXT,
+        numero_semanas INTEGER,
+        estado TEXT NOT NULL DEFAULT 'pendiente',
+        reclamado_hasta TEXT,
+        intentos INTEGER NOT NULL DEFAULT 0,
+        enviado_en TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_recordatorios_estado_fecha ON recordatorios (estado, fecha_recordatorio);
+    CREATE INDEX IF NOT EXISTS idx_recordatorios_usuario_estado ON recordatorios (usuario, estado);
+    CREATE TABLE IF NOT EXISTS clientes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        whatsapp TEXT UNIQUE,
+        nombre TEXT,
+        mascota_tipo TEXT,
+        mascota_nombre TEXT,
+        preferencias TEXT,
+        step INTEGER DEFAULT 0
+    );
+"""
+
+# Clave única de cada tabla para traducir ON DUPLICATE KEY UPDATE a ON CONFLICT
+CLAVES_UNICAS = {"clientes": "whatsapp"}
+
+RE_INSERT_TABLA = re.compile(r"INSERT\s+INTO\s+(\w+)", re.IGNORECASE)
+RE_ON_DUPLICATE = re.compile(r"ON\s+DUPLICATE\s+KEY\s+UPDATE", re.IGNORECASE)
+RE_VALUES_COLUMNA = re.compile(r"VALUES\((\w+)\)", re.IGNORECASE)
+RE_LAST_INSERT_ID = re.compile(r",\s*id\s*=\s*LAST_INSERT_ID\(id\)", re.IGNORECASE)
+RE_FOR_UPDATE = re.compile(r"FOR\s+UPDATE(\s+SKIP\s+LOCKED)?", re.IGNORECASE)
+RE_NOW = re.compile(r"NOW\(\)", re.IGNORECASE)
+RE_FROM_DUAL = re.compile(r"\s+FROM\s+DUAL\b", re.IGNORECASE)
+
+
+def traducir(sql):
+    """Convierte una sentencia de MySQL al dialecto de SQLite"""
+    sql = sql.replace("%s", "?")
+    sql = RE_FOR_UPDATE.sub("", sql)
+    sql = RE_NOW.sub("datetime('now', 'localtime')", sql)
+    sql = RE_FROM_DUAL.sub("", sql)
+    if RE_ON_DUPLICATE.search(sql):
+        tabla = RE_INSERT_TABLA.search(sql).group(1)
+        insercion, actualizacion = RE_ON_DUPLICATE.split(RE_LAST_INSERT_ID.sub("", sql), 1)
+        actualizacion = RE_VALUES_COLUMNA.sub(r"excluded.\1", actualizacion)
+        sql = f"{insercion} ON CONFLICT({CLAVES_UNICAS[tabla]}) DO UPDATE SET {actualizacion}"
+    return sql
+
+
+class CursorFalso:
+    """Cursor con la interfaz de pymysql.cursors.DictCursor"""
+
+    def __init__(self, conexion):
+        self.conexion = conexion
+        self._cursor = conexion._conn.cursor()
+        self.lastrowid = None
+        self.rowcount = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _filas(self, filas):
+        columnas = [d[0] for d in self._cursor.description or ()]
+        return [dict(zip(columnas, fila)) for fila in filas]
+
+    def execute(self, sql, parametros=()):
+        self.conexion.db._contar(sql)
+        traducida = self.conexion.db._traducir(sql)
+        self._cursor.execute(traducida, tuple(parametros))
+        self.rowcount = self._cursor.rowcount
+        self.lastrowid = self._cursor.lastrowid
+        if RE_ON_DUPLICATE.search(sql):
+            # LAST_INSERT_ID(id): en MySQL lastrowid es el id también cuando la fila se actualiza
+            tabla = RE_INSERT_TABLA.search(sql).group(1)
+            clave = CLAVES_UNICAS[tabla]
+            self.lastrowid = self.conexion._conn.execute(
+                f"SELECT id FROM {tabla} WHERE {clave} = ?", (parametros[0],)
+            ).fetchone()[0]
+        return self.rowcount
+
+    def executemany(self, sql, parametros):
+        # pymysql agrupa los INSERT de executemany en una sola sentencia: cuenta como una consulta
+        self.conexion.db._contar(sql)
+        self._cursor.executemany(self.conexion.db._traducir(sql), [tuple(p) for p in parametros])
+        self.rowcount = self._cursor.rowcount
+        return self.rowcount
+
+    def fetchone(self):
+        fila = self._cursor.fetchone()
+        return self._filas([fila])[0] if fila is not None else None
+
+    def fetchall(self):
+        return self._filas(self._cursor.fetchall())
+
+    def fetchmany(self, tamano=1):
+        return self._filas(self._cursor.fetchmany(tamano))
+
+    def close(self):
+        self._cursor.close()
+
+
+class ConexionFalsa:
+    """Conexión con la interfaz de pymysql: cursor(), commit(), rollback(), ping() y close()"""
+
+    def __init__(self, db):
+        self.db = db
+        self._conn = sqlite3.connect(db.ruta, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+
+    def cursor(self):
+        return CursorFalso(self)
+
+    def commit(self):
+        self.db._contar("COMMIT")
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def ping(self, reconnect=False):
+        self.db._contar("PING")
+
+    def close(self):
+        self._conn.close()
+
+
+class MySQLFalso:
+    """Fábrica de conexiones falsas sobre un archivo SQLite, con contadores de consultas"""
+
+    def __init__(self, ruta, latencia=0.0):
+        self.ruta = ruta
+        self.latencia = latencia
+        self._lock = threading.Lock()
+        self._traducciones = {}
+        self.consultas = Counter()
+        self.conexiones = 0
+        with sqlite3.connect(ruta) as conn:
+            conn.executescript(ESQUEMA)
+
+    def conectar(self):
+        """Reemplazo de chatbot_script.crear_conexion"""
+        with self._lock:
+            self.conexiones += 1
+        return ConexionFalsa(self)
+
+    def _traducir(self, sql):
+        traducida = self._traducciones.get(sql)
+        if traducida is None:
+            traducida = self._traducciones[sql] = traducir(sql)
+        return traducida
+
+    def _contar(self, sql):
+        # La latencia simula el viaje de ida y vuelta a MySQL en cada consulta
+        if self.latencia:
+            time.sleep(self.latencia)
+        with self._lock:
+            self.consultas[sql.split(None, 1)[0].upper()] += 1
+
+    def total_consultas(self):
+        """Consultas ejecutadas, sin contar COMMIT ni PING"""
+        with self._lock:
+            return sum(n for tipo, n in self.consultas.items() if tipo not in ("COMMIT", "PING"))
+
+    def reiniciar_contadores(self):
+        with self._lock:
+            self.consultas.clear()
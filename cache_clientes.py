@@ -0,0 +1,156 @@
+"""
+Cache de perfiles de clientes (tabla clientes) con escritura directa.
+Nivel 1: LRU en memoria del proceso. Nivel 2 opcional: archivo SQLite compartido
+por los workers de Gunicorn del mismo host. Las escrituras en MySQL actualizan
+ambos niveles para que las lecturas siguientes no consulten la base de datos.
+"""
+
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+CACHE_CLIENTES_MAX = int(os.environ.get("CLIENT_CACHE_SIZE", "10000"))
+CACHE_CLIENTES_TTL = int(os.environ.get("CLIENT_CACHE_TTL", "60"))
+CACHE_CLIENTES_SQLITE = os.environ.get("CLIENT_CACHE_SQLITE")
+
+
+def _serializar(valor):
+    if isinstance(valor, (datetime.date, datetime.datetime)):
+        return valor.isoformat()
+    raise TypeError(f"Tipo no serializable: {type(valor)}")
+
+
+class CacheClientes:
+    """LRU con TTL de clientes por numero de WhatsApp, con nivel SQLite opcional"""
+
+    def __init__(self, max_size=CACHE_CLIENTES_MAX, ttl=CACHE_CLIENTES_TTL, ruta_sqlite=CACHE_CLIENTES_SQLITE):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.ruta_sqlite = ruta_sqlite
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.aciertos = 0
+        self.aciertos_compartidos = 0
+        self.fallos = 0
+        self.desalojos = 0
+        if ruta_sqlite:
+            self._sqlite().execute(
+                "CREATE TABLE IF NOT EXISTS clientes (whatsapp TEXT PRIMARY KEY, datos TEXT, actualizado REAL)"
+            )
+
+    def _sqlite(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.ruta_sqlite, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def obtener(self, whatsapp):
+        """Devuelve una copia del cliente en cache o None si no esta"""
+        ahora = time.time()
+        with self._lock:
+            entrada = self._datos.get(whatsapp)
+            if entrada is not None and ahora - entrada[0] <= self.ttl:
+                self._datos.move_to_end(whatsapp)
+                self.aciertos += 1
+                return dict(entrada[1])
+
+        if self.ruta_sqlite:
+            try:
+                fila = self._sqlite().execute(
+                    "SELECT datos, actualizado FROM clientes WHERE whatsapp = ?", (whatsapp,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.error("Error al leer la cache compartida de clientes: %s", e)
+                fila = None
+            if fila and ahora - fila[1] <= self.ttl:
+                cliente = json.loads(fila[0])
+                with self._lock:
+                    self.aciertos_compartidos += 1
+                    self._poner(whatsapp, cliente, fila[1])
+                return dict(cliente)
+
+        with self._lock:
+            self.fallos += 1
+        return None
+
+    def guardar(self, whatsapp, cliente):
+        """Guarda el cliente completo leido o escrito en MySQL"""
+        ahora = time.time()
+        with self._lock:
+            self._poner(whatsapp, dict(cliente), ahora)
+        self._guardar_compartido(whatsapp, cliente, ahora)
+
+    def actualizar(self, whatsapp, campos):
+        """Aplica campos escritos en MySQL al cliente en cache; si no esta, no hace nada"""
+        ahora = time.time()
+        with self._lock:
+            entrada = self._datos.get(whatsapp)
+            cliente = dict(entrada[1]) if entrada is not None else None
+        if cliente is None and self.ruta_sqlite:
+            try:
+                fila = self._sqlite().execute("SELECT datos FROM clientes WHERE whatsapp = ?", (whatsapp,)).fetchone()
+            except sqlite3.Error as e:
+                logger.error("Error al leer la cache compartida de clientes: %s", e)
+                fila = None
+            cliente = json.loads(fila[0]) if fila else None
+        if cliente is None:
+            return
+        cliente.update(campos)
+        with self._lock:
+            self._poner(whatsapp, cliente, ahora)
+        self._guardar_compartido(whatsapp, cliente, ahora)
+
+    def invalidar(self, whatsapp):
+        """Elimina un cliente de ambos niveles de la cache"""
+        with self._lock:
+            self._datos.pop(whatsapp, None)
+        if self.ruta_sqlite:
+            self._sqlite().execute("DELETE FROM clientes WHERE whatsapp = ?", (whatsapp,))
+
+    def olvidar_local(self, whatsapp):
+        """Elimina un cliente solo del nivel en memoria; el compartido ya tiene lo que escribió otro worker"""
+        with self._lock:
+            self._datos.pop(whatsapp, None)
+
+    def _poner(self, whatsapp, cliente, actualizado):
+        self._datos[whatsapp] = (actualizado, cliente)
+        self._datos.move_to_end(whatsapp)
+        while len(self._datos) > self.max_size:
+            self._datos.popitem(last=False)
+            self.desalojos += 1
+
+    def _guardar_compartido(self, whatsapp, cliente, actualizado):
+        if not self.ruta_sqlite:
+            return
+        try:
+            self._sqlite().execute(
+                "INSERT OR REPLACE INTO clientes (whatsapp, datos, actualizado) VALUES (?, ?, ?)",
+                (whatsapp, json.dumps(cliente, default=_serializar), actualizado)
+            )
+        except sqlite3.Error as e:
+            logger.error("Error al escribir la cache compartida de clientes: %s", e)
+
+    def estadisticas(self):
+        """Devuelve aciertos, fallos y desalojos de la cache"""
+        with self._lock:
+            consultas = self.aciertos + self.aciertos_compartidos + self.fallos
+            return {
+                "clientes": len(self._datos),
+                "aciertos": self.aciertos,
+                "aciertos_compartidos": self.aciertos_compartidos,
+                "fallos": self.fallos,
+                "desalojos": self.desalojos,
+                "tasa_aciertos": (self.aciertos + self.aciertos_compartidos) / consultas if consultas else 0.0,
+            }
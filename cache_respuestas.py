@@ -0,0 +1,125 @@
+"""
+Cache persistente de respuestas del LLM.
+La clave es (step, mensaje normalizado, campos del cliente que influyen en la
+respuesta). Se guarda en SQLite para sobrevivir reinicios y compartirse entre
+workers. Solo debe usarse cuando el prompt no contiene historial del cliente.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from ruta_rapida import normalizar
+
+logger = logging.getLogger(__name__)
+
+CACHE_RESPUESTAS_RUTA = os.environ.get("LLM_CACHE_PATH", "cache_respuestas.db")
+CACHE_RESPUESTAS_TTL = int(os.environ.get("LLM_CACHE_TTL", str(24 * 3600)))
+CACHE_RESPUESTAS_MAX = int(os.environ.get("LLM_CACHE_SIZE", "10000"))
+CACHE_RESPUESTAS_ACTIVA = os.environ.get("LLM_CACHE", "1") != "0"
+
+
+class CacheRespuestas:
+    """Respuestas del LLM en SQLite con TTL y tamaño maximo"""
+
+    def __init__(self, ruta=CACHE_RESPUESTAS_RUTA, ttl=CACHE_RESPUESTAS_TTL, max_size=CACHE_RESPUESTAS_MAX,
+                 activa=CACHE_RESPUESTAS_ACTIVA):
+        self.ruta = ruta
+        self.ttl = ttl
+        self.max_size = max_size
+        self.activa = activa
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._escrituras = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.omitidas = 0
+        if activa:
+            self._conexion().execute(
+                "CREATE TABLE IF NOT EXISTS respuestas (clave TEXT PRIMARY KEY, respuesta TEXT, creado REAL, usado REAL)"
+            )
+            self._conexion().execute("CREATE INDEX IF NOT EXISTS idx_respuestas_usado ON respuestas (usado)")
+
+    def _conexion(self):
+        conn = getattr(self._local, "conn", None)
+        # Una conexión heredada por fork (gunicorn --preload) no se comparte con el proceso hijo
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.ruta, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def clave(step, mensaje, cliente=None):
+        """Calcula la clave de cache a partir del step, el mensaje y los datos del cliente"""
+        cliente = cliente or {}
+        campos = [cliente.get(campo) for campo in ("mascota_tipo", "mascota_nombre", "preferencias")]
+        crudo = json.dumps([str(step), normalizar(mensaje), campos], ensure_ascii=False)
+        return hashlib.sha256(crudo.encode("utf-8")).hexdigest()
+
+    def omitir(self):
+        """Registra que el prompt era específico del cliente y no se usó la cache"""
+        with self._lock:
+            self.omitidas += 1
+
+    def obtener(self, clave):
+        """Devuelve la respuesta guardada o None si no existe o expiró"""
+        if not self.activa:
+            return None
+        ahora = time.time()
+        try:
+            conn = self._conexion()
+            fila = conn.execute(
+                "SELECT respuesta FROM respuestas WHERE clave = ? AND creado > ?", (clave, ahora - self.ttl)
+            ).fetchone()
+            if fila:
+                conn.execute("UPDATE respuestas SET usado = ? WHERE clave = ?", (ahora, clave))
+        except sqlite3.Error as e:
+            logger.error("Error al leer la cache de respuestas: %s", e)
+            fila = None
+        with self._lock:
+            if fila:
+                self.aciertos += 1
+            else:
+                self.fallos += 1
+        return json.loads(fila[0]) if fila else None
+
+    def guardar(self, clave, respuesta):
+        """Guarda una respuesta y recorta la cache si supera el tamaño máximo"""
+        if not self.activa:
+            return
+        ahora = time.time()
+        try:
+            conn = self._conexion()
+            conn.execute(
+                "INSERT OR REPLACE INTO respuestas (clave, respuesta, creado, usado) VALUES (?, ?, ?, ?)",
+                (clave, json.dumps(respuesta, ensure_ascii=False), ahora, ahora)
+            )
+            with self._lock:
+                self._escrituras += 1
+                recortar = self._escrituras % 100 == 0
+            if recortar:
+                self.recortar()
+        except sqlite3.Error as e:
+            logger.error("Error al escribir la cache de respuestas: %s", e)
+
+    def recortar(self):
+        """Elimina las respuestas expiradas y las menos usadas por encima de max_size"""
+        conn = self._conexion()
+        conn.execute("DELETE FROM respuestas WHERE creado <= ?", (time.time() - self.ttl,))
+        conn.execute(
+            "DELETE FROM respuestas WHERE clave IN ("
+            "SELECT clave FROM respuestas ORDER BY usado DESC LIMIT -1 OFFSET ?)",
+            (self.max_size,)
+        )
+
+    def estadisticas(self):
+        """Devuelve aciertos, fallos y consultas que no podían usar la cache"""
+        with self._lock:
+            return {"aciertos": self.aciertos, "fallos": self.fallos, "omitidas": self.omitidas}
@@ -0,0 +1,138 @@
+"""
+Candados por telefono para el motor de conversacion.
+Dentro del proceso: un Lock por clave, creado al pedirlo y eliminado cuando
+nadie lo usa. Entre workers de gunicorn del mismo host: un lock de rango de
+bytes (fcntl) sobre un archivo compartido, en una franja elegida por hash del
+telefono. Asi dos mensajes de un mismo cliente nunca leen y escriben su step a
+la vez, y clientes distintos avanzan en paralelo. Cada franja guarda el pid
+del ultimo worker que la tomo: si fue otro, las caches en memoria de ese
+cliente pueden estar viejas y hay que releerlo.
+"""
+
+import asyncio
+import os
+import threading
+import time
+import zlib
+from contextlib import asynccontextmanager, contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo candados dentro del proceso
+    fcntl = None
+
+CANDADOS_RUTA = os.environ.get("PHONE_LOCK_PATH", "candados.lock")
+CANDADOS_FRANJAS = int(os.environ.get("PHONE_LOCK_STRIPES", "65536"))
+TAMANO_FRANJA = 8
+
+
+class CandadosPorClave:
+    """Serializa el trabajo por clave y mide cuánto se espera por cada candado"""
+
+    def __init__(self, ruta=CANDADOS_RUTA, franjas=CANDADOS_FRANJAS):
+        self.ruta = ruta if fcntl is not None else None
+        self.franjas = franjas
+        self._lock = threading.Lock()
+        self._candados = {}
+        self._archivo = None
+        self._pid = None
+        self.adquisiciones = 0
+        self.contendidas = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+        self.espera_entre_procesos = 0.0
+        self.de_otro_proceso = 0
+
+    def _descriptor(self):
+        # Los locks fcntl no se heredan en un fork y cerrar cualquier descriptor del archivo los libera:
+        # un único descriptor por proceso
+        if self._pid != os.getpid():
+            self._archivo = os.open(self.ruta, os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        return self._archivo
+
+    def franja(self, clave):
+        """Franja del archivo de locks que corresponde a la clave"""
+        return zlib.crc32(str(clave).encode("utf-8")) % self.franjas
+
+    def _adquirir(self, clave):
+        # El Lock del proceso es por franja y no por clave: los locks fcntl pertenecen al proceso,
+        # así dos hilos nunca sostienen a la vez la misma franja del archivo
+        franja = self.franja(clave)
+        inicio = time.monotonic()
+        with self._lock:
+            entrada = self._candados.get(franja)
+            if entrada is None:
+                entrada = self._candados[franja] = [threading.Lock(), 0]
+            entrada[1] += 1
+        contendida = not entrada[0].acquire(blocking=False)
+        if contendida:
+            entrada[0].acquire()
+        entre_procesos = 0.0
+        ajeno = False
+        if self.ruta:
+            antes = time.monotonic()
+            descriptor = self._descriptor()
+            try:
+                fcntl.lockf(descriptor, fcntl.LOCK_EX, TAMANO_FRANJA, franja * TAMANO_FRANJA)
+                # Cada franja guarda el pid del último proceso que la tomó
+                previo = int.from_bytes(os.pread(descriptor, TAMANO_FRANJA, franja * TAMANO_FRANJA) or b"\0", "little")
+                ajeno = previo not in (0, os.getpid())
+                if previo != os.getpid():
+                    os.pwrite(descriptor, os.getpid().to_bytes(TAMANO_FRANJA, "little"), franja * TAMANO_FRANJA)
+            except OSError:
+                self._soltar(franja, entrada)
+                raise
+            entre_procesos = time.monotonic() - antes
+        espera = time.monotonic() - inicio
+        with self._lock:
+            self.adquisiciones += 1
+            self.contendidas += contendida
+            self.espera_total += espera
+            self.espera_max = max(self.espera_max, espera)
+            self.espera_entre_procesos += entre_procesos
+            self.de_otro_proceso += ajeno
+        return franja, entrada, ajeno
+
+    def _liberar(self, franja, entrada):
+        if self.ruta:
+            fcntl.lockf(self._descriptor(), fcntl.LOCK_UN, TAMANO_FRANJA, franja * TAMANO_FRANJA)
+        self._soltar(franja, entrada)
+
+    def _soltar(self, franja, entrada):
+        entrada[0].release()
+        with self._lock:
+            entrada[1] -= 1
+            if entrada[1] == 0:
+                del self._candados[franja]
+
+    @contextmanager
+    def bloquear(self, clave):
+        """Retiene el candado de la clave; el with recibe True si otro worker la tomó desde nuestro último uso"""
+        franja, entrada, ajeno = self._adquirir(clave)
+        try:
+            yield ajeno
+        finally:
+            self._liberar(franja, entrada)
+
+    @asynccontextmanager
+    async def bloquear_async(self, clave):
+        """Como bloquear, pero la espera ocurre en un hilo y no detiene el event loop"""
+        franja, entrada, ajeno = await asyncio.to_thread(self._adquirir, clave)
+        try:
+            yield ajeno
+        finally:
+            self._liberar(franja, entrada)
+
+    def estadisticas(self):
+        """Devuelve adquisiciones, esperas y candados en uso"""
+        with self._lock:
+            return {
+                "adquisiciones": self.adquisiciones,
+                "contendidas": self.contendidas,
+                "espera_promedio_s": self.espera_total / self.adquisiciones if self.adquisiciones else 0.0,
+                "espera_max_s": self.espera_max,
+                "espera_entre_procesos_s": self.espera_entre_procesos,
+                "de_otro_proceso": self.de_otro_proceso,
+                "franjas_en_uso": len(self._candados),
+            }
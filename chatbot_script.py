@@ -4,204 +4,499 @@ Este script implementa un asistente virtual que gestiona recordatorios de compra
 y almacena información de clientes y sus mascotas.
 """
 
+import asyncio
 import pymysql
-import time
-import random
 import datetime
 import json
+import logging
 import os
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.chains import ConversationChain
-from langchain.memory import ConversationBufferMemory
-from langchain.prompts import PromptTemplate
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pool_db import PoolConexiones
+from historial import CacheHistorial, HISTORIAL_MAX_MENSAJES, contar_tokens, ventana_historial
+from constructor_prompt import ConstructorPrompt
+from memorias import MemoriasPorCliente
+from cache_clientes import CacheClientes
+from ruta_rapida import RutaRapida
+from cache_respuestas import CacheRespuestas
+from parser_respuesta import ExtractorCampo, RespuestaIA, RespuestaInvalida, parsear_respuesta
+from planificador_llm import PlanificadorLLM, CuotaAgotada, PlazoExcedido, PRIORIDAD_EN_CONVERSACION, PRIORIDAD_NUEVO
+from perezoso import Perezoso
+from candados import CandadosPorClave
+from instrumentacion import configurar_logging, metricas
+from recordatorios import SQL_ACTUALIZAR_PENDIENTE, SQL_INSERTAR_SI_NO_HAY_PENDIENTE
+
+logger = logging.getLogger(__name__)
 
 # --- Configuración del modelo LLM ---
-API_KEY = os.environ.get("API_KEY")
-if API_KEY is None:
-    raise ValueError("The GEMINI_API_KEY environment variable is not set.")
-llm = ChatGoogleGenerativeAI(
-    model="models/gemini-2.0-flash",
-    google_api_key=API_KEY,
-    temperature=0.7
-)
-memory = ConversationBufferMemory(memory_key="history", return_messages=True)
+# JSON mode: Gemini devuelve el diccionario como JSON válido, sin ```json ni texto alrededor
+LLM_JSON_MODE = os.environ.get("LLM_JSON_MODE", "1") != "0"
+# Streaming: si quien llama a interactuar() pasa al_responder, la respuesta sale en cuanto el modelo la termina de escribir
+LLM_STREAMING = os.environ.get("LLM_STREAMING", "1") != "0"
+# Si es mayor que 0, la memoria de cada cliente se resume al superar este número de tokens
+MEMORIA_RESUMEN_TOKENS = int(os.environ.get("MEMORY_SUMMARY_TOKENS", "0"))
+
+def crear_llm():
+    """Construye el cliente de Gemini; LangChain se importa aquí y no al cargar el módulo"""
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    api_key = os.environ.get("API_KEY")
+    if api_key is None:
+        raise ValueError("The GEMINI_API_KEY environment variable is not set.")
+    return ChatGoogleGenerativeAI(
+        model="models/gemini-2.0-flash",
+        google_api_key=api_key,
+        temperature=0.7
+    )
+
+def crear_llm_respuestas():
+    llm = obtener_llm()
+    return llm.bind(response_mime_type="application/json") if LLM_JSON_MODE else llm
+
+_llm = Perezoso(crear_llm)
+_llm_respuestas = Perezoso(crear_llm_respuestas)
+
+def obtener_llm():
+    """Cliente de Gemini del proceso actual"""
+    return _llm.obtener()
+
+def obtener_llm_respuestas():
+    """Cliente de Gemini configurado para responder en JSON"""
+    return _llm_respuestas.obtener()
 
 # --- Configuración de la base de datos ---
-def inicializar_base_datos():
-    """Inicializa la conexión a la base de datos y crea las tablas si no existen"""
-    print("[INFO] Inicializando base de datos...")
+def crear_conexion():
+    """Abre una nueva conexión a la base de datos"""
+    return pymysql.connect(
+        host=os.environ.get("HOST"),
+        user=os.environ.get("USER"),
+        port=int(os.environ.get("PORT_DATABASE")),
+        password=os.environ.get("PASSWORD"),
+        database="analytics_remax",
+        cursorclass=pymysql.cursors.DictCursor
+    )
+
+def crear_pool():
+    """Crea el pool de conexiones; el esquema se aplica aparte con `python cli.py migrar`"""
+    logger.info("Inicializando pool de base de datos...")
+    return PoolConexiones(
+        crear_conexion,
+        min_size=int(os.environ.get("DB_POOL_MIN", "1")),
+        max_size=int(os.environ.get("DB_POOL_MAX", "10")),
+        timeout=float(os.environ.get("DB_POOL_TIMEOUT", "10")),
+        ping_intervalo=float(os.environ.get("DB_PING_INTERVAL", "30"))
+    )
+
+_pool = Perezoso(crear_pool)
+
+def obtener_pool():
+    """Devuelve el pool del proceso, o None si la base de datos no está disponible (se reintenta en la siguiente llamada)"""
     try:
-        conn = pymysql.connect(
+        return _pool.obtener()
+    except Exception as e:
+        logger.error("Error al conectar con la base de datos: %s", e)
+        return None
+
+# Pool asyncio (aiomysql) para la ruta async; se crea en el primer uso dentro del event loop
+_pool_async = None
+_pool_async_lock = asyncio.Lock()
+
+async def obtener_pool_async():
+    """Devuelve el pool de conexiones aiomysql, creándolo si no existe"""
+    global _pool_async
+    async with _pool_async_lock:
+        if _pool_async is not None:
+            return _pool_async
+        import aiomysql
+        _pool_async = await aiomysql.create_pool(
             host=os.environ.get("HOST"),
             user=os.environ.get("USER"),
             port=int(os.environ.get("PORT_DATABASE")),
             password=os.environ.get("PASSWORD"),
-            database="analytics_remax",
-            cursorclass=pymysql.cursors.DictCursor
+            db="analytics_remax",
+            minsize=int(os.environ.get("DB_POOL_MIN", "1")),
+            maxsize=int(os.environ.get("DB_ASYNC_POOL_MAX", "20")),
+            cursorclass=aiomysql.DictCursor,
+            autocommit=False
         )
-        cursor = conn.cursor()
-
-        # Tabla message_log
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS message_log (
-                id INTEGER PRIMARY KEY AUTO_INCREMENT,
-                telefono_cliente VARCHAR(255),
-                fecha_mensaje DATETIME,
-                mensaje TEXT,
-                message_direction VARCHAR(255),
-                servicio VARCHAR(255),
-                step VARCHAR(255)
-            )
-        ''')
-
-        # Tabla recordatorios
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS recordatorios (
-                id INTEGER PRIMARY KEY AUTO_INCREMENT,
-                usuario VARCHAR(255),
-                fecha_recordatorio DATE,
-                numero_semanas INTEGER
-            )
-        ''')
-
-        # Tabla de clientes
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS clientes (
-                id INTEGER PRIMARY KEY AUTO_INCREMENT,
-                whatsapp VARCHAR(255) UNIQUE,
-                nombre VARCHAR(255),
-                mascota_tipo VARCHAR(255),
-                mascota_nombre VARCHAR(255),
-                preferencias TEXT
-            )
-        ''')
-
-        conn.commit()
-        print("[INFO] Base de datos inicializada correctamente")
-        return conn, cursor
-    except Exception as e:
-        print(f"[ERROR] Error al inicializar la base de datos: {e}")
-        return None, None
+        return _pool_async
+
+async def cerrar_pool_async():
+    """Cierra el pool aiomysql si llegó a crearse"""
+    global _pool_async
+    async with _pool_async_lock:
+        if _pool_async is not None:
+            _pool_async.close()
+            await _pool_async.wait_closed()
+            _pool_async = None
 
-conn, cursor = inicializar_base_datos()
+cache_historial = CacheHistorial()
+cache_clientes = CacheClientes()
 
 # --- Funciones de base de datos ---
 def obtener_info_cliente(whatsapp):
     """Obtiene la información de un cliente por su número de WhatsApp"""
+    cliente = cache_clientes.obtener(whatsapp)
+    if cliente:
+        return cliente
     try:
-        if conn and cursor:
-            cursor.execute("SELECT * FROM clientes WHERE whatsapp = %s", (whatsapp,))
-            cliente = cursor.fetchone()
+        pool = obtener_pool()
+        if pool:
+            with pool.conexion() as conn, conn.cursor() as cursor:
+                cursor.execute("SELECT * FROM clientes WHERE whatsapp = %s", (whatsapp,))
+                cliente = cursor.fetchone()
             if cliente:
-                print(f"[INFO] Cliente encontrado: ID={cliente['id']}, WhatsApp={cliente['whatsapp']}")
+                cache_clientes.guardar(whatsapp, cliente)
+                logger.debug("Cliente encontrado: ID=%s, WhatsApp=%s", cliente['id'], cliente['whatsapp'])
             else:
-                print(f"[INFO] Cliente no encontrado: WhatsApp={whatsapp}")
+                logger.debug("Cliente no encontrado: WhatsApp=%s", whatsapp)
             return cliente
         else:
-            print("[ERROR] No hay conexión a la base de datos.")
+            logger.error("No hay conexión a la base de datos.")
             return None
     except Exception as e:
-        print(f"[ERROR] Error al obtener información del cliente: {e}")
+        logger.error("Error al obtener información del cliente: %s", e)
         return None
 
 def guardar_info_cliente(whatsapp, datos):
     """Guarda o actualiza la información de un cliente en la base de datos"""
-    print(f"[INFO] Guardando información del cliente: {whatsapp}")
-    print(f"[INFO] Datos a guardar: {datos}")
+    logger.debug("Guardando información del cliente: %s", whatsapp)
+    logger.debug("Datos a guardar: %s", datos)
     try:
-        if conn and cursor:
-            cursor.execute("""
-            INSERT INTO clientes (whatsapp, nombre, mascota_tipo, mascota_nombre, preferencias)
-                VALUES (%s, %s, %s, %s, %s)
-                ON DUPLICATE KEY UPDATE
-                nombre=%s,
-                mascota_tipo=%s,
-                mascota_nombre=%s,
-                preferencias=%s
-            """, (
-                whatsapp,
-                datos['nombre'],
-                datos.get('mascota_tipo'),
-                datos.get('mascota_nombre'),
-                datos.get('preferencias'),
-                datos['nombre'],
-                datos.get('mascota_tipo'),
-                datos.get('mascota_nombre'),
-                datos.get('preferencias')
-            ))
+        pool = obtener_pool()
+        if pool:
+            with pool.conexion() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("""
+                    INSERT INTO clientes (whatsapp, nombre, mascota_tipo, mascota_nombre, preferencias)
+                        VALUES (%s, %s, %s, %s, %s)
+                        ON DUPLICATE KEY UPDATE
+                        nombre=%s,
+                        mascota_tipo=%s,
+                        mascota_nombre=%s,
+                        preferencias=%s
+                    """, (
+                        whatsapp,
+                        datos['nombre'],
+                        datos.get('mascota_tipo'),
+                        datos.get('mascota_nombre'),
+                        datos.get('preferencias'),
+                        datos['nombre'],
+                        datos.get('mascota_tipo'),
+                        datos.get('mascota_nombre'),
+                        datos.get('preferencias')
+                    ))
 
-            conn.commit()
-            print(f"[INFO] Información del cliente guardada correctamente")
+                conn.commit()
+            cache_clientes.actualizar(whatsapp, {
+                "nombre": datos['nombre'],
+                "mascota_tipo": datos.get('mascota_tipo'),
+                "mascota_nombre": datos.get('mascota_nombre'),
+                "preferencias": datos.get('preferencias')
+            })
+            logger.debug("Información del cliente guardada correctamente")
         else:
-            print("[ERROR] No hay conexión a la base de datos.")
+            logger.error("No hay conexión a la base de datos.")
     except Exception as e:
-        print(f"[ERROR] Error al guardar información del cliente: {e}")
+        logger.error("Error al guardar información del cliente: %s", e)
+
+def actualizar_step_cliente(whatsapp, step):
+    """Actualiza el step actual de un cliente"""
+    try:
+        pool = obtener_pool()
+        if pool:
+            with pool.conexion() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("UPDATE clientes SET step = %s WHERE whatsapp = %s", (step, whatsapp))
+                conn.commit()
+            cache_clientes.actualizar(whatsapp, {"step": step})
+            logger.debug("Step actualizado en la base de datos para el cliente %s a %s", whatsapp, step)
+        else:
+            logger.error("No hay conexión a la base de datos.")
+    except Exception as e:
+        logger.error("Error al actualizar el step del cliente: %s", e)
 
 def guardar_recordatorio(usuario, fecha_recordatorio, numero_semanas):
     """Guarda un recordatorio para un cliente"""
-    print(f"[INFO] Guardando recordatorio para usuario={usuario}")
-    print(f"[INFO] Fecha: {fecha_recordatorio}, Numero de Semanas: {numero_semanas}")
+    logger.debug("Guardando recordatorio para usuario=%s", usuario)
+    logger.debug("Fecha: %s, Numero de Semanas: %s", fecha_recordatorio, numero_semanas)
     try:
-        if conn and cursor:
-            cursor.execute(
-                "INSERT INTO recordatorios (usuario, fecha_recordatorio, numero_semanas) VALUES (%s, %s, %s)",
-                (usuario, fecha_recordatorio, numero_semanas)
-            )
+        pool = obtener_pool()
+        if pool:
+            with pool.conexion() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(SQL_ACTUALIZAR_PENDIENTE, (fecha_recordatorio, numero_semanas, usuario))
+                    cursor.execute(SQL_INSERTAR_SI_NO_HAY_PENDIENTE, (usuario, fecha_recordatorio, numero_semanas, usuario))
 
-            conn.commit()
-            print(f"[INFO] Recordatorio guardado correctamente")
+                conn.commit()
+            logger.debug("Recordatorio guardado correctamente")
         else:
-            print("[ERROR] No hay conexión a la base de datos.")
+            logger.error("No hay conexión a la base de datos.")
     except Exception as e:
-        print(f"[ERROR] Error al guardar el recordatorio: {e}")
+        logger.error("Error al guardar el recordatorio: %s", e)
 
 def guardar_message_log(telefono_cliente, fecha_mensaje, mensaje, message_direction, servicio, previous_step):
     """Guarda un mensaje en la tabla message_log"""
-    print(f"[INFO] Guardando mensaje en message_log para telefono_cliente={telefono_cliente}")
-    print(f"[INFO] Fecha: {fecha_mensaje}, Mensaje: {mensaje}, Direccion: {message_direction}, Servicio: {servicio}, Step: {previous_step}")
+    logger.debug("Guardando mensaje en message_log para telefono_cliente=%s", telefono_cliente)
+    logger.debug("Fecha: %s, Mensaje: %s, Direccion: %s, Servicio: %s, Step: %s", fecha_mensaje, mensaje, message_direction, servicio, previous_step)
 
     try:
-        cursor.execute(
-            "INSERT INTO message_log (telefono_cliente, fecha_mensaje, mensaje, message_direction, servicio, step) VALUES (%s, %s, %s, %s, %s, %s)",
-            (telefono_cliente, fecha_mensaje, mensaje, message_direction, servicio, previous_step)
-        )
+        with obtener_pool().conexion() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "INSERT INTO message_log (telefono_cliente, fecha_mensaje, mensaje, message_direction, servicio, step) VALUES (%s, %s, %s, %s, %s, %s)",
+                    (telefono_cliente, fecha_mensaje, mensaje, message_direction, servicio, previous_step)
+                )
 
-        conn.commit()
-        print(f"[INFO] Mensaje guardado correctamente en message_log")
+            conn.commit()
+        logger.debug("Mensaje guardado correctamente en message_log")
     except Exception as e:
-        print(f"[ERROR] Error al guardar el mensaje en message_log: {e}")
+        logger.error("Error al guardar el mensaje en message_log: %s", e)
 
 def insert_manual_message(telefono_cliente, fecha_mensaje, mensaje, message_direction, servicio, step):
     """Inserts a message into the message_log table manually"""
     try:
-        if conn and cursor:
-            cursor.execute(
-                "INSERT INTO message_log (telefono_cliente, fecha_mensaje, mensaje, message_direction, servicio, step) VALUES (%s, %s, %s, %s, %s, %s)",
-                (telefono_cliente, fecha_mensaje, mensaje, message_direction, servicio, step)
-            )
-            conn.commit()
-            print("[INFO] Manual message inserted successfully")
+        pool = obtener_pool()
+        if pool:
+            with pool.conexion() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        "INSERT INTO message_log (telefono_cliente, fecha_mensaje, mensaje, message_direction, servicio, step) VALUES (%s, %s, %s, %s, %s, %s)",
+                        (telefono_cliente, fecha_mensaje, mensaje, message_direction, servicio, step)
+                    )
+                conn.commit()
+            logger.debug("Manual message inserted successfully")
         else:
-            print("[ERROR] No hay conexión a la base de datos.")
+            logger.error("No hay conexión a la base de datos.")
     except Exception as e:
-        print(f"[ERROR] Error al insert manual message: {e}")
+        logger.error("Error al insert manual message: %s", e)
 
-def obtener_message_history(telefono_cliente):
-    """Obtiene el historial de mensajes de un cliente"""
+def obtener_message_history(telefono_cliente, limite=HISTORIAL_MAX_MENSAJES):
+    """Obtiene los últimos mensajes de un cliente, del más antiguo al más reciente"""
     try:
-        if conn and cursor:
-            cursor.execute("SELECT mensaje, message_direction, step FROM message_log WHERE telefono_cliente = %s ORDER BY fecha_mensaje DESC", (telefono_cliente,))
-            message_history = cursor.fetchall()
-            print(f"[INFO] Obteniendo historial de mensajes para telefono_cliente={telefono_cliente}")
-            print(f"[INFO] Historial de mensajes: {message_history}")
+        pool = obtener_pool()
+        if pool:
+            with pool.conexion() as conn, conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT mensaje, message_direction, step FROM message_log WHERE telefono_cliente = %s ORDER BY fecha_mensaje DESC, id DESC LIMIT %s",
+                    (telefono_cliente, limite)
+                )
+                message_history = list(reversed(cursor.fetchall()))
+            logger.debug("Obteniendo historial de mensajes para telefono_cliente=%s", telefono_cliente)
+            logger.debug("Historial de mensajes: %s", message_history)
             return message_history
         else:
-            print("[ERROR] No hay conexión a la base de datos.")
+            logger.error("No hay conexión a la base de datos.")
             return []
     except Exception as e:
-        print(f"[ERROR] Error al obtener el historial de mensajes: {e}")
+        logger.error("Error al obtener el historial de mensajes: %s", e)
         return []
 
+# --- Unidad de trabajo por mensaje ---
+SQL_CLIENTE = "SELECT * FROM clientes WHERE whatsapp = %s"
+
+SQL_CLIENTE_E_HISTORIAL = """
+    SELECT c.id, c.whatsapp, c.nombre, c.mascota_tipo, c.mascota_nombre, c.preferencias, c.step,
+           m.mensaje, m.message_direction, m.step AS mensaje_step
+    FROM (SELECT %s AS whatsapp) k
+    LEFT JOIN clientes c ON c.whatsapp = k.whatsapp
+    LEFT JOIN message_log m ON m.telefono_cliente = k.whatsapp
+    ORDER BY m.fecha_mensaje DESC, m.id DESC
+    LIMIT %s
+"""
+
+def _separar_cliente_e_historial(whatsapp, filas):
+    """Divide las filas del JOIN en cliente e historial y los guarda en cache"""
+    cliente = None
+    if filas and filas[0]['id'] is not None:
+        cliente = {clave: filas[0][clave] for clave in ('id', 'whatsapp', 'nombre', 'mascota_tipo', 'mascota_nombre', 'preferencias', 'step')}
+        cache_clientes.guardar(whatsapp, cliente)
+    message_history = [
+        {"mensaje": fila['mensaje'], "message_direction": fila['message_direction'], "step": fila['mensaje_step']}
+        for fila in reversed(filas) if fila['mensaje'] is not None
+    ]
+    cache_historial.cargar(whatsapp, message_history)
+    return cliente, message_history
+
+def cargar_cliente_e_historial(whatsapp):
+    """Obtiene el cliente y sus últimos mensajes (del más antiguo al más reciente) en una sola consulta"""
+    message_history = cache_historial.obtener(whatsapp)
+    if message_history is not None:
+        # Con el historial en cache basta con el cliente, que también puede estar en cache
+        return obtener_info_cliente(whatsapp), message_history
+    try:
+        pool = obtener_pool()
+        if pool:
+            with pool.conexion() as conn, conn.cursor() as cursor:
+                cursor.execute(SQL_CLIENTE_E_HISTORIAL, (whatsapp, HISTORIAL_MAX_MENSAJES))
+                filas = cursor.fetchall()
+        else:
+            logger.error("No hay conexión a la base de datos.")
+            return None, []
+    except Exception as e:
+        logger.error("Error al obtener el cliente y su historial: %s", e)
+        return None, []
+    return _separar_cliente_e_historial(whatsapp, filas)
+
+async def cargar_cliente_e_historial_async(whatsapp):
+    """Versión asyncio de cargar_cliente_e_historial usando aiomysql"""
+    cliente = cache_clientes.obtener(whatsapp)
+    message_history = cache_historial.obtener(whatsapp)
+    if cliente is not None and message_history is not None:
+        return cliente, message_history
+    try:
+        pool_async = await obtener_pool_async()
+        async with pool_async.acquire() as conn:
+            try:
+                async with conn.cursor() as cursor:
+                    if message_history is not None:
+                        await cursor.execute(SQL_CLIENTE, (whatsapp,))
+                        cliente = await cursor.fetchone()
+                        if cliente:
+                            cache_clientes.guardar(whatsapp, cliente)
+                        return cliente, message_history
+                    await cursor.execute(SQL_CLIENTE_E_HISTORIAL, (whatsapp, HISTORIAL_MAX_MENSAJES))
+                    filas = await cursor.fetchall()
+            finally:
+                # aiomysql cierra en vez de reutilizar una conexion devuelta con la transaccion abierta
+                await conn.rollback()
+    except Exception as e:
+        logger.error("Error al obtener el cliente y su historial: %s", e)
+        return None, []
+    return _separar_cliente_e_historial(whatsapp, list(filas))
+
+class UnidadDeTrabajo:
+    """Acumula las escrituras de un turno y las guarda en una sola transacción"""
+
+    def __init__(self, whatsapp):
+        self.whatsapp = whatsapp
+        self.cliente = None
+        self.mensajes = []
+        self.recordatorios = []
+
+    def guardar_cliente(self, datos, step):
+        """Registra el upsert del cliente junto con su step actual"""
+        self.cliente = (dict(datos), step)
+
+    def guardar_message_log(self, fecha_mensaje, mensaje, message_direction, servicio, step):
+        """Registra un mensaje para message_log"""
+        self.mensajes.append((self.whatsapp, fecha_mensaje, mensaje, message_direction, servicio, step))
+
+    def guardar_recordatorio(self, fecha_recordatorio, numero_semanas):
+        """Registra el recordatorio pendiente del cliente; reemplaza al registrado antes en el turno"""
+        self.recordatorios = [(self.whatsapp, fecha_recordatorio, numero_semanas)]
+
+    def _sentencias(self):
+        # (etapa, sql, parámetros, es_executemany); el upsert del cliente va primero para leer su id
+        if self.cliente:
+            datos, step = self.cliente
+            yield "db_clientes", """
+                INSERT INTO clientes (whatsapp, nombre, mascota_tipo, mascota_nombre, preferencias, step)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE
+                    nombre=VALUES(nombre),
+                    mascota_tipo=VALUES(mascota_tipo),
+                    mascota_nombre=VALUES(mascota_nombre),
+                    preferencias=VALUES(preferencias),
+                    step=VALUES(step),
+                    id=LAST_INSERT_ID(id)
+                """, (
+                    self.whatsapp,
+                    datos['nombre'],
+                    datos.get('mascota_tipo'),
+                    datos.get('mascota_nombre'),
+                    datos.get('preferencias'),
+                    step
+                ), False
+        # executemany agrupa los VALUES en un solo INSERT multi-fila
+        if self.mensajes:
+            yield ("db_message_log", "INSERT INTO message_log (telefono_cliente, fecha_mensaje, mensaje, message_direction, servicio, step) VALUES (%s, %s, %s, %s, %s, %s)",
+                   self.mensajes, True)
+        # Un solo recordatorio pendiente por cliente: se actualiza el que haya y solo si no hay se inserta
+        for usuario, fecha, semanas in self.recordatorios:
+            yield "db_recordatorios", SQL_ACTUALIZAR_PENDIENTE, (fecha, semanas, usuario), False
+            yield "db_recordatorios", SQL_INSERTAR_SI_NO_HAY_PENDIENTE, (usuario, fecha, semanas, usuario), False
+
+    def _despues_de_confirmar(self, cliente_id):
+        if self.cliente:
+            datos, step = self.cliente
+            cache_clientes.guardar(self.whatsapp, {
+                "id": cliente_id,
+                "whatsapp": self.whatsapp,
+                "nombre": datos['nombre'],
+                "mascota_tipo": datos.get('mascota_tipo'),
+                "mascota_nombre": datos.get('mascota_nombre'),
+                "preferencias": datos.get('preferencias'),
+                "step": step
+            })
+        cache_historial.agregar(self.whatsapp, [
+            {"mensaje": mensaje, "message_direction": direccion, "step": step}
+            for _, _, mensaje, direccion, _, step in self.mensajes
+        ])
+        logger.info("Turno guardado para %s: %s mensajes, %s recordatorios", self.whatsapp, len(self.mensajes), len(self.recordatorios))
+
+    def _vaciar(self):
+        self.cliente = None
+        self.mensajes = []
+        self.recordatorios = []
+
+    def confirmar(self):
+        """Escribe todos los cambios pendientes con un único commit"""
+        if not (self.cliente or self.mensajes or self.recordatorios):
+            return
+        try:
+            pool = obtener_pool()
+            if pool:
+                cliente_id = None
+                with pool.conexion() as conn:
+                    with conn.cursor() as cursor:
+                        for etapa, sql, parametros, multiple in self._sentencias():
+                            with metricas.medir(etapa):
+                                if multiple:
+                                    cursor.executemany(sql, parametros)
+                                else:
+                                    cursor.execute(sql, parametros)
+                                    if etapa == "db_clientes":
+                                        # LAST_INSERT_ID(id) hace que lastrowid sea el id también cuando se actualiza
+                                        cliente_id = cursor.lastrowid
+                    with metricas.medir("db_commit"):
+                        conn.commit()
+                self._despues_de_confirmar(cliente_id)
+            else:
+                logger.error("No hay conexión a la base de datos.")
+        except Exception as e:
+            logger.error("Error al guardar el turno del cliente: %s", e)
+        finally:
+            self._vaciar()
+
+    async def confirmar_async(self):
+        """Versión asyncio de confirmar() usando aiomysql"""
+        if not (self.cliente or self.mensajes or self.recordatorios):
+            return
+        try:
+            pool_async = await obtener_pool_async()
+            cliente_id = None
+            async with pool_async.acquire() as conn:
+                try:
+                    async with conn.cursor() as cursor:
+                        for etapa, sql, parametros, multiple in self._sentencias():
+                            with metricas.medir(etapa):
+                                if multiple:
+                                    await cursor.executemany(sql, parametros)
+                                else:
+                                    await cursor.execute(sql, parametros)
+                                    if etapa == "db_clientes":
+                                        cliente_id = cursor.lastrowid
+                    with metricas.medir("db_commit"):
+                        await conn.commit()
+                except Exception:
+                    await conn.rollback()
+                    raise
+            self._despues_de_confirmar(cliente_id)
+        except Exception as e:
+            logger.error("Error al guardar el turno del cliente: %s", e)
+        finally:
+            self._vaciar()
+
 def convertir_a_semanas(intervalo, unidad):
     """Convierte un intervalo de tiempo a semanas."""
     unidad = unidad.lower()
@@ -266,254 +561,509 @@ Ejemplos de formato correcto:
 Cliente: {input}
 """
 
-prompt = PromptTemplate(
-    input_variables=["history", "input", "step"],
-    template=template
-)
+# Las instrucciones se compilan una vez; cada turno solo agrega historial y mensaje
+constructor_prompt = ConstructorPrompt(template)
 
-# --- Configuración de la cadena de conversación ---
-conversation = ConversationChain(
-    prompt=prompt,
-    llm=llm,
-    verbose=False,
-    memory=memory
-)
+# --- Configuración de la conversación ---
+class Conversacion:
+    """Memoria de un cliente y el modelo que le responde; el prompt lo arma constructor_prompt"""
 
-# --- Función principal de interacción ---
-def interactuar(mensaje_usuario, whatsapp_id):
-    """
-    Procesa un mensaje del usuario y genera una respuesta
+    def __init__(self, memory, llm):
+        self.memory = memory
+        self.llm = llm
 
-    Args:
-        mensaje_usuario: El mensaje enviado por el usuario
-        whatsapp_id: El número de WhatsApp del usuario
+def crear_conversacion(message_history):
+    """Crea la memoria y la conversación de un cliente a partir de su historial"""
+    from langchain.memory import ConversationBufferWindowMemory, ConversationSummaryBufferMemory
 
-    Returns:
-        La respuesta generada para el usuario
-    """
-    print(f"\n[INFO] Procesando mensaje: '{mensaje_usuario}' de WhatsApp: {whatsapp_id}")
+    if MEMORIA_RESUMEN_TOKENS > 0:
+        memoria = ConversationSummaryBufferMemory(
+            llm=obtener_llm(),
+            max_token_limit=MEMORIA_RESUMEN_TOKENS,
+            memory_key="history",
+            human_prefix="Cliente",
+            ai_prefix="Asistente"
+        )
+    else:
+        memoria = ConversationBufferWindowMemory(
+            k=max(HISTORIAL_MAX_MENSAJES // 2, 1),
+            memory_key="history",
+            human_prefix="Cliente",
+            ai_prefix="Asistente"
+        )
+    for message in ventana_historial(message_history):
+        if message['message_direction'] == "outbound":
+            memoria.chat_memory.add_ai_message(message['mensaje'])
+        else:
+            memoria.chat_memory.add_user_message(message['mensaje'])
+    return Conversacion(memoria, obtener_llm_respuestas())
+
+# Una conversación por cliente, en un LRU con expiración
+memorias = MemoriasPorCliente(crear_conversacion)
+
+# Respuestas sin LLM para los pasos predecibles
+ruta_rapida = RutaRapida(convertir_a_semanas)
+
+# Respuestas del modelo reutilizables entre clientes; el archivo SQLite se abre en el primer uso de cada proceso
+cache_respuestas = Perezoso(CacheRespuestas)
+
+# Cuota, concurrencia y backoff compartidos para todas las llamadas a Gemini
+planificador_llm = PlanificadorLLM()
+
+# --- Consulta al modelo ---
+# Hilos que envían la respuesta detectada en el stream, para no retener el turno del planificador durante el envío
+RESPUESTA_TEMPRANA_HILOS = int(os.environ.get("EARLY_REPLY_THREADS", "8"))
+_hilos_respuesta_temprana = Perezoso(lambda: ThreadPoolExecutor(max_workers=RESPUESTA_TEMPRANA_HILOS,
+                                                                thread_name_prefix="respuesta-temprana"))
+
+class RespuestaTemprana:
+    """Entrega la respuesta al cliente una sola vez, en cuanto se conoce, y mide el tiempo hasta ese envío"""
+
+    def __init__(self, al_responder, inicio):
+        self.al_responder = al_responder
+        self.inicio = inicio
+        self.enviada = False
+        self.texto = None
+        self._pendiente = None
+
+    def _enviar(self, texto):
+        self.al_responder(texto)
+        metricas.observar("primera_respuesta", time.perf_counter() - self.inicio)
+
+    async def _enviar_async(self, texto):
+        await self.al_responder(texto)
+        metricas.observar("primera_respuesta", time.perf_counter() - self.inicio)
+
+    def adelantar(self, texto):
+        """Lanza el envío en segundo plano sin esperar a la Graph API; se usa dentro del stream"""
+        # Un reintento del planificador puede volver a extraer la misma respuesta
+        if self.enviada:
+            return
+        self.enviada = True
+        self.texto = texto
+        self._pendiente = _hilos_respuesta_temprana.obtener().submit(self._enviar, texto)
+
+    def adelantar_async(self, texto):
+        """Versión asyncio de adelantar: el envío corre en su propia tarea"""
+        if self.enviada:
+            return
+        self.enviada = True
+        self.texto = texto
+        self._pendiente = asyncio.ensure_future(self._enviar_async(texto))
+
+    def esperar(self):
+        """Espera el envío adelantado; los mensajes que siguen no deben llegar antes que la respuesta"""
+        if self._pendiente is not None:
+            self._pendiente.result()
+
+    async def esperar_async(self):
+        if self._pendiente is not None:
+            await self._pendiente
+
+    def enviar(self, texto):
+        """Envía la respuesta si el stream no la adelantó, o espera a que termine el envío adelantado"""
+        if not self.enviada:
+            self.enviada = True
+            self.texto = texto
+            self._enviar(texto)
+        self.esperar()
+
+    async def enviar_async(self, texto):
+        if not self.enviada:
+            self.enviada = True
+            self.texto = texto
+            await self._enviar_async(texto)
+        await self.esperar_async()
+
+    def conciliar(self, respuesta_ia):
+        """Respuesta que se guarda en el turno: el texto que ya recibió el cliente manda sobre el del modelo"""
+        if self.texto is None:
+            return respuesta_ia
+        if respuesta_ia is None:
+            # El modelo falló después del envío adelantado: se guarda lo entregado y el step no cambia
+            return RespuestaIA(respuesta=self.texto)
+        if respuesta_ia.respuesta != self.texto:
+            # Un reintento del planificador generó otro texto; el cliente recibió el primero
+            respuesta_ia.respuesta = self.texto
+        return respuesta_ia
+
+def armar_prompt(conversacion, mensaje_usuario):
+    """Prompt de la llamada y sus tokens: instrucciones, historial de la memoria dentro del presupuesto y mensaje"""
+    memoria = conversacion.memory
+    return constructor_prompt.construir(memoria.chat_memory.messages, mensaje_usuario,
+                                        getattr(memoria, "moving_summary_buffer", ""))
+
+def guardar_en_memoria(conversacion, mensaje_usuario, texto):
+    """Agrega el turno a la memoria sin resumirla; save_context de la memoria con resumen llamaría a Gemini aquí"""
+    conversacion.memory.chat_memory.add_user_message(mensaje_usuario)
+    conversacion.memory.chat_memory.add_ai_message(texto)
+
+def requiere_resumen(conversacion):
+    """True si la memoria con resumen superó MEMORY_SUMMARY_TOKENS; se estima en local para no consultar a Gemini"""
+    if MEMORIA_RESUMEN_TOKENS <= 0:
+        return False
+    mensajes = conversacion.memory.chat_memory.messages
+    return sum(contar_tokens(mensaje.content) for mensaje in mensajes) > MEMORIA_RESUMEN_TOKENS
+
+def resumir_memoria(conversacion, prioridad=PRIORIDAD_NUEVO):
+    """Resume la memoria a través del planificador, con el turno ya respondido"""
+    if not requiere_resumen(conversacion):
+        return
+    try:
+        with metricas.medir("resumen"):
+            planificador_llm.ejecutar(conversacion.memory.prune, prioridad=prioridad)
+    except Exception as e:
+        # La memoria sigue completa y se vuelve a intentar en el próximo turno
+        logger.error("No se pudo resumir la memoria: %s", e)
+
+async def resumir_memoria_async(conversacion, prioridad=PRIORIDAD_NUEVO):
+    """Versión asyncio de resumir_memoria usando aprune"""
+    if not requiere_resumen(conversacion):
+        return
+    try:
+        with metricas.medir("resumen"):
+            await planificador_llm.ejecutar_async(conversacion.memory.aprune, prioridad=prioridad)
+    except Exception as e:
+        logger.error("No se pudo resumir la memoria: %s", e)
+
+def cerrar_llamada(conversacion, mensaje_usuario, texto, tokens_prompt):
+    """Guarda el turno en la memoria y registra los tokens de la llamada"""
+    guardar_en_memoria(conversacion, mensaje_usuario, texto)
+    tokens_respuesta = contar_tokens(texto)
+    metricas.observar_tokens("prompt", tokens_prompt)
+    metricas.observar_tokens("respuesta", tokens_respuesta)
+    logger.debug("Tokens de la llamada: prompt %s, respuesta %s", tokens_prompt, tokens_respuesta)
+    return texto
+
+def predecir(conversacion, mensaje_usuario):
+    """Una llamada al modelo sin streaming"""
+    prompt, tokens_prompt = armar_prompt(conversacion, mensaje_usuario)
+    texto = conversacion.llm.invoke(prompt).content
+    return cerrar_llamada(conversacion, mensaje_usuario, texto, tokens_prompt)
+
+async def predecir_async(conversacion, mensaje_usuario):
+    """Versión asyncio de predecir usando ainvoke"""
+    prompt, tokens_prompt = armar_prompt(conversacion, mensaje_usuario)
+    texto = (await conversacion.llm.ainvoke(prompt)).content
+    return cerrar_llamada(conversacion, mensaje_usuario, texto, tokens_prompt)
+
+def transmitir(conversacion, mensaje_usuario, respuesta_temprana):
+    """Consume el modelo por fragmentos; entrega "respuesta" apenas se cierra y guarda el turno en la memoria al final"""
+    prompt, tokens_prompt = armar_prompt(conversacion, mensaje_usuario)
+    extractor = ExtractorCampo("respuesta")
+    partes = []
+    for fragmento in conversacion.llm.stream(prompt):
+        partes.append(fragmento.content)
+        if extractor.valor is None and extractor.alimentar(fragmento.content) is not None:
+            respuesta_temprana.adelantar(extractor.valor)
+    return cerrar_llamada(conversacion, mensaje_usuario, "".join(partes), tokens_prompt)
+
+async def transmitir_async(conversacion, mensaje_usuario, respuesta_temprana):
+    """Versión asyncio de transmitir usando astream"""
+    prompt, tokens_prompt = armar_prompt(conversacion, mensaje_usuario)
+    extractor = ExtractorCampo("respuesta")
+    partes = []
+    async for fragmento in conversacion.llm.astream(prompt):
+        partes.append(fragmento.content)
+        if extractor.valor is None and extractor.alimentar(fragmento.content) is not None:
+            respuesta_temprana.adelantar_async(extractor.valor)
+    return cerrar_llamada(conversacion, mensaje_usuario, "".join(partes), tokens_prompt)
+
+def consultar_llm(conversacion, mensaje_usuario, prioridad=PRIORIDAD_NUEVO, respuesta_temprana=None):
+    """Consulta al modelo a través del planificador; devuelve (respuesta_ia, None) o (None, mensaje de error)"""
+    try:
+        logger.debug("Enviando mensaje al modelo")
+        def llamar():
+            with metricas.medir("llm"):
+                if respuesta_temprana is not None and LLM_STREAMING:
+                    return transmitir(conversacion, mensaje_usuario, respuesta_temprana)
+                return predecir(conversacion, mensaje_usuario)
+
+        # Obtener respuesta del modelo; la cuota, la concurrencia y los reintentos los gestiona el planificador
+        respuesta_raw = planificador_llm.ejecutar(llamar, prioridad=prioridad)
+    except (CuotaAgotada, PlazoExcedido) as e:
+        logger.error("%s", e)
+        return None, "No se pudo obtener una respuesta de la IA. Por favor, inténtalo de nuevo más tarde."
+    except Exception as e:
+        logger.error("Error inesperado: %s", e)
+        return None, "Hubo un error al procesar tu solicitud. Por favor, inténtalo de nuevo más tarde."
+
+    # Convertir a respuesta tipada sin eval()
+    try:
+        with metricas.medir("parseo"):
+            respuesta_ia = parsear_respuesta(respuesta_raw)
+        logger.debug("Respuesta convertida a diccionario: %s", respuesta_ia)
+        return respuesta_ia, None
+    except RespuestaInvalida as e:
+        logger.error("Error al convertir la respuesta a diccionario: %s", e)
+        return None, "Hubo un error al procesar tu solicitud. Por favor, inténtalo de nuevo más tarde."
+
+async def consultar_llm_async(conversacion, mensaje_usuario, prioridad=PRIORIDAD_NUEVO, respuesta_temprana=None):
+    """Versión asyncio de consultar_llm usando ainvoke o astream"""
+    try:
+        logger.debug("Enviando mensaje al modelo")
+        async def llamar():
+            with metricas.medir("llm"):
+                if respuesta_temprana is not None and LLM_STREAMING:
+                    return await transmitir_async(conversacion, mensaje_usuario, respuesta_temprana)
+                return await predecir_async(conversacion, mensaje_usuario)
+
+        respuesta_raw = await planificador_llm.ejecutar_async(llamar, prioridad=prioridad)
+    except (CuotaAgotada, PlazoExcedido) as e:
+        logger.error("%s", e)
+        return None, "No se pudo obtener una respuesta de la IA. Por favor, inténtalo de nuevo más tarde."
+    except Exception as e:
+        logger.error("Error inesperado: %s", e)
+        return None, "Hubo un error al procesar tu solicitud. Por favor, inténtalo de nuevo más tarde."
 
-    # Obtener información del cliente
-    cliente = obtener_info_cliente(whatsapp_id)
-    datos_cliente = {}
-    datos_nuevos = {}
+    try:
+        with metricas.medir("parseo"):
+            respuesta_ia = parsear_respuesta(respuesta_raw)
+        logger.debug("Respuesta convertida a diccionario: %s", respuesta_ia)
+        return respuesta_ia, None
+    except RespuestaInvalida as e:
+        logger.error("Error al convertir la respuesta a diccionario: %s", e)
+        return None, "Hubo un error al procesar tu solicitud. Por favor, inténtalo de nuevo más tarde."
 
-    # Get the current step for the user
-    if cliente:
-        step = cliente['step']
-        previous_step = step
-        print(f"[INFO] Cliente encontrado, current step: {step}")
-    else:
-        step = 0
-        previous_step = 0
-        print("[INFO] Cliente no encontrado, starting at step 0")
-        # Create a new client with the initial step
-        datos_nuevos = {"nombre": "Desconocido", "step": 0}
-        guardar_info_cliente(whatsapp_id, datos_nuevos)
-        cliente = obtener_info_cliente(whatsapp_id)  # Obtener el cliente recién creado
+# --- Función principal de interacción ---
+class Turno:
+    """Estado de un mensaje entrante; compartido por la versión síncrona y la asyncio de interactuar"""
 
-    if cliente:
-        datos_cliente = {
+    def __init__(self, mensaje_usuario, whatsapp_id, cliente, message_history):
+        self.mensaje_usuario = mensaje_usuario
+        self.whatsapp_id = whatsapp_id
+        self.uow = UnidadDeTrabajo(whatsapp_id)
+
+        # Get the current step for the user
+        if cliente:
+            self.step = cliente['step']
+            logger.debug("Cliente encontrado, current step: %s", self.step)
+        else:
+            self.step = 0
+            logger.debug("Cliente no encontrado, starting at step 0")
+            # Create a new client with the initial step, se guarda al confirmar el turno
+            cliente = {"nombre": "Desconocido", "mascota_tipo": None, "mascota_nombre": None, "preferencias": None, "step": 0}
+            self.uow.guardar_cliente(cliente, 0)
+        self.previous_step = self.step
+        self.cliente = cliente
+
+        self.datos_cliente = {
             "nombre": cliente['nombre'],
             "mascota_tipo": cliente['mascota_tipo'],
             "mascota_nombre": cliente['mascota_nombre'],
             "preferencias": cliente['preferencias'],
         }
-        print(f"[INFO] Datos del cliente: {datos_cliente}")
-
-    # Get the message history of the client
-    message_history = obtener_message_history(whatsapp_id)
-    print(f"[INFO] Historial de mensajes del cliente: {message_history}")
-
-    # Limit the history to the last 3 messages
-    # Format message history for the prompt
-    formatted_history = ""
-    for message in message_history:
-        formatted_history += f"Cliente: {message['mensaje']}\n"
-        
-    # Combine the history with the prompt
-    prompt_con_historial = template.format(history=formatted_history, input=mensaje_usuario, step=step)
-
-    # Retry system for the API
-    max_reintentos = 5
-    reintentos = 0
-    espera = 1
-
-    # Intentar obtener respuesta del modelo
-    while reintentos < max_reintentos:
-        try:
-            print(f"[INFO] Enviando mensaje al modelo (intento {reintentos+1}/{max_reintentos})")
-
-            # Obtener respuesta del modelo
-            respuesta_raw = conversation.predict(input=prompt_con_historial)
-
-            # Limpiar y parsear la respuesta
-            respuesta_limpia = respuesta_raw.strip().replace("json", "", 1).replace("```", "").replace("\n", " ").replace("\r", " ").replace('   ', '').replace(" ", "", 1).replace("python", "", 1)
-            print(f"[INFO] Respuesta recibida: {respuesta_limpia}")
-
-            # Convertir a diccionario
-            try:
-                respuesta_ia = eval(respuesta_limpia)
-                print(f"[INFO] Respuesta convertida a diccionario: {respuesta_ia}")
-                break
-            except Exception as e:
-                print(f"[ERROR] Error al convertir la respuesta a diccionario: {e}")
-                return "Hubo un error al procesar tu solicitud. Por favor, inténtalo de nuevo más tarde."
-        except Exception as e:
-            reintentos += 1
-            if "Resource has been exhausted" in str(e) or "429" in str(e):
-                print(f"[ERROR] Intento {reintentos}/{max_reintentos}: Límite de cuota alcanzado. Esperando {espera} segundos...")
-                time.sleep(espera)
-                espera *= 2
-                espera += random.uniform(0, 0.1)
-            else:
-                print(f"[ERROR] Error inesperado: {e}")
-                return "Hubo un error al procesar tu solicitud. Por favor, inténtalo de nuevo más tarde."
-    else:
-        print(f"[ERROR] Se alcanzó el número máximo de reintentos ({max_reintentos}).")
-        return "No se pudo obtener una respuesta de la IA. Por favor, inténtalo de nuevo más tarde."
-
-    # Extract the step from the response
-    try:
-        step = respuesta_ia['step']
-        print(f"[INFO] Step IA detectado: {step}")
-    except KeyError:
-        print("[WARNING] No se proporcionó un step en la respuesta de la IA, usando el step anterior.")
-
-    # Guardar the current step for the user's message
-    fecha_actual = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    guardar_message_log(whatsapp_id, fecha_actual, mensaje_usuario, "inbound", "SRR", previous_step)
-
-    # Procesar la respuesta y manejar recordatorios e información de mascota
-    intervalo = None
-    nombre_mascota = None
-    preferencia = None
-    raza_mascota = None
-    try:
-        # Verificar si hay un intervalo en la respuesta
-        if 'intervalo' in respuesta_ia:
-            intervalo = respuesta_ia['intervalo']
-            print(f"[INFO] Intervalo detectado: {intervalo}")
-
-        if 'Nombre_mascota' in respuesta_ia:
-            nombre_mascota = respuesta_ia['Nombre_mascota']
-            print(f"[INFO] Nombre de mascota detectado: {nombre_mascota}")
+        logger.debug("Datos del cliente: %s", self.datos_cliente)
+        logger.debug("Historial de mensajes del cliente: %s", message_history)
+
+        # Conversación propia del cliente; si no está en memoria se rehidrata con su historial reciente
+        self.conversacion = memorias.obtener(whatsapp_id, message_history)
+
+        # La cache solo es segura si el prompt no lleva historial propio del cliente
+        memoria = self.conversacion.memory
+        self.prompt_generico = not memoria.chat_memory.messages and not getattr(memoria, "moving_summary_buffer", "")
+        self.clave_cache = CacheRespuestas.clave(self.step, mensaje_usuario, cliente)
+
+        # Los clientes a mitad de conversación tienen prioridad sobre los nuevos
+        self.prioridad = PRIORIDAD_EN_CONVERSACION if self.step else PRIORIDAD_NUEVO
+
+    def respuesta_local(self):
+        """Devuelve la respuesta sin consultar al LLM (ruta rápida o cache), o None"""
+        # Ruta rápida: los pasos predecibles se responden sin consultar al modelo
+        respuesta = ruta_rapida.responder(self.mensaje_usuario, self.step)
+        if respuesta is not None:
+            logger.debug("Respuesta generada sin LLM: %s", respuesta)
+        elif self.prompt_generico:
+            respuesta = cache_respuestas.obtener().obtener(self.clave_cache)
+            if respuesta is not None:
+                logger.debug("Respuesta obtenida de la cache: %s", respuesta)
+        else:
+            cache_respuestas.obtener().omitir()
+        if respuesta is None:
+            return None
+        guardar_en_memoria(self.conversacion, self.mensaje_usuario, json.dumps(respuesta, ensure_ascii=False))
+        return RespuestaIA.desde_dict(respuesta)
+
+    def guardar_en_cache(self, respuesta_ia):
+        """Guarda la respuesta del LLM si el prompt era genérico"""
+        if self.prompt_generico:
+            cache_respuestas.obtener().guardar(self.clave_cache, respuesta_ia.a_dict())
+
+    def aplicar(self, respuesta_ia):
+        """Registra en la unidad de trabajo los cambios derivados de la respuesta y devuelve el texto"""
+        step = self.step
+        datos_nuevos = {}
+
+        # Extract the step from the response
+        if respuesta_ia.step is not None:
+            step = respuesta_ia.step
+            logger.debug("Step IA detectado: %s", step)
+        else:
+            logger.warning("No se proporcionó un step en la respuesta de la IA, usando el step anterior.")
 
-        if 'preferencia' in respuesta_ia:
-            preferencia = respuesta_ia['preferencia']
-            print(f"[INFO] Preferencia detectada: {preferencia}")
+        # Guardar the current step for the user's message
+        fecha_actual = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.uow.guardar_message_log(fecha_actual, self.mensaje_usuario, "inbound", "SRR", self.previous_step)
 
-        if 'raza_mascota' in respuesta_ia:
-            raza_mascota = respuesta_ia['raza_mascota']
-            print(f"[INFO] Raza detectada: {raza_mascota}")
+        # Procesar la respuesta y manejar recordatorios e información de mascota
+        intervalo = respuesta_ia.intervalo
+        nombre_mascota = respuesta_ia.Nombre_mascota
+        preferencia = respuesta_ia.preferencia
+        raza_mascota = respuesta_ia.raza_mascota
+        if intervalo is not None:
+            logger.debug("Intervalo detectado: %s", intervalo)
+        if nombre_mascota:
+            logger.debug("Nombre de mascota detectado: %s", nombre_mascota)
+        if preferencia:
+            logger.debug("Preferencia detectada: %s", preferencia)
+        if raza_mascota:
+            logger.debug("Raza detectada: %s", raza_mascota)
 
         if intervalo is not None:
-            # Convertir a entero y calcular fecha de recordatorio
-            intervalo = int(intervalo)
+            # El parser ya garantiza un entero positivo de semanas
             fecha_recordatorio = datetime.date.today() + datetime.timedelta(weeks=intervalo)
-            print(f"[INFO] Fecha de recordatorio calculada: {fecha_recordatorio}")
+            logger.debug("Fecha de recordatorio calculada: %s", fecha_recordatorio)
 
             # Guardar recordatorio en la base de datos
-            if not cliente:
-                # Crear un nuevo cliente si no existe
-                datos_nuevos = {"nombre": "Desconocido", "step": 0}
-                guardar_info_cliente(whatsapp_id, datos_nuevos)
-                cliente = obtener_info_cliente(whatsapp_id)  # Obtener el cliente recién creado
+            self.uow.guardar_recordatorio(fecha_recordatorio.strftime("%Y-%m-%d"), intervalo)
 
-            # Update the step in the database
-            if cliente:
-                cursor.execute("UPDATE clientes SET step = %s WHERE whatsapp = %s", (step, whatsapp_id))
-                conn.commit()
-                print(f"[INFO] Step actualizado en la base de datos para el cliente {whatsapp_id} a {step}")
-            else:
-                # Create a new client with the initial step
-                datos_nuevos = {"nombre": "Desconocido", "step": step}
-                guardar_info_cliente(whatsapp_id, datos_nuevos)
-                print(f"[INFO] Nuevo cliente creado con step inicial {step}")
-
-            if cliente:
-                guardar_recordatorio(
-                    whatsapp_id,
-                    fecha_recordatorio.strftime("%Y-%m-%d"),
-                    intervalo
-                )
-
-            # Guardar el mensaje de la IA en el message_log
-            guardar_message_log(whatsapp_id, fecha_actual, respuesta_ia['respuesta'], "outbound", "SRR", step)
+        # Update datos_nuevos with nombre_mascota and preferencia from respuesta_ia
+        if nombre_mascota:
+            datos_nuevos["mascota_nombre"] = nombre_mascota
+        if preferencia:
+            datos_nuevos["preferencias"] = preferencia
+        if raza_mascota:
+            datos_nuevos["mascota_tipo"] = raza_mascota
 
-            # Enviar confirmación
-            print("[INFO] Recordatorio guardado correctamente")
+        # Guardar datos del cliente y su step en el mismo upsert
+        datos_actualizados = self.datos_cliente.copy()
+        datos_actualizados.update(datos_nuevos)
+        self.uow.guardar_cliente(datos_actualizados, step)
 
-    except KeyError:
-        print("[INFO] No se proporcionó un intervalo, no se guarda el recordatorio.")
         # Guardar el mensaje de la IA en el message_log
-        guardar_message_log(whatsapp_id, fecha_actual, respuesta_ia['respuesta'], "outbound", "SRR", step)
-    except ValueError as e:
-        print(f"[ERROR] Error al procesar el intervalo: {e}")
-        tipo = mensaje_usuario.lower().split("mi mascota es una")[1].split(".")[0].strip()
-        datos_nuevos["mascota_tipo"] = tipo
-        print(f"[INFO] Tipo de mascota detectado: {tipo}")
-
-    # Update datos_nuevos with nombre_mascota and preferencia from respuesta_ia
-    if nombre_mascota:
-        datos_nuevos["mascota_nombre"] = nombre_mascota
-    if preferencia:
-        datos_nuevos["preferencias"] = preferencia
-
-    if raza_mascota:
-        datos_nuevos["mascota_tipo"] = raza_mascota
-    
-    
-    # Guardar datos nuevos si se encontraron
-    if datos_nuevos or nombre_mascota or preferencia:
-        if cliente:
-            # Actualizar datos existentes
-            datos_actualizados = datos_cliente.copy()
-            datos_actualizados.update(datos_nuevos)
-            if nombre_mascota:
-                datos_actualizados["mascota_nombre"] = nombre_mascota
-            if preferencia:
-                datos_actualizados["preferencias"] = preferencia
-            guardar_info_cliente(whatsapp_id, datos_actualizados)
-        else:
-            # Crear nuevo cliente
-            datos_nuevos = {"nombre": "Desconocido", "step": 0}
-            if nombre_mascota:
-                datos_nuevos["mascota_nombre"] = nombre_mascota
-            if preferencia:
-                datos_nuevos["preferencias"] = preferencia
-            guardar_info_cliente(whatsapp_id, datos_nuevos)
-            print("[INFO] Nuevo cliente creado con datos iniciales")
-
-    # Update the step in the database
-    if cliente:
-        cursor.execute("UPDATE clientes SET step = %s WHERE whatsapp = %s", (step, whatsapp_id))
-        conn.commit()
-        print(f"[INFO] Step actualizado en la base de datos para el cliente {whatsapp_id} a {step}")
+        self.uow.guardar_message_log(fecha_actual, respuesta_ia.respuesta, "outbound", "SRR", step)
+        return respuesta_ia.respuesta
+
+candados_telefono = CandadosPorClave()
+
+# Contadores de los componentes del motor, publicados en /metrics
+metricas.registrar_fuente("pool", lambda: _pool.obtener().estadisticas() if _pool.creado() else {})
+metricas.registrar_fuente("cache_clientes", cache_clientes.estadisticas)
+metricas.registrar_fuente("cache_respuestas", lambda: cache_respuestas.obtener().estadisticas() if cache_respuestas.creado() else {})
+metricas.registrar_fuente("memorias", lambda: memorias.estadisticas())
+metricas.registrar_fuente("ruta_rapida", ruta_rapida.estadisticas)
+metricas.registrar_fuente("planificador_llm", planificador_llm.estadisticas)
+metricas.registrar_fuente("candados", candados_telefono.estadisticas)
+metricas.registrar_fuente("prompt", constructor_prompt.estadisticas)
+
+def olvidar_en_memoria(whatsapp_id):
+    """Descarta lo que este worker guarda en memoria del cliente: otro worker atendió su último turno"""
+    cache_clientes.olvidar_local(whatsapp_id)
+    cache_historial.invalidar(whatsapp_id)
+    memorias.descartar(whatsapp_id)
+
+def interactuar(mensaje_usuario, whatsapp_id, al_responder=None):
+    """
+    Procesa un mensaje del usuario y genera una respuesta
 
-    # Guardar el mensaje de la IA en el message_log
-    fecha_actual = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    guardar_message_log(whatsapp_id, fecha_actual, respuesta_ia['respuesta'], "outbound", "SRR", step)
+    Args:
+        mensaje_usuario: El mensaje enviado por el usuario
+        whatsapp_id: El número de WhatsApp del usuario
+        al_responder: Opcional; recibe el texto de la respuesta apenas se conoce, antes de guardar el turno
+
+    Returns:
+        La respuesta generada para el usuario
+    """
+    logger.info("Procesando mensaje: '%s' de WhatsApp: %s", mensaje_usuario, whatsapp_id)
+    respuesta_temprana = RespuestaTemprana(al_responder, time.perf_counter()) if al_responder else None
+
+    # Un solo turno por cliente a la vez, en este worker y en los demás
+    with metricas.medir("turno"), candados_telefono.bloquear(whatsapp_id) as ajeno:
+        if ajeno:
+            olvidar_en_memoria(whatsapp_id)
+
+        # Obtener información del cliente y su historial en una sola consulta
+        with metricas.medir("historial"):
+            cliente, message_history = cargar_cliente_e_historial(whatsapp_id)
+        with metricas.medir("prompt"):
+            turno = Turno(mensaje_usuario, whatsapp_id, cliente, message_history)
+
+        respuesta_ia = turno.respuesta_local()
+        if respuesta_ia is None:
+            respuesta_ia, mensaje_error = consultar_llm(turno.conversacion, mensaje_usuario, turno.prioridad, respuesta_temprana)
+            if respuesta_ia is not None:
+                turno.guardar_en_cache(respuesta_ia)
+            if respuesta_temprana:
+                respuesta_ia = respuesta_temprana.conciliar(respuesta_ia)
+            if respuesta_ia is None:
+                turno.uow.confirmar()
+                return mensaje_error
+
+        # El cliente recibe la respuesta antes de que se escriba el turno
+        if respuesta_temprana:
+            respuesta_temprana.enviar(respuesta_ia.respuesta)
+        respuesta = turno.aplicar(respuesta_ia)
+
+        # Escribir todo el turno en una sola transacción
+        turno.uow.confirmar()
+        resumir_memoria(turno.conversacion, turno.prioridad)
 
     # Devolver la respuesta al usuario
-    return respuesta_ia['respuesta']
+    return respuesta
+
+async def interactuar_async(mensaje_usuario, whatsapp_id, al_responder=None):
+    """Versión asyncio de interactuar: aiomysql para la base de datos y ainvoke/astream para el modelo; al_responder es una corrutina"""
+    logger.info("Procesando mensaje: '%s' de WhatsApp: %s", mensaje_usuario, whatsapp_id)
+    respuesta_temprana = RespuestaTemprana(al_responder, time.perf_counter()) if al_responder else None
+
+    with metricas.medir("turno"):
+        async with candados_telefono.bloquear_async(whatsapp_id) as ajeno:
+            if ajeno:
+                olvidar_en_memoria(whatsapp_id)
+
+            with metricas.medir("historial"):
+                cliente, message_history = await cargar_cliente_e_historial_async(whatsapp_id)
+            with metricas.medir("prompt"):
+                turno = Turno(mensaje_usuario, whatsapp_id, cliente, message_history)
+
+            respuesta_ia = turno.respuesta_local()
+            if respuesta_ia is None:
+                respuesta_ia, mensaje_error = await consultar_llm_async(turno.conversacion, mensaje_usuario, turno.prioridad, respuesta_temprana)
+                if respuesta_ia is not None:
+                    turno.guardar_en_cache(respuesta_ia)
+                if respuesta_temprana:
+                    respuesta_ia = respuesta_temprana.conciliar(respuesta_ia)
+                if respuesta_ia is None:
+                    await turno.uow.confirmar_async()
+                    return mensaje_error
+
+            if respuesta_temprana:
+                await respuesta_temprana.enviar_async(respuesta_ia.respuesta)
+            respuesta = turno.aplicar(respuesta_ia)
+            await turno.uow.confirmar_async()
+            await resumir_memoria_async(turno.conversacion, turno.prioridad)
+    return respuesta
 
 # --- Pruebas ---
 def truncate_tables():
     """Truncates all tables in the database"""
     try:
-        if conn and cursor:
-            cursor.execute("TRUNCATE TABLE message_log")
-            cursor.execute("TRUNCATE TABLE clientes")
-            cursor.execute("TRUNCATE TABLE recordatorios")
-            conn.commit()
-            print("[INFO] All tables truncated successfully")
+        pool = obtener_pool()
+        if pool:
+            with pool.conexion() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("TRUNCATE TABLE message_log")
+                    cursor.execute("TRUNCATE TABLE clientes")
+                    cursor.execute("TRUNCATE TABLE recordatorios")
+                conn.commit()
+            logger.info("All tables truncated successfully")
         else:
-            print("[ERROR] No hay conexión a la base de datos.")
+            logger.error("No hay conexión a la base de datos.")
     except Exception as e:
-        print(f"[ERROR] Error al truncating tables: {e}")
+        logger.error("Error al truncating tables: %s", e)
 
 if __name__ == "__main__":
+    configurar_logging()
     print("[INFO] Iniciando pruebas del chatbot")
     truncate_tables()
 
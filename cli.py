@@ -0,0 +1,156 @@
+"""
+Comandos de mantenimiento que no deben correr en cada arranque de un worker.
+
+Uso:
+    python cli.py migrar        # crea tablas e índices (una vez por despliegue)
+    python cli.py verificar     # comprueba la conexión a MySQL y la configuración de Gemini
+    python cli.py recordatorios [--una-vez] [--lote 500] [--concurrencia 8]
+    python cli.py exportar message_log|clientes|recordatorios [--formato ndjson|csv] [--telefono ...]
+                           [--desde AAAA-MM-DD] [--hasta AAAA-MM-DD] [--step N] [--despues-de ID] [--salida archivo]
+    python cli.py retencion particionar              # una vez, fuera de horario: reconstruye message_log
+    python cli.py retencion mantener [--dias 180] [--destino tabla|archivos] [--directorio ...]
+"""
+
+import argparse
+import logging
+import sys
+
+from exportacion import EXPORTAR_LOTE, FORMATOS, TABLAS
+from instrumentacion import configurar_logging
+from recordatorios import RECORDATORIOS_INTERVALO, RECORDATORIOS_LOTE
+from retencion import DESTINOS, RETENCION_DESTINO, RETENCION_DIAS, RETENCION_DIRECTORIO, RETENCION_MESES_FUTUROS
+
+logger = logging.getLogger(__name__)
+
+
+def migrar(args):
+    from chatbot_script import obtener_pool
+    from migraciones import migrar as aplicar_migraciones
+
+    pool = obtener_pool()
+    if pool is None:
+        return 1
+    aplicar_migraciones(pool)
+    return 0
+
+
+def verificar(args):
+    from chatbot_script import obtener_llm, obtener_pool
+
+    codigo = 0
+    try:
+        with obtener_pool().conexion() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        logger.info("Base de datos: OK")
+    except Exception as e:
+        logger.error("Base de datos: %s", e)
+        codigo = 1
+    try:
+        obtener_llm()
+        logger.info("Gemini: OK")
+    except Exception as e:
+        logger.error("Gemini: %s", e)
+        codigo = 1
+    return codigo
+
+
+def recordatorios(args):
+    from chatbot_script import obtener_pool
+    from remitentes_whatsapp import RemitentesWhatsApp
+    from recordatorios import DespachadorRecordatorios
+
+    pool = obtener_pool()
+    if pool is None:
+        return 1
+    cliente = RemitentesWhatsApp(max_concurrencia=args.concurrencia, pool_size=max(args.concurrencia, 20))
+    despachador = DespachadorRecordatorios(pool, cliente, lote=args.lote)
+    try:
+        logger.info("Recordatorios: %s", despachador.ejecutar(una_vez=args.una_vez, intervalo=args.intervalo))
+    except KeyboardInterrupt:
+        logger.info("Recordatorios: %s", despachador.estadisticas())
+    finally:
+        cliente.cerrar()
+    return 0
+
+
+def exportar(args):
+    from chatbot_script import crear_conexion
+    from exportacion import Exportacion, FiltroInvalido
+
+    try:
+        exportacion = Exportacion.desde_argumentos(args.tabla, vars(args))
+    except FiltroInvalido as e:
+        logger.error("Exportación: %s", e)
+        return 2
+    salida = open(args.salida, "w", encoding="utf-8", newline="") if args.salida else sys.stdout
+    try:
+        for bloque in exportacion.exportar(crear_conexion, lote=args.lote):
+            salida.write(bloque)
+    finally:
+        if args.salida:
+            salida.close()
+    logger.info("Exportadas %s filas de %s; último id %s", exportacion.exportadas, args.tabla, exportacion.ultimo_id)
+    return 0
+
+
+def retencion(args):
+    from chatbot_script import crear_conexion, obtener_pool
+    from retencion import RetencionMessageLog
+
+    pool = obtener_pool()
+    if pool is None:
+        return 1
+    mantenimiento = RetencionMessageLog(pool, crear_conexion, dias=args.dias, destino=args.destino,
+                                        directorio=args.directorio, meses_futuros=args.meses_futuros)
+    try:
+        if args.accion == "particionar":
+            mantenimiento.particionar()
+        else:
+            resumen = mantenimiento.mantener()
+            logger.info("Retención de message_log: %s", resumen)
+            if resumen["fallidas"]:
+                return 1
+    except RuntimeError as e:
+        logger.error("Retención de message_log: %s", e)
+        return 1
+    return 0
+
+
+def crear_parser():
+    parser = argparse.ArgumentParser(description="Mantenimiento del chatbot")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+    comandos.add_parser("migrar", help="Aplica el esquema de la base de datos").set_defaults(funcion=migrar)
+    comandos.add_parser("verificar", help="Comprueba base de datos y modelo").set_defaults(funcion=verificar)
+    envio = comandos.add_parser("recordatorios", help="Envía los recordatorios vencidos y programa los siguientes")
+    envio.add_argument("--una-vez", action="store_true", help="Termina cuando no quedan vencidos")
+    envio.add_argument("--lote", type=int, default=RECORDATORIOS_LOTE)
+    envio.add_argument("--concurrencia", type=int, default=8)
+    envio.add_argument("--intervalo", type=float, default=RECORDATORIOS_INTERVALO)
+    envio.set_defaults(funcion=recordatorios)
+    exportacion = comandos.add_parser("exportar", help="Exporta una tabla como NDJSON o CSV, en streaming")
+    exportacion.add_argument("tabla", choices=list(TABLAS))
+    exportacion.add_argument("--formato", choices=list(FORMATOS), default="ndjson")
+    exportacion.add_argument("--telefono")
+    exportacion.add_argument("--desde", help="Fecha inicial, incluida (AAAA-MM-DD o AAAA-MM-DD HH:MM:SS)")
+    exportacion.add_argument("--hasta", help="Fecha final, excluida")
+    exportacion.add_argument("--step")
+    exportacion.add_argument("--despues-de", dest="despues_de", help="Retoma después de este id")
+    exportacion.add_argument("--limite", help="Máximo de filas")
+    exportacion.add_argument("--lote", type=int, default=EXPORTAR_LOTE, help="Filas por consulta")
+    exportacion.add_argument("--salida", help="Archivo de salida (por defecto stdout)")
+    exportacion.set_defaults(funcion=exportar)
+    retener = comandos.add_parser("retencion", help="Particiona message_log y archiva los meses fuera de la retención")
+    retener.add_argument("accion", choices=["particionar", "mantener"])
+    retener.add_argument("--dias", type=int, default=RETENCION_DIAS, help="Días de message_log que se conservan")
+    retener.add_argument("--destino", choices=DESTINOS, default=RETENCION_DESTINO)
+    retener.add_argument("--directorio", default=RETENCION_DIRECTORIO, help="Carpeta de los JSONL.gz con --destino archivos")
+    retener.add_argument("--meses-futuros", type=int, default=RETENCION_MESES_FUTUROS)
+    retener.set_defaults(funcion=retencion)
+    return parser
+
+
+if __name__ == "__main__":
+    args = crear_parser().parse_args()
+    # La exportación puede ir a stdout: el log se escribe en stderr para no mezclarse con ella
+    configurar_logging(stream=sys.stderr if args.comando == "exportar" else None)
+    sys.exit(args.funcion(args))
@@ -0,0 +1,273 @@
+"""
+Cliente reutilizable para la API de WhatsApp Cloud (Graph API).
+Mantiene un pool de conexiones keep-alive, los encabezados ya construidos y
+reintenta con backoff ante 429/5xx respetando el encabezado Retry-After.
+Los errores de red solo se reintentan si la conexion no llego a establecerse:
+un timeout de lectura o una conexion cortada despues de enviar el cuerpo pueden
+significar que Meta ya recibio el mensaje, y reintentar lo duplicaria.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
+
+logger = logging.getLogger(__name__)
+
+GRAPH_API_URL = os.environ.get("GRAPH_API_URL", "https://graph.facebook.com")
+GRAPH_API_VERSION = os.environ.get("GRAPH_API_VERSION", "v19.0")
+PHONE_NUMBER_ID = os.environ.get("PHONE_NUMBER_ID", "309696275570080")
+
+CODIGOS_REINTENTABLES = {429, 500, 502, 503, 504}
+# Tope de cada espera entre reintentos, aunque el Retry-After pida más
+ESPERA_MAX_REINTENTO = float(os.environ.get("WHATSAPP_MAX_RETRY_WAIT", "30"))
+
+
+class WhatsAppError(Exception):
+    """Error definitivo al enviar un mensaje por la Graph API"""
+
+    def __init__(self, status_code, texto):
+        super().__init__(f"Error al enviar el mensaje: {status_code} {texto}")
+        self.status_code = status_code
+        self.texto = texto
+
+
+def payload_texto(telefono, mensaje):
+    """Cuerpo de la Graph API para un mensaje de texto"""
+    return {
+        "messaging_product": "whatsapp",
+        "recipient_type": "individual",
+        "to": telefono,
+        "type": "text",
+        "text": {
+            "preview_url": True,
+            "body": mensaje
+        }
+    }
+
+
+def payload_plantilla(telefono, nombre, idioma, parametros=()):
+    """Cuerpo de la Graph API para una plantilla aprobada; parametros llena {{1}}, {{2}}... del cuerpo"""
+    plantilla = {"name": nombre, "language": {"code": idioma}}
+    if parametros:
+        plantilla["components"] = [{
+            "type": "body",
+            "parameters": [{"type": "text", "text": str(parametro)} for parametro in parametros]
+        }]
+    return {
+        "messaging_product": "whatsapp",
+        "recipient_type": "individual",
+        "to": telefono,
+        "type": "template",
+        "template": plantilla
+    }
+
+
+class Plantilla:
+    """
+    Mensaje de plantilla aprobada en WhatsApp Manager. Fuera de la ventana de 24 horas
+    desde el ultimo mensaje del cliente la Graph API solo entrega plantillas; el texto
+    libre se rechaza (error 131047).
+    """
+
+    def __init__(self, nombre, idioma, parametros=()):
+        self.nombre = nombre
+        self.idioma = idioma
+        self.parametros = tuple(parametros)
+
+    def payload(self, telefono):
+        return payload_plantilla(telefono, self.nombre, self.idioma, self.parametros)
+
+
+def payload_mensaje(telefono, mensaje):
+    """Cuerpo para un texto libre (str) o una Plantilla"""
+    if isinstance(mensaje, Plantilla):
+        return mensaje.payload(telefono)
+    return payload_texto(telefono, mensaje)
+
+
+def espera_reintento(intento, retry_after, backoff, espera_max=ESPERA_MAX_REINTENTO):
+    """Respeta el Retry-After de la API cuando viene en segundos; si no, backoff exponencial. Nunca más de espera_max"""
+    if retry_after:
+        try:
+            return min(max(float(retry_after), 0.0), espera_max)
+        except ValueError:
+            pass
+    return min(backoff * (2 ** intento) + random.uniform(0, 0.1), espera_max)
+
+
+def fallo_al_conectar(error):
+    """Indica si el error de requests ocurrió antes de enviar la solicitud (no se pudo abrir la conexión)"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.ConnectionError) or not error.args:
+        return False
+    # requests envuelve el MaxRetryError de urllib3; NewConnectionError hereda de ConnectTimeoutError
+    razon = getattr(error.args[0], "reason", error.args[0])
+    return isinstance(razon, ConnectTimeoutError)
+
+
+class WhatsAppClient:
+    """Cliente de la Graph API con sesion HTTP persistente y reintentos"""
+
+    def __init__(self, access_token=None, phone_number_id=PHONE_NUMBER_ID, base_url=GRAPH_API_URL,
+                 api_version=GRAPH_API_VERSION, timeout=(3.05, 10), max_reintentos=3,
+                 backoff=0.5, pool_size=20, max_concurrencia=8, espera_max=ESPERA_MAX_REINTENTO):
+        access_token = access_token or os.environ.get("ACCESS_TOKEN")
+        if access_token is None:
+            raise ValueError("The WHATSAPP_ACCESS_TOKEN environment variable is not set.")
+        self.phone_number_id = phone_number_id
+        self.url = f"{base_url.rstrip('/')}/{api_version}/{phone_number_id}/messages"
+        self.timeout = timeout
+        self.max_reintentos = max_reintentos
+        self.backoff = backoff
+        self.espera_max = espera_max
+        self.max_concurrencia = max_concurrencia
+
+        self.session = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adaptador)
+        self.session.mount("http://", adaptador)
+        self.session.headers.update({
+            'Authorization': f'Bearer {access_token}',
+            'Content-Type': 'application/json'
+        })
+        self._executor = None
+
+    def enviar_texto(self, telefono, mensaje):
+        """Envia un mensaje de texto y devuelve el JSON de la respuesta"""
+        return self._post(payload_texto(telefono, mensaje))
+
+    def enviar_plantilla(self, telefono, plantilla):
+        """Envia una Plantilla y devuelve el JSON de la respuesta"""
+        return self._post(plantilla.payload(telefono))
+
+    def enviar(self, telefono, mensaje):
+        """Envia un texto (str) o una Plantilla"""
+        return self._post(payload_mensaje(telefono, mensaje))
+
+    def _post(self, payload):
+        intento = 0
+        while True:
+            try:
+                response = self.session.post(self.url, json=payload, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if not fallo_al_conectar(e) or intento >= self.max_reintentos:
+                    raise WhatsAppError(None, str(e))
+                espera = self._espera(intento, None)
+            else:
+                if response.status_code == 200:
+                    return response.json()
+                if response.status_code not in CODIGOS_REINTENTABLES or intento >= self.max_reintentos:
+                    raise WhatsAppError(response.status_code, response.text)
+                espera = self._espera(intento, response.headers.get("Retry-After"))
+            intento += 1
+            logger.error("Intento %s/%s fallido al enviar a WhatsApp. Esperando %.2f segundos...", intento, self.max_reintentos, espera)
+            time.sleep(espera)
+
+    def _espera(self, intento, retry_after):
+        return espera_reintento(intento, retry_after, self.backoff, self.espera_max)
+
+    def enviar_lote(self, mensajes):
+        """Envia varios (telefono, texto o Plantilla) en paralelo y devuelve resultados o excepciones en orden"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrencia,
+                                                thread_name_prefix="whatsapp-envio")
+        futuros = [self._executor.submit(self.enviar, telefono, mensaje) for telefono, mensaje in mensajes]
+        resultados = []
+        for futuro in futuros:
+            try:
+                resultados.append(futuro.result())
+            except WhatsAppError as e:
+                resultados.append(e)
+        return resultados
+
+    def cerrar(self):
+        """Cierra el pool de conexiones y los hilos de envio"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.session.close()
+
+
+class ClienteWhatsAppAsync:
+    """Version asyncio del cliente: httpx.AsyncClient con pool keep-alive y los mismos reintentos"""
+
+    def __init__(self, access_token=None, phone_number_id=PHONE_NUMBER_ID, base_url=GRAPH_API_URL,
+                 api_version=GRAPH_API_VERSION, timeout=(3.05, 10), max_reintentos=3,
+                 backoff=0.5, pool_size=100, espera_max=ESPERA_MAX_REINTENTO):
+        import httpx
+
+        access_token = access_token or os.environ.get("ACCESS_TOKEN")
+        if access_token is None:
+            raise ValueError("The WHATSAPP_ACCESS_TOKEN environment variable is not set.")
+        self.phone_number_id = phone_number_id
+        self.url = f"{base_url.rstrip('/')}/{api_version}/{phone_number_id}/messages"
+        self.max_reintentos = max_reintentos
+        self.backoff = backoff
+        self.espera_max = espera_max
+        self._httpx = httpx
+        # Errores en los que la solicitud no llegó a salir: se pueden reintentar sin duplicar el mensaje
+        self._errores_antes_de_enviar = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+        self.client = httpx.AsyncClient(
+            headers={
+                'Authorization': f'Bearer {access_token}',
+                'Content-Type': 'application/json'
+            },
+            timeout=httpx.Timeout(timeout[1], connect=timeout[0]),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        )
+        # La espera por conexión se hace aquí: el pool de httpx se degrada con muchas solicitudes encoladas
+        self._semaforo = asyncio.Semaphore(pool_size)
+
+    async def enviar_texto(self, telefono, mensaje):
+        """Envia un mensaje de texto y devuelve el JSON de la respuesta"""
+        return await self._post(payload_texto(telefono, mensaje))
+
+    async def enviar_plantilla(self, telefono, plantilla):
+        """Envia una Plantilla y devuelve el JSON de la respuesta"""
+        return await self._post(plantilla.payload(telefono))
+
+    async def enviar(self, telefono, mensaje):
+        """Envia un texto (str) o una Plantilla"""
+        return await self._post(payload_mensaje(telefono, mensaje))
+
+    async def _post(self, payload):
+        intento = 0
+        while True:
+            try:
+                async with self._semaforo:
+                    response = await self.client.post(self.url, json=payload)
+            except self._httpx.TransportError as e:
+                if not isinstance(e, self._errores_antes_de_enviar) or intento >= self.max_reintentos:
+                    raise WhatsAppError(None, str(e))
+                espera = espera_reintento(intento, None, self.backoff, self.espera_max)
+            else:
+                if response.status_code == 200:
+                    return response.json()
+                if response.status_code not in CODIGOS_REINTENTABLES or intento >= self.max_reintentos:
+                    raise WhatsAppError(response.status_code, response.text)
+                espera = espera_reintento(intento, response.headers.get("Retry-After"), self.backoff, self.espera_max)
+            intento += 1
+            logger.error("Intento %s/%s fallido al enviar a WhatsApp. Esperando %.2f segundos...", intento, self.max_reintentos, espera)
+            await asyncio.sleep(espera)
+
+    async def enviar_lote(self, mensajes):
+        """Envia varios (telefono, texto o Plantilla) concurrentemente y devuelve resultados o excepciones en orden"""
+        resultados = await asyncio.gather(
+            *(self.enviar(telefono, mensaje) for telefono, mensaje in mensajes), return_exceptions=True
+        )
+        for resultado in resultados:
+            if isinstance(resultado, Exception) and not isinstance(resultado, WhatsAppError):
+                raise resultado
+        return resultados
+
+    async def cerrar(self):
+        """Cierra el pool de conexiones"""
+        await self.client.aclose()
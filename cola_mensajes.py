@@ -0,0 +1,130 @@
+"""
+Cola de procesamiento en segundo plano para los mensajes del webhook.
+El webhook solo valida y encola; un pool de hilos ejecuta interactuar() y
+enviar(). Cada telefono se asigna siempre al mismo hilo, asi sus mensajes se
+procesan en orden mientras telefonos distintos avanzan en paralelo.
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+
+from instrumentacion import metricas
+
+logger = logging.getLogger(__name__)
+
+NUM_WORKERS = int(os.environ.get("WEBHOOK_WORKERS", "4"))
+MAX_PENDIENTES = int(os.environ.get("WEBHOOK_MAX_PENDING", "1000"))
+
+
+class ColaMensajes:
+    """Pool de hilos con una cola por hilo, particionado por telefono"""
+
+    def __init__(self, procesar, num_workers=NUM_WORKERS, max_pendientes=MAX_PENDIENTES):
+        self.procesar = procesar
+        self.num_workers = num_workers
+        self.max_pendientes = max_pendientes
+        self._colas = []
+        self._hilos = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._metricas_lock = threading.Lock()
+        self._procesados = 0
+        self._errores = 0
+        self._rechazados = 0
+        self._espera_total = 0.0
+        self._proceso_total = 0.0
+        self._proceso_max = 0.0
+        self._procesados_por_worker = [0] * num_workers
+        self._ocupado_por_worker = [0.0] * num_workers
+
+    def _iniciar(self):
+        # Los hilos se crean en el primer uso y se recrean tras un fork de Gunicorn
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._colas = [queue.Queue(maxsize=self.max_pendientes) for _ in range(self.num_workers)]
+            self._hilos = []
+            for indice, cola in enumerate(self._colas):
+                hilo = threading.Thread(target=self._trabajar, args=(indice, cola), name=f"webhook-worker-{indice}", daemon=True)
+                hilo.start()
+                self._hilos.append(hilo)
+            self._pid = os.getpid()
+
+    def particion(self, telefono):
+        """Devuelve el indice del hilo que atiende al telefono"""
+        return zlib.crc32(str(telefono).encode("utf-8")) % self.num_workers
+
+    def encolar(self, telefono, *args):
+        """Encola un mensaje sin bloquear; devuelve False si la cola esta llena"""
+        self._iniciar()
+        try:
+            self._colas[self.particion(telefono)].put_nowait((time.monotonic(), telefono, args))
+            return True
+        except queue.Full:
+            with self._metricas_lock:
+                self._rechazados += 1
+            logger.error("Cola llena, mensaje descartado para %s", telefono)
+            return False
+
+    def _trabajar(self, indice, cola):
+        while True:
+            encolado, telefono, args = cola.get()
+            if telefono is None:
+                cola.task_done()
+                return
+            inicio = time.monotonic()
+            metricas.observar("cola_espera", inicio - encolado)
+            error = False
+            try:
+                self.procesar(telefono, *args)
+            except Exception as e:
+                error = True
+                logger.error("Error al procesar el mensaje de %s: %s", telefono, e)
+            finally:
+                fin = time.monotonic()
+                with self._metricas_lock:
+                    self._procesados += 1
+                    self._errores += error
+                    self._espera_total += inicio - encolado
+                    duracion = fin - inicio
+                    self._proceso_total += duracion
+                    self._proceso_max = max(self._proceso_max, duracion)
+                    self._procesados_por_worker[indice] += 1
+                    self._ocupado_por_worker[indice] += duracion
+                cola.task_done()
+
+    def metricas(self):
+        """Devuelve profundidad de la cola, latencias de procesamiento y reparto entre hilos"""
+        with self._metricas_lock:
+            procesados = self._procesados
+            # Desbalance: tiempo ocupado del hilo más cargado sobre el promedio (1.0 = reparto parejo)
+            ocupado_promedio = sum(self._ocupado_por_worker) / self.num_workers
+            return {
+                "profundidad": sum(cola.qsize() for cola in self._colas),
+                "profundidad_por_worker": [cola.qsize() for cola in self._colas],
+                "procesados": procesados,
+                "errores": self._errores,
+                "rechazados": self._rechazados,
+                "espera_promedio_s": self._espera_total / procesados if procesados else 0.0,
+                "proceso_promedio_s": self._proceso_total / procesados if procesados else 0.0,
+                "proceso_max_s": self._proceso_max,
+                "procesados_por_worker": list(self._procesados_por_worker),
+                "ocupado_por_worker_s": list(self._ocupado_por_worker),
+                "desbalance": max(self._ocupado_por_worker) / ocupado_promedio if ocupado_promedio else 1.0,
+            }
+
+    def detener(self, timeout=None):
+        """Procesa los mensajes pendientes y detiene los hilos"""
+        if self._pid != os.getpid():
+            return
+        for cola in self._colas:
+            cola.put((time.monotonic(), None, ()))
+        for hilo in self._hilos:
+            hilo.join(timeout)
+        self._pid = None
@@ -0,0 +1,94 @@
+"""
+Prompt de cada llamada a Gemini.
+Las instrucciones fijas de la plantilla se compilan una vez por proceso (se
+resuelven los escapes {{ }} y se cuentan sus tokens); en cada turno solo se
+agregan el historial del cliente, recortado a un presupuesto de tokens, y su
+mensaje. Devuelve tambien los tokens del prompt para medir el costo por turno.
+"""
+
+import threading
+
+from historial import HISTORIAL_MAX_MENSAJES, HISTORIAL_MAX_TOKENS, contar_tokens
+
+# Prefijos con los que LangChain escribe cada tipo de mensaje en {history}
+PREFIJOS = {"human": "Cliente", "ai": "Asistente", "system": "System"}
+
+
+class ConstructorPrompt:
+    """Prefijo estatico precompilado mas historial acotado por tokens y mensaje del cliente"""
+
+    def __init__(self, plantilla, max_mensajes=HISTORIAL_MAX_MENSAJES, max_tokens_historial=HISTORIAL_MAX_TOKENS,
+                 contar=contar_tokens):
+        prefijo, separador, resto = plantilla.partition("{history}")
+        antes, separador_entrada, despues = resto.partition("{input}")
+        if not separador or not separador_entrada:
+            raise ValueError("La plantilla debe contener {history} y después {input}")
+        self.prefijo = self._sin_escapes(prefijo)
+        self.antes_entrada = self._sin_escapes(antes)
+        self.despues_entrada = self._sin_escapes(despues)
+        self.max_mensajes = max_mensajes
+        self.max_tokens_historial = max_tokens_historial
+        self.contar = contar
+        self._tokens_fijos = None
+        self._lock = threading.Lock()
+        self.construidos = 0
+        self.recortados = 0
+        self.mensajes_descartados = 0
+
+    @staticmethod
+    def _sin_escapes(texto):
+        return texto.replace("{{", "{").replace("}}", "}")
+
+    def tokens_fijos(self):
+        """Tokens del prefijo y del texto alrededor del mensaje; se cuentan una vez (el tokenizador se carga en el primer uso)"""
+        if self._tokens_fijos is None:
+            self._tokens_fijos = self.contar(self.prefijo + self.antes_entrada + self.despues_entrada)
+        return self._tokens_fijos
+
+    def construir(self, mensajes, entrada, resumen=""):
+        """
+        Arma el prompt con los mensajes más recientes que caben en el presupuesto
+
+        Args:
+            mensajes: Mensajes de la memoria (con .type y .content), el más antiguo primero
+            entrada: El mensaje actual del cliente
+            resumen: Resumen de la conversación anterior, si la memoria resume
+
+        Returns:
+            (prompt, tokens) con los tokens aproximados del prompt completo
+        """
+        lineas = []
+        tokens_historial = self.contar(resumen) if resumen else 0
+        recientes = mensajes[-self.max_mensajes:] if self.max_mensajes else []
+        for mensaje in reversed(recientes):
+            linea = f"{PREFIJOS.get(mensaje.type, mensaje.type)}: {mensaje.content}"
+            tokens = self.contar(linea)
+            if tokens_historial + tokens > self.max_tokens_historial:
+                break
+            lineas.append(linea)
+            tokens_historial += tokens
+        incluidos = len(lineas)
+        if resumen:
+            lineas.append(f"{PREFIJOS['system']}: {resumen}")
+        lineas.reverse()
+
+        descartados = len(mensajes) - incluidos
+        with self._lock:
+            self.construidos += 1
+            if len(recientes) > incluidos:
+                self.recortados += 1
+            self.mensajes_descartados += descartados
+
+        prompt = "".join((self.prefijo, "\n".join(lineas), self.antes_entrada, entrada, self.despues_entrada))
+        return prompt, self.tokens_fijos() + tokens_historial + self.contar(entrada)
+
+    def estadisticas(self):
+        """Devuelve prompts armados, cuántos recortó el presupuesto y los tokens del prefijo"""
+        with self._lock:
+            return {
+                "construidos": self.construidos,
+                "recortados_por_tokens": self.recortados,
+                "mensajes_fuera_de_ventana": self.mensajes_descartados,
+                "tokens_fijos": self._tokens_fijos or 0,
+                "max_tokens_historial": self.max_tokens_historial,
+            }
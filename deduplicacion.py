@@ -0,0 +1,117 @@
+"""
+Deduplicacion de entregas del webhook por id de mensaje de WhatsApp.
+Meta reintenta la entrega si no respondemos a tiempo; un mensaje ya visto se
+descarta antes de encolarlo, sin tocar el LLM ni MySQL. Nivel 1: conjunto en
+memoria con expiracion. Nivel 2: archivo SQLite compartido por los workers del
+host, donde el INSERT decide de forma atomica que worker se queda el mensaje.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEDUP_TTL = int(os.environ.get("WEBHOOK_DEDUP_TTL", str(24 * 3600)))
+DEDUP_MAX = int(os.environ.get("WEBHOOK_DEDUP_SIZE", "100000"))
+DEDUP_RUTA = os.environ.get("WEBHOOK_DEDUP_PATH", "deduplicacion.db")
+
+
+class Deduplicador:
+    """Conjunto de ids vistos, acotado y con expiración, con nivel SQLite opcional"""
+
+    def __init__(self, ttl=DEDUP_TTL, max_size=DEDUP_MAX, ruta=DEDUP_RUTA):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.ruta = ruta
+        self._vistos = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._registros = 0
+        self.nuevos = 0
+        self.duplicados = 0
+        self.duplicados_compartidos = 0
+        if ruta:
+            self._sqlite().execute("CREATE TABLE IF NOT EXISTS vistos (id TEXT PRIMARY KEY, expira REAL)")
+
+    def _sqlite(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.ruta, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def registrar(self, id_mensaje):
+        """Marca el id como visto; devuelve True si es la primera vez"""
+        ahora = time.time()
+        with self._lock:
+            self._purgar(ahora)
+            if id_mensaje in self._vistos:
+                self.duplicados += 1
+                return False
+            self._vistos[id_mensaje] = ahora + self.ttl
+            while len(self._vistos) > self.max_size:
+                self._vistos.popitem(last=False)
+            self._registros += 1
+            limpiar = self._registros % 1000 == 0
+
+        if self.ruta:
+            try:
+                conn = self._sqlite()
+                # Inserta, o reutiliza la fila si ya expiró; rowcount 0 = otro worker lo vio antes
+                nuevo = conn.execute(
+                    "INSERT INTO vistos (id, expira) VALUES (?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET expira = excluded.expira WHERE vistos.expira < ?",
+                    (id_mensaje, ahora + self.ttl, ahora)
+                ).rowcount == 1
+                if limpiar:
+                    conn.execute("DELETE FROM vistos WHERE expira < ?", (ahora,))
+            except sqlite3.Error as e:
+                logger.error("Error en la deduplicación compartida: %s", e)
+                nuevo = True
+            if not nuevo:
+                with self._lock:
+                    self.duplicados += 1
+                    self.duplicados_compartidos += 1
+                return False
+
+        with self._lock:
+            self.nuevos += 1
+        return True
+
+    def olvidar(self, ids):
+        """Quita ids registrados que no se pudieron encolar, para aceptar el reintento de Meta"""
+        with self._lock:
+            for id_mensaje in ids:
+                self._vistos.pop(id_mensaje, None)
+        if self.ruta and ids:
+            try:
+                self._sqlite().execute(
+                    f"DELETE FROM vistos WHERE id IN ({', '.join('?' * len(ids))})", list(ids)
+                )
+            except sqlite3.Error as e:
+                logger.error("Error en la deduplicación compartida: %s", e)
+
+    def _purgar(self, ahora):
+        # El TTL es fijo, así que el orden de inserción es también el orden de expiración
+        while self._vistos:
+            id_mensaje, expira = next(iter(self._vistos.items()))
+            if expira > ahora:
+                return
+            del self._vistos[id_mensaje]
+
+    def estadisticas(self):
+        """Devuelve mensajes nuevos, duplicados descartados y tamaño del conjunto en memoria"""
+        with self._lock:
+            return {
+                "nuevos": self.nuevos,
+                "duplicados": self.duplicados,
+                "duplicados_compartidos": self.duplicados_compartidos,
+                "en_memoria": len(self._vistos),
+            }
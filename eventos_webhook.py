@@ -0,0 +1,91 @@
+"""
+Lectura de las notificaciones del webhook de WhatsApp.
+Meta puede agrupar varias entradas, cambios y mensajes en una sola entrega, o
+enviar solo actualizaciones de estado (sent/delivered/read). Aqui se recorren
+todos los mensajes de texto, se descartan los estados sin mas trabajo y los
+mensajes de un mismo telefono se unen en un solo turno del chatbot.
+"""
+
+import re
+from dataclasses import dataclass, field
+
+RE_CLAVE_MENSAJES = re.compile(rb'"messages"\s*:')
+
+
+@dataclass
+class TurnoEntrante:
+    """Mensajes de un telefono dentro de una entrega, procesados como un solo turno"""
+    telefono: str
+    textos: list = field(default_factory=list)
+    timestamp: str = None
+    ids: list = field(default_factory=list)
+    # phone_number_id de nuestro número que recibió el mensaje; la respuesta sale por él
+    numero: str = None
+
+    @property
+    def mensaje(self):
+        return "\n".join(self.textos)
+
+
+@dataclass
+class Entrega:
+    """Resultado de leer una notificación"""
+    turnos: list = field(default_factory=list)
+    mensajes: int = 0
+    estados: int = 0
+    ignorados: int = 0
+    duplicados: int = 0
+
+
+def trae_mensajes(cuerpo):
+    """Descarte barato antes de parsear: una entrega sin la clave "messages" solo trae estados"""
+    # Buscar la clave y no el texto: todas las entregas llevan "field": "messages"
+    return RE_CLAVE_MENSAJES.search(cuerpo) is not None
+
+
+def _orden(mensaje):
+    try:
+        return int(mensaje.get("timestamp") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def leer_entrega(data, es_nuevo=None):
+    """Recorre entry/changes/messages y agrupa los mensajes de texto por teléfono
+
+    es_nuevo(id) decide si un mensaje ya se recibió en una entrega anterior; los repetidos se descartan.
+    """
+    entrega = Entrega()
+    if not isinstance(data, dict):
+        return entrega
+    por_telefono = {}
+    numeros = {}
+    for entry in data.get("entry") or ():
+        for change in entry.get("changes") or ():
+            value = change.get("value") or {}
+            numero = (value.get("metadata") or {}).get("phone_number_id")
+            # Las notificaciones de estado no traen "messages"; solo se cuentan
+            entrega.estados += len(value.get("statuses") or ())
+            for mensaje in value.get("messages") or ():
+                telefono = mensaje.get("from")
+                if mensaje.get("type", "text") != "text" or not telefono or not (mensaje.get("text") or {}).get("body"):
+                    entrega.ignorados += 1
+                    continue
+                if es_nuevo is not None and mensaje.get("id") and not es_nuevo(mensaje["id"]):
+                    entrega.duplicados += 1
+                    continue
+                entrega.mensajes += 1
+                por_telefono.setdefault(telefono, []).append(mensaje)
+                numeros[telefono] = numero
+
+    for telefono, mensajes in por_telefono.items():
+        # Meta no garantiza el orden dentro de la entrega; sort es estable ante timestamps iguales
+        mensajes.sort(key=_orden)
+        entrega.turnos.append(TurnoEntrante(
+            telefono=telefono,
+            textos=[mensaje["text"]["body"] for mensaje in mensajes],
+            timestamp=mensajes[-1].get("timestamp"),
+            ids=[mensaje["id"] for mensaje in mensajes if mensaje.get("id")],
+            numero=numeros[telefono],
+        ))
+    return entrega
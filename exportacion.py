@@ -0,0 +1,206 @@
+"""
+Exportacion de message_log, clientes y recordatorios para analisis.
+Las filas se leen con un cursor del lado del servidor (SSDictCursor) en paginas
+por id (WHERE id > ultimo ORDER BY id LIMIT lote) y se escriben como NDJSON o
+CSV a medida que llegan: la memoria no crece con el tamaño de la tabla, ninguna
+consulta mantiene abierto un resultado de millones de filas y una exportacion
+cortada se retoma con despues_de=<ultimo id recibido>. Cada exportacion abre
+su propia conexion para no ocupar las del pool del chatbot.
+
+Uso:
+    python cli.py exportar message_log --formato csv --desde 2025-01-01 > message_log.csv
+    curl -H "Authorization: Bearer $EXPORT_TOKEN" "/exportar/clientes?formato=ndjson&step=6"
+"""
+
+import csv
+import datetime
+import io
+import json
+import os
+import threading
+
+from pymysql.cursors import SSDictCursor
+
+EXPORTAR_LOTE = int(os.environ.get("EXPORT_BATCH", "5000"))
+# Caracteres por bloque enviado: agrupa filas para no escribir en el socket una vez por fila
+EXPORTAR_BLOQUE = int(os.environ.get("EXPORT_CHUNK", "65536"))
+EXPORTAR_MAX_SIMULTANEAS = int(os.environ.get("EXPORT_MAX_CONCURRENT", "2"))
+# Sin token la ruta /exportar/ queda deshabilitada; la CLI no lo necesita
+EXPORTAR_TOKEN = os.environ.get("EXPORT_TOKEN", "")
+
+FORMATOS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+# Columnas exportadas y la columna sobre la que se aplica cada filtro (None = filtro no disponible)
+TABLAS = {
+    "message_log": {
+        "columnas": ("id", "telefono_cliente", "fecha_mensaje", "mensaje", "message_direction", "servicio", "step"),
+        "telefono": "telefono_cliente",
+        "fecha": "fecha_mensaje",
+        "step": "step",
+    },
+    "clientes": {
+        "columnas": ("id", "whatsapp", "nombre", "mascota_tipo", "mascota_nombre", "preferencias", "step"),
+        "telefono": "whatsapp",
+        "fecha": None,
+        "step": "step",
+    },
+    "recordatorios": {
+        "columnas": ("id", "usuario", "fecha_recordatorio", "numero_semanas", "estado", "intentos", "enviado_en"),
+        "telefono": "usuario",
+        "fecha": "fecha_recordatorio",
+        "step": None,
+    },
+}
+
+# Exportaciones en curso en este proceso; /exportar/ responde 503 si no hay lugar
+exportaciones_en_curso = threading.BoundedSemaphore(EXPORTAR_MAX_SIMULTANEAS)
+
+
+class FiltroInvalido(ValueError):
+    """Tabla, formato o filtro de exportacion no valido"""
+
+
+def _fecha(valor, nombre):
+    if not valor:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(valor)
+    except ValueError:
+        raise FiltroInvalido(f"{nombre} debe ser una fecha ISO (AAAA-MM-DD o AAAA-MM-DD HH:MM:SS)") from None
+
+
+def _entero(valor, nombre, minimo=0):
+    if valor in (None, ""):
+        return None
+    try:
+        numero = int(valor)
+    except (TypeError, ValueError):
+        raise FiltroInvalido(f"{nombre} debe ser un entero") from None
+    if numero < minimo:
+        raise FiltroInvalido(f"{nombre} debe ser mayor o igual que {minimo}")
+    return numero
+
+
+class Exportacion:
+    """Una exportacion de una tabla con sus filtros; recorre las filas por paginas de id"""
+
+    def __init__(self, tabla, formato="ndjson", telefono=None, desde=None, hasta=None, step=None,
+                 despues_de=0, limite=None):
+        if tabla not in TABLAS:
+            raise FiltroInvalido(f"Tabla desconocida: {tabla} (disponibles: {', '.join(TABLAS)})")
+        if formato not in FORMATOS:
+            raise FiltroInvalido(f"Formato desconocido: {formato} (disponibles: {', '.join(FORMATOS)})")
+        self.tabla = tabla
+        self.formato = formato
+        self.definicion = TABLAS[tabla]
+        if (desde or hasta) and not self.definicion["fecha"]:
+            raise FiltroInvalido(f"{tabla} no admite filtro por fecha")
+        if step is not None and not self.definicion["step"]:
+            raise FiltroInvalido(f"{tabla} no admite filtro por step")
+        self.telefono = telefono or None
+        self.desde = desde
+        self.hasta = hasta
+        self.step = step
+        self.despues_de = despues_de
+        self.limite = limite
+        self.ultimo_id = despues_de
+        self.exportadas = 0
+
+    @classmethod
+    def desde_argumentos(cls, tabla, argumentos):
+        """Construye la exportacion desde parametros de texto (query string de Flask o argparse)"""
+        return cls(
+            tabla,
+            formato=argumentos.get("formato") or "ndjson",
+            telefono=argumentos.get("telefono"),
+            desde=_fecha(argumentos.get("desde"), "desde"),
+            hasta=_fecha(argumentos.get("hasta"), "hasta"),
+            step=_entero(argumentos.get("step"), "step"),
+            despues_de=_entero(argumentos.get("despues_de"), "despues_de") or 0,
+            limite=_entero(argumentos.get("limite"), "limite", minimo=1),
+        )
+
+    @property
+    def tipo_contenido(self):
+        return FORMATOS[self.formato]
+
+    def consulta(self, despues_de, lote):
+        """SQL y parametros de la pagina que sigue al id despues_de"""
+        condiciones = ["id > %s"]
+        parametros = [despues_de]
+        if self.telefono:
+            condiciones.append(f"{self.definicion['telefono']} = %s")
+            parametros.append(self.telefono)
+        if self.desde:
+            condiciones.append(f"{self.definicion['fecha']} >= %s")
+            parametros.append(self.desde)
+        if self.hasta:
+            condiciones.append(f"{self.definicion['fecha']} < %s")
+            parametros.append(self.hasta)
+        if self.step is not None:
+            condiciones.append(f"{self.definicion['step']} = %s")
+            parametros.append(self.step)
+        parametros.append(lote)
+        sql = (f"SELECT {', '.join(self.definicion['columnas'])} FROM {self.tabla} "
+               f"WHERE {' AND '.join(condiciones)} ORDER BY id LIMIT %s")
+        return sql, parametros
+
+    def filas(self, conexion, lote=EXPORTAR_LOTE):
+        """Genera las filas en orden de id, una pagina por consulta y sin cargar la pagina en memoria"""
+        while self.limite is None or self.exportadas < self.limite:
+            pedido = lote if self.limite is None else min(lote, self.limite - self.exportadas)
+            leidas = 0
+            with conexion.cursor(SSDictCursor) as cursor:
+                cursor.execute(*self.consulta(self.ultimo_id, pedido))
+                for fila in cursor:
+                    leidas += 1
+                    self.exportadas += 1
+                    self.ultimo_id = fila["id"]
+                    yield fila
+            if leidas < pedido:
+                return
+
+    def lineas(self, conexion, lote=EXPORTAR_LOTE):
+        """Genera el texto de la exportacion en el formato elegido, una linea por fila"""
+        if self.formato == "csv":
+            buffer = io.StringIO()
+            escritor = csv.writer(buffer)
+            columnas = self.definicion["columnas"]
+            escritor.writerow(columnas)
+            for fila in self.filas(conexion, lote):
+                escritor.writerow([fila[columna] for columna in columnas])
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            # Sin filas, al menos el encabezado
+            if buffer.tell():
+                yield buffer.getvalue()
+        else:
+            for fila in self.filas(conexion, lote):
+                yield json.dumps(fila, ensure_ascii=False, default=str) + "\n"
+
+    def exportar(self, crear_conexion, lote=EXPORTAR_LOTE, bloque=EXPORTAR_BLOQUE):
+        """Texto de la exportacion en bloques de ~bloque caracteres; abre una conexion propia y la cierra al terminar o si se abandona"""
+        conexion = crear_conexion()
+        try:
+            # Cada pagina en su propia transaccion: una exportacion larga no retiene una instantanea de InnoDB
+            conexion.autocommit(True)
+            partes = []
+            tamano = 0
+            for linea in self.lineas(conexion, lote):
+                partes.append(linea)
+                tamano += len(linea)
+                if tamano >= bloque:
+                    yield "".join(partes)
+                    partes = []
+                    tamano = 0
+            if partes:
+                yield "".join(partes)
+        finally:
+            try:
+                conexion.close()
+            except Exception:
+                pass
@@ -0,0 +1,112 @@
+"""
+Historial de conversacion acotado para construir el prompt.
+Guarda en memoria los ultimos mensajes de cada telefono; se alimenta al
+escribir en message_log y solo consulta MySQL cuando el telefono no esta en cache.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from perezoso import Perezoso
+
+logger = logging.getLogger(__name__)
+
+HISTORIAL_MAX_MENSAJES = int(os.environ.get("HISTORY_MAX_MESSAGES", "6"))
+HISTORIAL_MAX_TOKENS = int(os.environ.get("HISTORY_MAX_TOKENS", "600"))
+HISTORIAL_CACHE_TELEFONOS = int(os.environ.get("HISTORY_CACHE_SIZE", "5000"))
+HISTORIAL_CACHE_TTL = int(os.environ.get("HISTORY_CACHE_TTL", "300"))
+# Codificación de tiktoken para contar tokens; vacía = estimar por caracteres
+HISTORIAL_TOKENIZADOR = os.environ.get("HISTORY_TOKENIZER", "cl100k_base")
+
+
+def estimar_tokens(texto):
+    """Aproximacion barata de tokens (~4 caracteres por token)"""
+    return len(texto) // 4 + 1
+
+
+def crear_contador_tokens(codificacion=HISTORIAL_TOKENIZADOR):
+    """Contador de tokens con tiktoken; si no esta instalado o no puede cargar la codificacion, usa estimar_tokens"""
+    if not codificacion:
+        return estimar_tokens
+    try:
+        import tiktoken
+        codificador = tiktoken.get_encoding(codificacion)
+    except Exception as e:
+        logger.warning("No se pudo cargar el tokenizador %s, se estiman los tokens: %s", codificacion, e)
+        return estimar_tokens
+    return lambda texto: len(codificador.encode_ordinary(texto))
+
+
+_contador_tokens = Perezoso(crear_contador_tokens)
+
+
+def contar_tokens(texto):
+    """Tokens de un texto segun tiktoken (o la estimacion, sin tiktoken)"""
+    return _contador_tokens.obtener()(texto)
+
+
+def ventana_historial(mensajes, max_mensajes=HISTORIAL_MAX_MENSAJES, max_tokens=HISTORIAL_MAX_TOKENS,
+                      contar_tokens=contar_tokens):
+    """Recorta una lista de mensajes (mas antiguo primero) a los ultimos N que caben en el presupuesto"""
+    ventana = []
+    tokens = 0
+    for mensaje in reversed(mensajes[-max_mensajes:] if max_mensajes else []):
+        tokens += contar_tokens(mensaje['mensaje'] or "")
+        if ventana and tokens > max_tokens:
+            break
+        ventana.append(mensaje)
+    ventana.reverse()
+    return ventana
+
+
+class CacheHistorial:
+    """Ultimos mensajes por telefono en un LRU con expiracion"""
+
+    def __init__(self, max_mensajes=HISTORIAL_MAX_MENSAJES, max_telefonos=HISTORIAL_CACHE_TELEFONOS,
+                 ttl=HISTORIAL_CACHE_TTL):
+        self.max_mensajes = max_mensajes
+        self.max_telefonos = max_telefonos
+        self.ttl = ttl
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, telefono):
+        """Devuelve los mensajes en cache (mas antiguo primero) o None si no esta"""
+        with self._lock:
+            entrada = self._datos.get(telefono)
+            if entrada is None or time.monotonic() - entrada[0] > self.ttl:
+                if entrada is not None:
+                    del self._datos[telefono]
+                self.fallos += 1
+                return None
+            self._datos.move_to_end(telefono)
+            self.aciertos += 1
+            return list(entrada[1])
+
+    def cargar(self, telefono, mensajes):
+        """Reemplaza el historial del telefono con mensajes leidos de la base de datos"""
+        with self._lock:
+            self._datos[telefono] = (time.monotonic(), deque(mensajes, maxlen=self.max_mensajes))
+            self._datos.move_to_end(telefono)
+            while len(self._datos) > self.max_telefonos:
+                self._datos.popitem(last=False)
+
+    def agregar(self, telefono, mensajes):
+        """Agrega mensajes recien escritos; si el telefono no esta en cache no hace nada"""
+        with self._lock:
+            entrada = self._datos.get(telefono)
+            if entrada is not None:
+                entrada[1].extend(mensajes)
+
+    def invalidar(self, telefono=None):
+        """Elimina un telefono de la cache, o toda la cache"""
+        with self._lock:
+            if telefono is None:
+                self._datos.clear()
+            else:
+                self._datos.pop(telefono, None)
@@ -0,0 +1,181 @@
+"""
+Instrumentacion del camino caliente de cada mensaje.
+Logging con nivel configurable (LOG_LEVEL) y temporizadores por etapa
+(historial, prompt, llm, parseo, escrituras en la base de datos, enviar)
+y tokens de prompt y respuesta por llamada al LLM, agregados en histogramas. /metrics los sirve en el formato de texto de
+Prometheus junto con las estadisticas de colas, caches y pools. Las metricas
+son del proceso: con varios workers de Gunicorn cada uno reporta las suyas.
+Con METRICS=0 medir() devuelve un contexto vacio y no lee el reloj.
+"""
+
+import bisect
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import nullcontext
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+METRICAS_ACTIVAS = os.environ.get("METRICS", "1") != "0"
+# Segundos: desde una lectura de cache hasta una llamada al LLM con reintentos
+LIMITES = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Tokens por llamada al LLM: prompt con las instrucciones fijas (~1500) y respuestas cortas
+LIMITES_TOKENS = (32, 64, 128, 256, 512, 1024, 1536, 2048, 3072, 4096, 8192)
+PREFIJO = "chatbot"
+
+_NULO = nullcontext()
+RE_NO_VALIDO = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def configurar_logging(nivel=LOG_LEVEL, stream=None):
+    """Configura el logger raíz con el nivel de LOG_LEVEL; escribe en stdout, como los print() que reemplaza, salvo otro stream"""
+    logging.basicConfig(
+        level=nivel,
+        stream=stream or sys.stdout,
+        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+    )
+
+
+class Histograma:
+    """Cubetas acumulables al estilo Prometheus, más suma y cuenta"""
+
+    def __init__(self, limites=LIMITES):
+        self.limites = limites
+        self.cubetas = [0] * (len(limites) + 1)
+        self.suma = 0.0
+        self.cuenta = 0
+
+    def observar(self, valor):
+        self.cubetas[bisect.bisect_left(self.limites, valor)] += 1
+        self.suma += valor
+        self.cuenta += 1
+
+
+class _Temporizador:
+    __slots__ = ("metricas", "etapa", "inicio")
+
+    def __init__(self, metricas, etapa):
+        self.metricas = metricas
+        self.etapa = etapa
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.metricas.observar(self.etapa, time.perf_counter() - self.inicio)
+
+
+class Metricas:
+    """Histogramas de duración por etapa y estadísticas de los componentes del proceso"""
+
+    def __init__(self, activas=METRICAS_ACTIVAS, limites=LIMITES, prefijo=PREFIJO):
+        self.activas = activas
+        self.limites = limites
+        self.prefijo = prefijo
+        self._lock = threading.Lock()
+        self._histogramas = {}
+        self._tokens = {}
+        self._fuentes = {}
+
+    def medir(self, etapa):
+        """Context manager que registra cuánto tarda el bloque en el histograma de la etapa"""
+        if not self.activas:
+            return _NULO
+        return _Temporizador(self, etapa)
+
+    def observar(self, etapa, segundos):
+        """Registra una duración ya medida"""
+        if not self.activas:
+            return
+        with self._lock:
+            histograma = self._histogramas.get(etapa)
+            if histograma is None:
+                histograma = self._histogramas[etapa] = Histograma(self.limites)
+            histograma.observar(segundos)
+
+    def observar_tokens(self, tipo, tokens):
+        """Registra los tokens de una llamada al LLM ("prompt" o "respuesta")"""
+        if not self.activas:
+            return
+        with self._lock:
+            histograma = self._tokens.get(tipo)
+            if histograma is None:
+                histograma = self._tokens[tipo] = Histograma(LIMITES_TOKENS)
+            histograma.observar(tokens)
+
+    def registrar_fuente(self, nombre, estadisticas):
+        """Agrega una función que devuelve un diccionario de contadores (p. ej. cola.metricas)"""
+        self._fuentes[nombre] = estadisticas
+
+    def resumen(self):
+        """Cuenta, promedio y máximo aproximado (límite de la cubeta) por etapa"""
+        with self._lock:
+            histogramas = {etapa: (list(h.cubetas), h.suma, h.cuenta) for etapa, h in self._histogramas.items()}
+        resumen = {}
+        for etapa, (cubetas, suma, cuenta) in sorted(histogramas.items()):
+            ultima = max((i for i, n in enumerate(cubetas) if n), default=0)
+            resumen[etapa] = {
+                "cuenta": cuenta,
+                "promedio_s": suma / cuenta if cuenta else 0.0,
+                "max_hasta_s": self.limites[ultima] if ultima < len(self.limites) else float("inf"),
+            }
+        return resumen
+
+    def resumen_tokens(self):
+        """Llamadas, promedio y total de tokens por tipo"""
+        with self._lock:
+            return {tipo: {"cuenta": h.cuenta, "promedio": h.suma / h.cuenta if h.cuenta else 0.0, "total": h.suma}
+                    for tipo, h in sorted(self._tokens.items())}
+
+    def exportar(self):
+        """Texto en el formato de exposición de Prometheus"""
+        lineas = []
+        with self._lock:
+            etapas = {etapa: (list(h.cubetas), h.suma, h.cuenta) for etapa, h in self._histogramas.items()}
+            tokens = {tipo: (list(h.cubetas), h.suma, h.cuenta) for tipo, h in self._tokens.items()}
+        self._exportar_histogramas(lineas, f"{self.prefijo}_etapa_segundos", "etapa", self.limites, etapas,
+                                   "Duración de cada etapa del procesamiento de un mensaje")
+        self._exportar_histogramas(lineas, f"{self.prefijo}_llm_tokens", "tipo", LIMITES_TOKENS, tokens,
+                                   "Tokens de prompt y de respuesta por llamada al LLM")
+
+        for fuente, estadisticas in sorted(self._fuentes.items()):
+            try:
+                valores = estadisticas()
+            except Exception as e:
+                logging.getLogger(__name__).debug("No se pudieron leer las estadísticas de %s: %s", fuente, e)
+                continue
+            self._exportar_valores(lineas, f"{self.prefijo}_{fuente}", valores or {})
+        return "\n".join(lineas) + "\n"
+
+    @staticmethod
+    def _exportar_histogramas(lineas, nombre, etiqueta, limites, histogramas, ayuda):
+        lineas.append(f"# HELP {nombre} {ayuda}")
+        lineas.append(f"# TYPE {nombre} histogram")
+        for valor, (cubetas, suma, cuenta) in sorted(histogramas.items()):
+            acumulado = 0
+            for limite, n in zip(limites, cubetas):
+                acumulado += n
+                lineas.append(f'{nombre}_bucket{{{etiqueta}="{valor}",le="{limite}"}} {acumulado}')
+            lineas.append(f'{nombre}_bucket{{{etiqueta}="{valor}",le="+Inf"}} {cuenta}')
+            lineas.append(f'{nombre}_sum{{{etiqueta}="{valor}"}} {suma}')
+            lineas.append(f'{nombre}_count{{{etiqueta}="{valor}"}} {cuenta}')
+
+    def _exportar_valores(self, lineas, prefijo, valores):
+        for clave, valor in valores.items():
+            nombre = RE_NO_VALIDO.sub("_", f"{prefijo}_{clave}")
+            if isinstance(valor, dict):
+                self._exportar_valores(lineas, nombre, valor)
+            elif isinstance(valor, (list, tuple)):
+                lineas.append(f"# TYPE {nombre} gauge")
+                lineas.extend(f'{nombre}{{indice="{i}"}} {float(v)}' for i, v in enumerate(valor)
+                              if isinstance(v, (int, float)))
+            elif isinstance(valor, (int, float)):
+                lineas.append(f"# TYPE {nombre} gauge")
+                lineas.append(f"{nombre} {float(valor)}")
+
+
+# Una instancia por proceso, compartida por todos los módulos
+metricas = Metricas()
@@ -0,0 +1,70 @@
+"""
+Memoria de conversacion por cliente.
+Cada telefono tiene su propia memoria (y cadena) en un LRU con expiracion,
+en lugar de un unico ConversationBufferMemory compartido por todos los usuarios.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+MEMORIA_MAX_CLIENTES = int(os.environ.get("MEMORY_MAX_CLIENTS", "2000"))
+MEMORIA_TTL = int(os.environ.get("MEMORY_TTL", "1800"))
+
+
+class MemoriasPorCliente:
+    """LRU con TTL de objetos de memoria por telefono, creados bajo demanda"""
+
+    def __init__(self, crear, max_clientes=MEMORIA_MAX_CLIENTES, ttl=MEMORIA_TTL):
+        self.crear = crear
+        self.max_clientes = max_clientes
+        self.ttl = ttl
+        self._memorias = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+
+    def obtener(self, telefono, historial=()):
+        """Devuelve la memoria del telefono; si no existe la crea a partir del historial"""
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._memorias.get(telefono)
+            if entrada is not None and ahora - entrada[0] <= self.ttl:
+                self._memorias[telefono] = (ahora, entrada[1])
+                self._memorias.move_to_end(telefono)
+                self.aciertos += 1
+                return entrada[1]
+            self.fallos += 1
+
+        # Crear fuera del lock: rehidratar puede ser costoso
+        memoria = self.crear(historial)
+        with self._lock:
+            self._memorias[telefono] = (ahora, memoria)
+            self._memorias.move_to_end(telefono)
+            self._desalojar(ahora)
+        return memoria
+
+    def descartar(self, telefono):
+        """Elimina la memoria de un telefono"""
+        with self._lock:
+            self._memorias.pop(telefono, None)
+
+    def _desalojar(self, ahora):
+        while self._memorias:
+            telefono, (ultimo_uso, _) = next(iter(self._memorias.items()))
+            if len(self._memorias) <= self.max_clientes and ahora - ultimo_uso <= self.ttl:
+                break
+            del self._memorias[telefono]
+            self.desalojos += 1
+
+    def estadisticas(self):
+        """Devuelve tamaño, aciertos, fallos y desalojos"""
+        with self._lock:
+            return {
+                "clientes": len(self._memorias),
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "desalojos": self.desalojos,
+            }
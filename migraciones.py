@@ -0,0 +1,133 @@
+"""
+Esquema de la base de datos.
+Antes se creaba al importar chatbot_script en cada worker; ahora se aplica una
+sola vez con `python cli.py migrar`. Todas las migraciones son idempotentes.
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def crear_indice_si_no_existe(cursor, tabla, indice, columnas):
+    """Crea un índice si la tabla todavía no lo tiene (MySQL no soporta CREATE INDEX IF NOT EXISTS)"""
+    cursor.execute(
+        "SELECT 1 FROM information_schema.statistics WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s LIMIT 1",
+        (tabla, indice)
+    )
+    if cursor.fetchone() is None:
+        logger.info("Creando índice %s en %s", indice, tabla)
+        cursor.execute(f"CREATE INDEX {indice} ON {tabla} {columnas}")
+
+
+def crear_columna_si_no_existe(cursor, tabla, columna, definicion):
+    """Agrega una columna si la tabla todavía no la tiene"""
+    cursor.execute(
+        "SELECT 1 FROM information_schema.columns WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s LIMIT 1",
+        (tabla, columna)
+    )
+    if cursor.fetchone() is None:
+        logger.info("Agregando columna %s a %s", columna, tabla)
+        cursor.execute(f"ALTER TABLE {tabla} ADD COLUMN {columna} {definicion}")
+
+
+def crear_tablas(cursor):
+    # Tabla message_log
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS message_log (
+            id INTEGER PRIMARY KEY AUTO_INCREMENT,
+            telefono_cliente VARCHAR(255),
+            fecha_mensaje DATETIME,
+            mensaje TEXT,
+            message_direction VARCHAR(255),
+            servicio VARCHAR(255),
+            step VARCHAR(255),
+            INDEX idx_message_log_telefono_fecha (telefono_cliente, fecha_mensaje)
+        )
+    ''')
+
+    # Tabla recordatorios
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS recordatorios (
+            id INTEGER PRIMARY KEY AUTO_INCREMENT,
+            usuario VARCHAR(255),
+            fecha_recordatorio DATE,
+            numero_semanas INTEGER
+        )
+    ''')
+
+    # Tabla de clientes
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS clientes (
+            id INTEGER PRIMARY KEY AUTO_INCREMENT,
+            whatsapp VARCHAR(255) UNIQUE,
+            nombre VARCHAR(255),
+            mascota_tipo VARCHAR(255),
+            mascota_nombre VARCHAR(255),
+            preferencias TEXT,
+            step INTEGER DEFAULT 0
+        )
+    ''')
+
+
+def indice_historial(cursor):
+    # Índice del historial para tablas creadas antes de que existiera
+    crear_indice_si_no_existe(cursor, "message_log", "idx_message_log_telefono_fecha", "(telefono_cliente, fecha_mensaje)")
+
+
+def step_clientes(cursor):
+    # Step actual del cliente, leído con sus datos en vez de buscarlo en message_log
+    crear_columna_si_no_existe(cursor, "clientes", "step", "INTEGER DEFAULT 0")
+
+
+def envio_recordatorios(cursor):
+    # Estado de envío: pendiente -> enviando (reclamado por un despachador) -> enviado | fallido
+    crear_columna_si_no_existe(cursor, "recordatorios", "estado", "VARCHAR(16) NOT NULL DEFAULT 'pendiente'")
+    crear_columna_si_no_existe(cursor, "recordatorios", "reclamado_hasta", "DATETIME NULL")
+    crear_columna_si_no_existe(cursor, "recordatorios", "intentos", "INTEGER NOT NULL DEFAULT 0")
+    crear_columna_si_no_existe(cursor, "recordatorios", "enviado_en", "DATETIME NULL")
+    crear_indice_si_no_existe(cursor, "recordatorios", "idx_recordatorios_estado_fecha", "(estado, fecha_recordatorio)")
+
+
+def tabla_archivo_message_log(cursor):
+    # Meses de message_log que salieron de la ventana de retención (ver retencion.py); comprimida, casi no se lee
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS message_log_archivo (
+            id INTEGER PRIMARY KEY,
+            telefono_cliente VARCHAR(255),
+            fecha_mensaje DATETIME,
+            mensaje TEXT,
+            message_direction VARCHAR(255),
+            servicio VARCHAR(255),
+            step VARCHAR(255),
+            INDEX idx_message_log_archivo_telefono_fecha (telefono_cliente, fecha_mensaje)
+        ) ROW_FORMAT=COMPRESSED
+    ''')
+
+
+# En orden; cada una recibe un cursor y debe poder ejecutarse más de una vez
+def indice_recordatorios_usuario(cursor):
+    # Upsert del recordatorio pendiente de cada cliente (estado 'duplicado': pendientes sobrantes de antes del upsert)
+    crear_indice_si_no_existe(cursor, "recordatorios", "idx_recordatorios_usuario_estado", "(usuario, estado)")
+
+
+MIGRACIONES = [
+    crear_tablas,
+    indice_historial,
+    step_clientes,
+    envio_recordatorios,
+    tabla_archivo_message_log,
+    indice_recordatorios_usuario,
+]
+
+
+def migrar(pool):
+    """Aplica todas las migraciones en orden"""
+    logger.info("Aplicando migraciones...")
+    with pool.conexion() as conn:
+        with conn.cursor() as cursor:
+            for migracion in MIGRACIONES:
+                logger.info("Migración: %s", migracion.__name__)
+                migracion(cursor)
+        conn.commit()
+    logger.info("Base de datos migrada correctamente")
@@ -0,0 +1,178 @@
+"""
+Parser de la respuesta estructurada del modelo.
+Reemplaza la cadena de .replace() + eval(): busca el primer objeto JSON
+(o diccionario de Python con comillas simples) dentro del texto, tolerando
+bloques ```json, texto antes o despues y saltos de linea, sin ejecutar codigo.
+"""
+
+import ast
+import json
+import re
+from dataclasses import dataclass, field
+
+CAMPOS_OPCIONALES = ("intervalo", "Nombre_mascota", "preferencia", "raza_mascota")
+CAMPOS_TEXTO = ("Nombre_mascota", "preferencia", "raza_mascota")
+STEP_MIN, STEP_MAX = 1, 6
+# Intervalo del recordatorio en semanas; mas alla de diez años es un error del modelo
+INTERVALO_MAX_SEMANAS = 520
+
+_decodificador = json.JSONDecoder(strict=False)
+
+
+class RespuestaInvalida(ValueError):
+    """La respuesta del modelo no contiene un diccionario valido"""
+
+
+def _entero(valor, minimo, maximo):
+    """Entero dentro de [minimo, maximo] a partir de un int, un float exacto o un texto de digitos; si no, None"""
+    if isinstance(valor, bool):
+        return None
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    elif isinstance(valor, str) and valor.strip().isdigit():
+        valor = int(valor.strip())
+    if not isinstance(valor, int) or not minimo <= valor <= maximo:
+        return None
+    return valor
+
+
+def _texto(valor):
+    if not isinstance(valor, str) or not valor.strip():
+        return None
+    return valor.strip()
+
+
+@dataclass
+class RespuestaIA:
+    """Respuesta del modelo ya validada"""
+    respuesta: str
+    step: int = None
+    intervalo: int = None
+    Nombre_mascota: str = None
+    preferencia: str = None
+    raza_mascota: str = None
+    extra: dict = field(default_factory=dict)
+
+    @classmethod
+    def desde_dict(cls, datos):
+        """Valida un diccionario y construye la respuesta tipada; los campos con valores fuera de tipo o rango se descartan"""
+        if not isinstance(datos, dict):
+            raise RespuestaInvalida(f"Se esperaba un diccionario, se obtuvo {type(datos).__name__}")
+        respuesta = datos.get("respuesta")
+        if not isinstance(respuesta, str) or not respuesta.strip():
+            raise RespuestaInvalida("Falta la clave 'respuesta'")
+        conocidas = {"respuesta", "step", *CAMPOS_OPCIONALES}
+        return cls(
+            respuesta=respuesta,
+            step=_entero(datos.get("step"), STEP_MIN, STEP_MAX),
+            intervalo=_entero(datos.get("intervalo"), 1, INTERVALO_MAX_SEMANAS),
+            extra={clave: valor for clave, valor in datos.items() if clave not in conocidas},
+            **{campo: _texto(datos.get(campo)) for campo in CAMPOS_TEXTO}
+        )
+
+    def a_dict(self):
+        """Devuelve el diccionario con solo las claves presentes, como lo escribe el modelo"""
+        datos = {"respuesta": self.respuesta}
+        if self.step is not None:
+            datos["step"] = self.step
+        for campo in CAMPOS_OPCIONALES:
+            valor = getattr(self, campo)
+            if valor is not None:
+                datos[campo] = valor
+        return datos
+
+
+class ExtractorJSON:
+    """Extractor incremental: recibe fragmentos y detecta cuando se cierra el primer objeto"""
+
+    def __init__(self):
+        self._partes = []
+        self._posicion = 0
+        self._inicio = None
+        self._profundidad = 0
+        self._comilla = None
+        self._escape = False
+        self.objeto = None
+
+    def alimentar(self, fragmento):
+        """Agrega texto; devuelve el texto del objeto en cuanto se cierra, o None si aún falta"""
+        if self.objeto is not None:
+            return self.objeto
+        self._partes.append(fragmento)
+        for caracter in fragmento:
+            posicion = self._posicion
+            self._posicion += 1
+            if self._inicio is None:
+                if caracter == "{":
+                    self._inicio = posicion
+                    self._profundidad = 1
+            elif self._comilla:
+                if self._escape:
+                    self._escape = False
+                elif caracter == "\\":
+                    self._escape = True
+                elif caracter == self._comilla:
+                    self._comilla = None
+            elif caracter in "\"'":
+                self._comilla = caracter
+            elif caracter == "{":
+                self._profundidad += 1
+            elif caracter == "}":
+                self._profundidad -= 1
+                if self._profundidad == 0:
+                    self.objeto = "".join(self._partes)[self._inicio:posicion + 1]
+                    return self.objeto
+        return None
+
+
+class ExtractorCampo:
+    """Extractor incremental de un campo de texto ("respuesta") antes de que el modelo termine el objeto"""
+
+    def __init__(self, campo="respuesta"):
+        self._patron = re.compile(r'"%s"\s*:\s*"((?:[^"\\]|\\.)*)"' % re.escape(campo))
+        self._partes = []
+        self.valor = None
+
+    def alimentar(self, fragmento):
+        """Agrega texto; devuelve el valor decodificado en cuanto se cierran sus comillas, o None si aún falta"""
+        if self.valor is not None:
+            return self.valor
+        self._partes.append(fragmento)
+        # Solo una comilla nueva puede cerrar el valor
+        if '"' not in fragmento:
+            return None
+        coincidencia = self._patron.search("".join(self._partes))
+        if coincidencia is not None:
+            self.valor = json.loads(f'"{coincidencia.group(1)}"', strict=False)
+        return self.valor
+
+
+def _a_dict(texto):
+    # Diccionarios de Python con comillas simples, True/None, etc. sin ejecutar código
+    try:
+        return ast.literal_eval(texto)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        raise RespuestaInvalida(f"No se pudo interpretar la respuesta: {texto[:200]!r}")
+
+
+def parsear_respuesta(texto):
+    """Convierte el texto del modelo en RespuestaIA; lanza RespuestaInvalida si no es posible"""
+    if not isinstance(texto, str):
+        raise RespuestaInvalida(f"Se esperaba texto, se obtuvo {type(texto).__name__}")
+    limpio = texto.strip()
+    # Caso común: JSON (con o sin ```json y texto alrededor), decodificado en C con raw_decode
+    inicio = limpio.find("{")
+    if inicio == -1:
+        raise RespuestaInvalida(f"La respuesta no contiene un diccionario: {limpio[:200]!r}")
+    try:
+        datos, _ = _decodificador.raw_decode(limpio, inicio)
+        return RespuestaIA.desde_dict(datos)
+    except RespuestaInvalida:
+        raise
+    except ValueError:
+        pass
+    # Respaldo: delimitar el objeto respetando comillas simples y dobles
+    objeto = ExtractorJSON().alimentar(limpio[inicio:])
+    if objeto is None:
+        raise RespuestaInvalida(f"La respuesta no contiene un diccionario completo: {limpio[:200]!r}")
+    return RespuestaIA.desde_dict(_a_dict(objeto))
@@ -0,0 +1,40 @@
+"""
+Instancias perezosas y seguras ante fork.
+El objeto (cliente del LLM, cadena, pool de base de datos) se construye en el
+primer uso y no al importar, una vez por proceso: si gunicorn hace fork despues
+de importar la app, cada worker crea el suyo en lugar de heredar sockets ajenos.
+"""
+
+import os
+import threading
+
+
+class Perezoso:
+    """Construye crear() en el primer obtener() de cada proceso"""
+
+    def __init__(self, crear):
+        self.crear = crear
+        self._lock = threading.Lock()
+        self._instancia = None
+        self._pid = None
+
+    def obtener(self):
+        """Devuelve la instancia del proceso actual; si crear() falla, se reintenta en la siguiente llamada"""
+        instancia = self._instancia
+        if instancia is not None and self._pid == os.getpid():
+            return instancia
+        with self._lock:
+            if self._instancia is None or self._pid != os.getpid():
+                self._instancia = self.crear()
+                self._pid = os.getpid()
+            return self._instancia
+
+    def creado(self):
+        """Indica si la instancia ya existe en este proceso"""
+        return self._instancia is not None and self._pid == os.getpid()
+
+    def reiniciar(self):
+        """Descarta la instancia; la siguiente llamada a obtener() crea una nueva"""
+        with self._lock:
+            self._instancia = None
+            self._pid = None
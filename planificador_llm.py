@@ -0,0 +1,272 @@
+"""
+Planificador compartido para las llamadas a Gemini.
+Limita la tasa con un token bucket ajustado a la cuota, limita la concurrencia,
+coordina el backoff ante 429 entre todos los hilos (y entre workers via SQLite),
+respeta un plazo por solicitud y atiende primero a clientes a mitad de conversacion.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+LLM_RPM = float(os.environ.get("LLM_RPM", "60"))
+LLM_PROCESOS = int(os.environ.get("WEB_CONCURRENCY", "1"))
+LLM_MAX_CONCURRENCIA = int(os.environ.get("LLM_MAX_CONCURRENCY", "4"))
+LLM_MAX_REINTENTOS = int(os.environ.get("LLM_MAX_RETRIES", "5"))
+LLM_PLAZO = float(os.environ.get("LLM_DEADLINE", "25"))
+LLM_ESTADO_COMPARTIDO = os.environ.get("LLM_SHARED_STATE")
+
+PRIORIDAD_EN_CONVERSACION = 0
+PRIORIDAD_NUEVO = 1
+
+
+class PlazoExcedido(Exception):
+    """La solicitud no pudo ejecutarse antes de su plazo"""
+
+
+class CuotaAgotada(Exception):
+    """Se agotaron los reintentos por errores de cuota"""
+
+
+def es_error_cuota(error):
+    """Indica si la excepción corresponde a un 429 / cuota agotada de Gemini"""
+    texto = str(error)
+    return "Resource has been exhausted" in texto or "429" in texto
+
+
+class PlanificadorLLM:
+    """Cola con prioridad, token bucket, límite de concurrencia y backoff global"""
+
+    def __init__(self, rpm=LLM_RPM / LLM_PROCESOS, max_concurrencia=LLM_MAX_CONCURRENCIA,
+                 max_reintentos=LLM_MAX_REINTENTOS, ruta_estado=LLM_ESTADO_COMPARTIDO,
+                 backoff_base=1.0, backoff_max=60.0):
+        self.tasa = rpm / 60.0
+        self.capacidad = max(1.0, min(rpm / 6.0, max_concurrencia))
+        self.max_concurrencia = max_concurrencia
+        self.max_reintentos = max_reintentos
+        self.ruta_estado = ruta_estado
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._condicion = threading.Condition()
+        self._tokens = self.capacidad
+        self._ultima_recarga = time.monotonic()
+        self._en_vuelo = 0
+        self._cola = []
+        self._secuencia = itertools.count()
+        self._pausa_hasta = 0.0
+        self._fallos_seguidos = 0
+        self._ultima_lectura_compartida = 0.0
+        self._local = threading.local()
+        self._esperas_async = set()
+
+        self.solicitudes = 0
+        self.reintentos = 0
+        self.errores_cuota = 0
+        self.plazos_excedidos = 0
+        self.turnos = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+
+        if ruta_estado:
+            self._sqlite().execute("CREATE TABLE IF NOT EXISTS estado (clave TEXT PRIMARY KEY, valor REAL)")
+
+    def _sqlite(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.ruta_estado, timeout=2, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def ejecutar(self, funcion, prioridad=PRIORIDAD_NUEVO, plazo=LLM_PLAZO):
+        """Ejecuta funcion() respetando la cuota; reintenta solo ante errores de cuota"""
+        limite = time.monotonic() + plazo
+        with self._condicion:
+            self.solicitudes += 1
+        for intento in range(self.max_reintentos):
+            self._adquirir(prioridad, limite)
+            try:
+                resultado = funcion()
+            except Exception as e:
+                self._liberar()
+                if not es_error_cuota(e):
+                    raise
+                pausa = self._registrar_error_cuota()
+                logger.error("Intento %s/%s: Límite de cuota alcanzado. Pausa global de %.2f segundos", intento + 1, self.max_reintentos, pausa)
+                continue
+            self._liberar(exito=True)
+            return resultado
+        raise CuotaAgotada(f"Se alcanzó el número máximo de reintentos ({self.max_reintentos})")
+
+    async def ejecutar_async(self, funcion, prioridad=PRIORIDAD_NUEVO, plazo=LLM_PLAZO):
+        """Como ejecutar, pero funcion() devuelve una corrutina; la espera del turno no bloquea el event loop"""
+        limite = time.monotonic() + plazo
+        with self._condicion:
+            self.solicitudes += 1
+        for intento in range(self.max_reintentos):
+            await self._adquirir_async(prioridad, limite)
+            try:
+                resultado = await funcion()
+            except BaseException as e:
+                self._liberar()
+                if not isinstance(e, Exception) or not es_error_cuota(e):
+                    raise
+                pausa = self._registrar_error_cuota()
+                logger.error("Intento %s/%s: Límite de cuota alcanzado. Pausa global de %.2f segundos", intento + 1, self.max_reintentos, pausa)
+                continue
+            self._liberar(exito=True)
+            return resultado
+        raise CuotaAgotada(f"Se alcanzó el número máximo de reintentos ({self.max_reintentos})")
+
+    def _adquirir(self, prioridad, limite):
+        inicio = time.monotonic()
+        # [prioridad, orden de llegada, cancelado]
+        turno = [prioridad, next(self._secuencia), False]
+        with self._condicion:
+            heapq.heappush(self._cola, turno)
+            while True:
+                espera = self._intentar(turno, inicio, limite)
+                if espera is None:
+                    return
+                self._condicion.wait(espera)
+
+    async def _adquirir_async(self, prioridad, limite):
+        # Misma cola que _adquirir, pero se espera un asyncio.Event del loop en vez de ocupar un hilo
+        inicio = time.monotonic()
+        turno = [prioridad, next(self._secuencia), False]
+        despertador = (asyncio.get_running_loop(), asyncio.Event())
+        with self._condicion:
+            heapq.heappush(self._cola, turno)
+            self._esperas_async.add(despertador)
+        try:
+            while True:
+                with self._condicion:
+                    espera = self._intentar(turno, inicio, limite)
+                    if espera is None:
+                        return
+                    despertador[1].clear()
+                try:
+                    await asyncio.wait_for(despertador[1].wait(), espera)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            with self._condicion:
+                turno[2] = True
+                self._notificar()
+            raise
+        finally:
+            with self._condicion:
+                self._esperas_async.discard(despertador)
+
+    def _intentar(self, turno, inicio, limite):
+        """Con el lock tomado: da el lugar al turno si le toca (None) o devuelve cuánto esperar"""
+        ahora = time.monotonic()
+        while self._cola and self._cola[0][2]:
+            heapq.heappop(self._cola)
+        if ahora >= limite:
+            turno[2] = True
+            self.plazos_excedidos += 1
+            self._notificar()
+            raise PlazoExcedido("Plazo excedido esperando turno para el LLM")
+        self._recargar(ahora)
+        self._leer_pausa_compartida(ahora)
+        espera = limite - ahora
+        if self._cola[0] is turno:
+            if self._pausa_hasta > ahora:
+                espera = min(espera, self._pausa_hasta - ahora)
+            elif self._en_vuelo >= self.max_concurrencia:
+                pass
+            elif self._tokens < 1:
+                espera = min(espera, (1 - self._tokens) / self.tasa)
+            else:
+                heapq.heappop(self._cola)
+                self._tokens -= 1
+                self._en_vuelo += 1
+                esperado = ahora - inicio
+                self.turnos += 1
+                self.espera_total += esperado
+                self.espera_max = max(self.espera_max, esperado)
+                self._notificar()
+                return None
+        if self.ruta_estado:
+            espera = min(espera, 0.5)
+        return max(espera, 0.001)
+
+    def _notificar(self):
+        # Se llama con el lock tomado: despierta a los hilos y a las tareas asyncio en espera
+        self._condicion.notify_all()
+        for loop, evento in self._esperas_async:
+            try:
+                loop.call_soon_threadsafe(evento.set)
+            except RuntimeError:
+                # Loop ya cerrado
+                pass
+
+    def _liberar(self, exito=False):
+        with self._condicion:
+            self._en_vuelo -= 1
+            if exito:
+                self._fallos_seguidos = 0
+            self._notificar()
+
+    def _recargar(self, ahora):
+        self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultima_recarga) * self.tasa)
+        self._ultima_recarga = ahora
+
+    def _registrar_error_cuota(self):
+        with self._condicion:
+            self.errores_cuota += 1
+            self.reintentos += 1
+            pausa = min(self.backoff_max, self.backoff_base * (2 ** self._fallos_seguidos)) + random.uniform(0, 0.1)
+            self._fallos_seguidos += 1
+            self._pausa_hasta = max(self._pausa_hasta, time.monotonic() + pausa)
+            # Sin tokens acumulados: tras la pausa se reanuda a la tasa base, sin ráfaga
+            self._tokens = 0
+            self._notificar()
+        if self.ruta_estado:
+            try:
+                self._sqlite().execute(
+                    "INSERT INTO estado (clave, valor) VALUES ('pausa_hasta', ?) "
+                    "ON CONFLICT(clave) DO UPDATE SET valor = MAX(valor, excluded.valor)",
+                    (time.time() + pausa,)
+                )
+            except sqlite3.Error as e:
+                logger.error("Error al compartir la pausa del LLM: %s", e)
+        return pausa
+
+    def _leer_pausa_compartida(self, ahora):
+        # Se llama con el lock tomado; lee como máximo dos veces por segundo
+        if not self.ruta_estado or ahora - self._ultima_lectura_compartida < 0.5:
+            return
+        self._ultima_lectura_compartida = ahora
+        try:
+            fila = self._sqlite().execute("SELECT valor FROM estado WHERE clave = 'pausa_hasta'").fetchone()
+        except sqlite3.Error:
+            return
+        if fila and fila[0] > time.time():
+            self._pausa_hasta = max(self._pausa_hasta, ahora + (fila[0] - time.time()))
+
+    def estadisticas(self):
+        """Devuelve espera en cola, reintentos y estado del limitador"""
+        with self._condicion:
+            return {
+                "solicitudes": self.solicitudes,
+                "en_cola": sum(1 for turno in self._cola if not turno[2]),
+                "en_vuelo": self._en_vuelo,
+                "reintentos": self.reintentos,
+                "errores_cuota": self.errores_cuota,
+                "plazos_excedidos": self.plazos_excedidos,
+                "espera_promedio_s": self.espera_total / self.turnos if self.turnos else 0.0,
+                "espera_max_s": self.espera_max,
+                "pausa_restante_s": max(0.0, self._pausa_hasta - time.monotonic()),
+            }
@@ -0,0 +1,154 @@
+"""
+Pool de conexiones MySQL seguro para hilos.
+Cada funcion de base de datos toma una conexion del pool y la devuelve al
+terminar, en lugar de compartir un unico cursor global entre todos los hilos.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class PoolAgotadoError(Exception):
+    """No se obtuvo una conexion libre antes del timeout"""
+
+
+class PoolConexiones:
+    """Pool con tamaño minimo/maximo, ping al prestar y reconexion automatica"""
+
+    def __init__(self, crear_conexion, min_size=1, max_size=10, timeout=10, ping_intervalo=30):
+        self.crear_conexion = crear_conexion
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.ping_intervalo = ping_intervalo
+        self._condicion = threading.Condition()
+        self._reiniciar()
+        for _ in range(min_size):
+            self._libres.append((self.crear_conexion(), time.monotonic()))
+            self._total += 1
+
+    def _reiniciar(self):
+        # Tras un fork las conexiones heredadas pertenecen al proceso padre: se descartan sin cerrarlas
+        self._pid = os.getpid()
+        self._libres = deque()
+        self._total = 0
+        self._en_uso = 0
+        self._prestamos = 0
+        self._esperas = 0
+        self._espera_total = 0.0
+        self._espera_max = 0.0
+        self._reconexiones = 0
+        self._uso_max = 0
+
+    def _tomar(self):
+        inicio = time.monotonic()
+        limite = inicio + self.timeout
+        with self._condicion:
+            if self._pid != os.getpid():
+                self._reiniciar()
+            esperado = False
+            while True:
+                if self._libres:
+                    conn, ultimo_uso = self._libres.pop()
+                    break
+                if self._total < self.max_size:
+                    self._total += 1
+                    conn, ultimo_uso = None, None
+                    break
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    raise PoolAgotadoError(f"No hay conexiones libres tras {self.timeout} segundos")
+                esperado = True
+                self._condicion.wait(restante)
+            espera = time.monotonic() - inicio
+            self._en_uso += 1
+            self._prestamos += 1
+            self._esperas += esperado
+            self._espera_total += espera
+            self._espera_max = max(self._espera_max, espera)
+            self._uso_max = max(self._uso_max, self._en_uso)
+
+        try:
+            if conn is None:
+                conn = self.crear_conexion()
+            elif time.monotonic() - ultimo_uso > self.ping_intervalo:
+                conn = self._verificar(conn)
+        except Exception:
+            self._liberar(None)
+            raise
+        return conn
+
+    def _verificar(self, conn):
+        try:
+            conn.ping(reconnect=False)
+            return conn
+        except Exception:
+            logger.info("Conexion a la base de datos caida, reconectando...")
+            self._cerrar(conn)
+            with self._condicion:
+                self._reconexiones += 1
+            return self.crear_conexion()
+
+    def _liberar(self, conn):
+        with self._condicion:
+            self._en_uso -= 1
+            if conn is None or self._pid != os.getpid():
+                self._total -= 1
+            else:
+                self._libres.append((conn, time.monotonic()))
+            self._condicion.notify()
+
+    @staticmethod
+    def _cerrar(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def conexion(self):
+        """Presta una conexion del pool; al devolverla se hace rollback de lo que no se confirmo"""
+        conn = self._tomar()
+        try:
+            yield conn
+        finally:
+            # Las lecturas no hacen commit: sin el rollback el siguiente prestamo seguiria
+            # en la misma transaccion y leeria la instantanea de REPEATABLE READ anterior
+            try:
+                conn.rollback()
+            except Exception:
+                # Conexion inutilizable: se descarta y el pool abrira otra
+                self._cerrar(conn)
+                conn = None
+            self._liberar(conn)
+
+    def estadisticas(self):
+        """Devuelve contadores de uso y tiempos de espera del pool"""
+        with self._condicion:
+            return {
+                "abiertas": self._total,
+                "en_uso": self._en_uso,
+                "libres": len(self._libres),
+                "max_size": self.max_size,
+                "utilizacion": self._en_uso / self.max_size,
+                "uso_max": self._uso_max,
+                "prestamos": self._prestamos,
+                "esperas": self._esperas,
+                "espera_promedio_s": self._espera_total / self._prestamos if self._prestamos else 0.0,
+                "espera_max_s": self._espera_max,
+                "reconexiones": self._reconexiones,
+            }
+
+    def cerrar(self):
+        """Cierra las conexiones libres del pool"""
+        with self._condicion:
+            while self._libres:
+                conn, _ = self._libres.pop()
+                self._cerrar(conn)
+                self._total -= 1
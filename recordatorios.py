@@ -0,0 +1,288 @@
+"""
+Despachador de recordatorios.
+Busca los recordatorios vencidos por el indice (estado, fecha_recordatorio), los
+reclama por lotes con SELECT ... FOR UPDATE SKIP LOCKED (MySQL 8) para que varias
+instancias puedan correr a la vez, los envia por WhatsApp con concurrencia
+limitada, los marca como enviados y programa el siguiente segun numero_semanas.
+
+El envio ocurre fuera de la transaccion: un lote reclamado queda en estado
+'enviando' hasta reclamado_hasta; si la instancia muere, otro despachador lo
+recupera cuando vence el reclamo.
+
+Cada cliente tiene a lo sumo un recordatorio pendiente: el chatbot actualiza el
+pendiente en lugar de insertar otro cuando el cliente repite el intervalo, la
+siguiente ocurrencia solo se inserta si no hay otro pendiente, y si aun asi un
+lote trae varios del mismo cliente se envia uno y el resto queda 'duplicado'.
+
+Un recordatorio llega semanas despues del ultimo mensaje del cliente, fuera de
+la ventana de 24 horas de WhatsApp, donde la Graph API solo entrega plantillas
+aprobadas: se envia la plantilla REMINDER_TEMPLATE con los datos del cliente
+como parametros del cuerpo, en el orden de REMINDER_TEMPLATE_PARAMS.
+
+Uso:
+    python cli.py recordatorios
+"""
+
+import datetime
+import logging
+import os
+import threading
+import time
+
+from cliente_whatsapp import Plantilla, WhatsAppError
+
+logger = logging.getLogger(__name__)
+
+RECORDATORIOS_LOTE = int(os.environ.get("REMINDER_BATCH", "500"))
+RECORDATORIOS_RECLAMO = int(os.environ.get("REMINDER_CLAIM_SECONDS", "300"))
+RECORDATORIOS_MAX_INTENTOS = int(os.environ.get("REMINDER_MAX_ATTEMPTS", "5"))
+RECORDATORIOS_REINTENTO = int(os.environ.get("REMINDER_RETRY_SECONDS", "600"))
+RECORDATORIOS_INTERVALO = float(os.environ.get("REMINDER_POLL_SECONDS", "30"))
+RECORDATORIOS_PLANTILLA = os.environ.get("REMINDER_TEMPLATE", "recordatorio_compra")
+RECORDATORIOS_IDIOMA = os.environ.get("REMINDER_TEMPLATE_LANGUAGE", "es")
+RECORDATORIOS_PARAMETROS = tuple(
+    parametro.strip() for parametro in os.environ.get("REMINDER_TEMPLATE_PARAMS", "alimento,mascota").split(",")
+    if parametro.strip()
+)
+
+SERVICIO = "recordatorio"
+
+# Upsert del recordatorio pendiente de un cliente: primero se actualiza y, si no habia ninguno, se inserta
+SQL_ACTUALIZAR_PENDIENTE = (
+    "UPDATE recordatorios SET fecha_recordatorio = %s, numero_semanas = %s "
+    "WHERE usuario = %s AND estado = 'pendiente'"
+)
+SQL_INSERTAR_SI_NO_HAY_PENDIENTE = (
+    "INSERT INTO recordatorios (usuario, fecha_recordatorio, numero_semanas) "
+    "SELECT %s, %s, %s FROM DUAL WHERE NOT EXISTS "
+    "(SELECT 1 FROM recordatorios WHERE usuario = %s AND estado = 'pendiente')"
+)
+
+# Parametros disponibles para la plantilla: (columna de clientes, valor si el cliente no la tiene)
+PARAMETROS_PLANTILLA = {
+    "alimento": ("preferencias", "alimento"),
+    "mascota": ("mascota_nombre", "tu mascota"),
+    "nombre": ("nombre", "cliente"),
+}
+
+
+def plantilla_recordatorio(cliente, nombre=RECORDATORIOS_PLANTILLA, idioma=RECORDATORIOS_IDIOMA,
+                           parametros=RECORDATORIOS_PARAMETROS):
+    """Plantilla del recordatorio con los datos del cliente como parametros del cuerpo"""
+    cliente = cliente or {}
+    valores = []
+    for parametro in parametros:
+        columna, por_defecto = PARAMETROS_PLANTILLA[parametro]
+        valores.append(cliente.get(columna) or por_defecto)
+    return Plantilla(nombre, idioma, valores)
+
+
+def mensaje_recordatorio(cliente):
+    """Texto equivalente a la plantilla, para message_log"""
+    cliente = cliente or {}
+    mascota = cliente.get("mascota_nombre")
+    alimento = cliente.get("preferencias")
+    texto = "¡Hola! Te recordamos que ya es momento de tu próxima compra de alimento"
+    if alimento:
+        texto += f" {alimento}"
+    if mascota:
+        texto += f" para {mascota}"
+    return texto + ". ¿Quieres que te ayudemos con tu pedido?"
+
+
+def siguiente_fecha(fecha, numero_semanas, hoy):
+    """Siguiente ocurrencia posterior a hoy; None si el recordatorio no se repite"""
+    if not numero_semanas or numero_semanas <= 0:
+        return None
+    paso = datetime.timedelta(weeks=numero_semanas)
+    siguiente = fecha + paso
+    if siguiente <= hoy:
+        # Recordatorios atrasados: se saltan las ocurrencias ya vencidas en lugar de enviarlas todas
+        siguiente += paso * ((hoy - siguiente) // paso + 1)
+    return siguiente
+
+
+class DespachadorRecordatorios:
+    """Reclama, envía y reprograma recordatorios vencidos por lotes"""
+
+    def __init__(self, pool, cliente_whatsapp, lote=RECORDATORIOS_LOTE, reclamo=RECORDATORIOS_RECLAMO,
+                 max_intentos=RECORDATORIOS_MAX_INTENTOS, reintento=RECORDATORIOS_REINTENTO,
+                 plantilla=RECORDATORIOS_PLANTILLA, idioma=RECORDATORIOS_IDIOMA, parametros=RECORDATORIOS_PARAMETROS):
+        desconocidos = [parametro for parametro in parametros if parametro not in PARAMETROS_PLANTILLA]
+        if desconocidos:
+            raise ValueError(f"Parámetros de plantilla desconocidos: {', '.join(desconocidos)} "
+                             f"(disponibles: {', '.join(PARAMETROS_PLANTILLA)})")
+        if not plantilla:
+            raise ValueError("Falta el nombre de la plantilla de recordatorio (REMINDER_TEMPLATE)")
+        self.pool = pool
+        self.cliente_whatsapp = cliente_whatsapp
+        self.lote = lote
+        self.reclamo = reclamo
+        self.max_intentos = max_intentos
+        self.reintento = reintento
+        self.plantilla = plantilla
+        self.idioma = idioma
+        self.parametros = parametros
+        self._lock = threading.Lock()
+        self.lotes = 0
+        self.enviados = 0
+        self.reprogramados = 0
+        self.reintentos = 0
+        self.fallidos = 0
+        self.recuperados = 0
+        self.duplicados = 0
+
+    def recuperar_vencidos(self):
+        """Devuelve a 'pendiente' los lotes cuyo reclamo venció (despachador caído o envío a reintentar)"""
+        with self.pool.conexion() as conn:
+            with conn.cursor() as cursor:
+                recuperados = cursor.execute(
+                    "UPDATE recordatorios SET estado = 'pendiente', reclamado_hasta = NULL "
+                    "WHERE estado = 'enviando' AND reclamado_hasta < NOW()"
+                )
+            conn.commit()
+        with self._lock:
+            self.recuperados += recuperados
+        return recuperados
+
+    def reclamar(self, hoy):
+        """Marca como 'enviando' hasta `lote` recordatorios vencidos y los devuelve, uno por cliente"""
+        with self.pool.conexion() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT id, usuario, fecha_recordatorio, numero_semanas, intentos FROM recordatorios "
+                    "WHERE estado = 'pendiente' AND fecha_recordatorio <= %s "
+                    "ORDER BY fecha_recordatorio LIMIT %s FOR UPDATE SKIP LOCKED",
+                    (hoy, self.lote)
+                )
+                filas = list(cursor.fetchall())
+                # Varios pendientes del mismo cliente (filas anteriores al upsert): se envía el más reciente
+                por_usuario = {}
+                for fila in filas:
+                    if fila["usuario"] not in por_usuario or fila["id"] > por_usuario[fila["usuario"]]["id"]:
+                        por_usuario[fila["usuario"]] = fila
+                duplicados = [fila["id"] for fila in filas if por_usuario[fila["usuario"]] is not fila]
+                filas = [fila for fila in filas if por_usuario[fila["usuario"]] is fila]
+                if duplicados:
+                    cursor.execute(
+                        f"UPDATE recordatorios SET estado = 'duplicado' WHERE id IN ({', '.join(['%s'] * len(duplicados))})",
+                        duplicados
+                    )
+                if filas:
+                    ids = [fila["id"] for fila in filas]
+                    cursor.execute(
+                        f"UPDATE recordatorios SET estado = 'enviando', intentos = intentos + 1, "
+                        f"reclamado_hasta = NOW() + INTERVAL %s SECOND WHERE id IN ({', '.join(['%s'] * len(ids))})",
+                        [self.reclamo, *ids]
+                    )
+            conn.commit()
+        if duplicados:
+            logger.info("%s recordatorios duplicados descartados", len(duplicados))
+            with self._lock:
+                self.duplicados += len(duplicados)
+        return filas
+
+    def _clientes(self, telefonos):
+        with self.pool.conexion() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                f"SELECT whatsapp, nombre, mascota_nombre, preferencias FROM clientes WHERE whatsapp IN ({', '.join(['%s'] * len(telefonos))})",
+                list(telefonos)
+            )
+            return {fila["whatsapp"]: fila for fila in cursor.fetchall()}
+
+    def despachar_lote(self, hoy=None):
+        """Procesa un lote; devuelve cuántos recordatorios se reclamaron"""
+        hoy = hoy or datetime.date.today()
+        filas = self.reclamar(hoy)
+        if not filas:
+            return 0
+        clientes = self._clientes({fila["usuario"] for fila in filas})
+        mensajes = [
+            (fila["usuario"], plantilla_recordatorio(clientes.get(fila["usuario"]), self.plantilla, self.idioma, self.parametros))
+            for fila in filas
+        ]
+        resultados = self.cliente_whatsapp.enviar_lote(mensajes)
+
+        enviados, reintentar, fallidos, siguientes, log = [], [], [], [], []
+        ahora = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        for fila, resultado in zip(filas, resultados):
+            telefono = fila["usuario"]
+            if isinstance(resultado, WhatsAppError):
+                logger.error("Recordatorio %s para %s: %s", fila['id'], telefono, resultado)
+                # Los errores 4xx distintos de 429 (número inválido, etc.) no se reintentan
+                definitivo = resultado.status_code is not None and 400 <= resultado.status_code < 500 and resultado.status_code != 429
+                if definitivo or fila["intentos"] + 1 >= self.max_intentos:
+                    fallidos.append(fila["id"])
+                else:
+                    reintentar.append(fila["id"])
+                continue
+            enviados.append(fila["id"])
+            log.append((telefono, ahora, mensaje_recordatorio(clientes.get(telefono)), "outbound", SERVICIO, None))
+            siguiente = siguiente_fecha(fila["fecha_recordatorio"], fila["numero_semanas"], hoy)
+            if siguiente is not None:
+                siguientes.append((telefono, siguiente.strftime("%Y-%m-%d"), fila["numero_semanas"], telefono))
+
+        # Resultado del lote en una sola transacción
+        reprogramados = 0
+        with self.pool.conexion() as conn:
+            with conn.cursor() as cursor:
+                if enviados:
+                    cursor.execute(
+                        f"UPDATE recordatorios SET estado = 'enviado', enviado_en = NOW(), reclamado_hasta = NULL "
+                        f"WHERE id IN ({', '.join(['%s'] * len(enviados))})",
+                        enviados
+                    )
+                if reintentar:
+                    # Siguen 'enviando' hasta que venza la espera; recuperar_vencidos los vuelve a poner en cola
+                    cursor.execute(
+                        f"UPDATE recordatorios SET reclamado_hasta = NOW() + INTERVAL %s SECOND "
+                        f"WHERE id IN ({', '.join(['%s'] * len(reintentar))})",
+                        [self.reintento, *reintentar]
+                    )
+                if fallidos:
+                    cursor.execute(
+                        f"UPDATE recordatorios SET estado = 'fallido', reclamado_hasta = NULL "
+                        f"WHERE id IN ({', '.join(['%s'] * len(fallidos))})",
+                        fallidos
+                    )
+                if siguientes:
+                    # Si el cliente ya tiene otro pendiente (dio un intervalo nuevo), ese continúa la cadena
+                    reprogramados = cursor.executemany(SQL_INSERTAR_SI_NO_HAY_PENDIENTE, siguientes)
+                if log:
+                    cursor.executemany(
+                        "INSERT INTO message_log (telefono_cliente, fecha_mensaje, mensaje, message_direction, servicio, step) VALUES (%s, %s, %s, %s, %s, %s)",
+                        log
+                    )
+            conn.commit()
+
+        with self._lock:
+            self.lotes += 1
+            self.enviados += len(enviados)
+            self.reprogramados += reprogramados
+            self.reintentos += len(reintentar)
+            self.fallidos += len(fallidos)
+        logger.info("Lote de recordatorios: %s enviados, %s a reintentar, %s fallidos", len(enviados), len(reintentar), len(fallidos))
+        return len(filas)
+
+    def ejecutar(self, una_vez=False, intervalo=RECORDATORIOS_INTERVALO):
+        """Despacha lotes mientras haya vencidos; luego espera `intervalo` segundos (o termina si una_vez)"""
+        while True:
+            self.recuperar_vencidos()
+            while self.despachar_lote() >= self.lote:
+                pass
+            if una_vez:
+                return self.estadisticas()
+            time.sleep(intervalo)
+
+    def estadisticas(self):
+        """Devuelve los contadores de envío"""
+        with self._lock:
+            return {
+                "lotes": self.lotes,
+                "enviados": self.enviados,
+                "reprogramados": self.reprogramados,
+                "reintentos": self.reintentos,
+                "fallidos": self.fallidos,
+                "recuperados": self.recuperados,
+                "duplicados": self.duplicados,
+            }
@@ -0,0 +1,252 @@
+"""
+Varios numeros de WhatsApp Business para los envios.
+La Graph API limita el throughput por numero, asi que cada numero
+(phone_number_id) tiene su token, sus clientes HTTP con su propio pool de
+conexiones y un limitador de mensajes por segundo. Los clientes se reparten
+entre numeros con hashing consistente: un telefono siempre recibe desde el
+mismo numero y agregar uno solo mueve ~1/N de los telefonos. Las respuestas a
+un mensaje entrante salen por el numero al que escribio el cliente.
+
+Configuracion:
+    WHATSAPP_NUMBERS=309696275570080,309696275570081   (por defecto PHONE_NUMBER_ID)
+    ACCESS_TOKEN_309696275570081=...                   (token de ese numero; si falta, ACCESS_TOKEN)
+    WHATSAPP_NUMBER_MPS=80                             (mensajes por segundo por numero, repartidos entre procesos)
+"""
+
+import asyncio
+import bisect
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cliente_whatsapp import PHONE_NUMBER_ID, ClienteWhatsAppAsync, WhatsAppClient, WhatsAppError
+
+WHATSAPP_PROCESOS = int(os.environ.get("WEB_CONCURRENCY", "1"))
+WHATSAPP_MPS = float(os.environ.get("WHATSAPP_NUMBER_MPS", "80"))
+WHATSAPP_NODOS_VIRTUALES = int(os.environ.get("WHATSAPP_VIRTUAL_NODES", "400"))
+
+
+def numeros_configurados():
+    """(phone_number_id, token) de cada numero de WHATSAPP_NUMBERS"""
+    ids = [numero.strip() for numero in os.environ.get("WHATSAPP_NUMBERS", PHONE_NUMBER_ID).split(",") if numero.strip()]
+    return [(numero, os.environ.get(f"ACCESS_TOKEN_{numero}") or os.environ.get("ACCESS_TOKEN")) for numero in ids]
+
+
+class AnilloConsistente:
+    """Hashing consistente con nodos virtuales; el hash es estable entre procesos (a diferencia de hash())"""
+
+    def __init__(self, nodos, virtuales=WHATSAPP_NODOS_VIRTUALES):
+        if not nodos:
+            raise ValueError("El anillo necesita al menos un nodo")
+        self._puntos = sorted((self._hash(f"{nodo}#{i}"), nodo) for nodo in nodos for i in range(virtuales))
+        self._hashes = [punto for punto, _ in self._puntos]
+
+    @staticmethod
+    def _hash(texto):
+        return int.from_bytes(hashlib.blake2b(texto.encode(), digest_size=8).digest(), "big")
+
+    def nodo(self, clave):
+        """Nodo dueño de la clave: el primer punto del anillo a partir de su hash"""
+        indice = bisect.bisect(self._hashes, self._hash(clave)) % len(self._puntos)
+        return self._puntos[indice][1]
+
+
+class LimitadorTasa:
+    """
+    Cubeta de tokens; cada envío reserva su turno y espera fuera del lock lo que le toque.
+    La ráfaga por defecto es una décima de segundo de envíos: con una ráfaga de un
+    segundo entero cabrían hasta el doble de por_segundo en un mismo segundo.
+    """
+
+    def __init__(self, por_segundo, rafaga=None):
+        self.por_segundo = por_segundo
+        self.rafaga = rafaga or max(por_segundo / 10, 1)
+        self._tokens = self.rafaga
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+        self.esperas = 0
+        self.espera_total = 0.0
+        self.en_espera = 0
+
+    def _reservar(self):
+        if self.por_segundo <= 0:
+            return 0.0
+        with self._lock:
+            ahora = time.monotonic()
+            self._tokens = min(self.rafaga, self._tokens + (ahora - self._ultimo) * self.por_segundo)
+            self._ultimo = ahora
+            # Tokens negativos = envíos ya reservados por delante
+            self._tokens -= 1
+            espera = -self._tokens / self.por_segundo if self._tokens < 0 else 0.0
+            if espera:
+                self.esperas += 1
+                self.espera_total += espera
+                self.en_espera += 1
+            return espera
+
+    def _listo(self):
+        with self._lock:
+            self.en_espera -= 1
+
+    def esperar(self):
+        espera = self._reservar()
+        if espera:
+            time.sleep(espera)
+            self._listo()
+
+    async def esperar_async(self):
+        espera = self._reservar()
+        if espera:
+            await asyncio.sleep(espera)
+            self._listo()
+
+    def estadisticas(self):
+        """Envíos esperando turno ahora, cuántos esperaron y cuánto en total"""
+        with self._lock:
+            return {"en_espera": self.en_espera, "esperas": self.esperas, "espera_total_s": self.espera_total}
+
+
+class Remitente:
+    """Un número: sus clientes HTTP (creados en el primer uso), su limitador y sus contadores"""
+
+    def __init__(self, numero, token, mps, opciones_cliente):
+        self.numero = numero
+        self.token = token
+        self.limitador = LimitadorTasa(mps)
+        self.opciones_cliente = opciones_cliente
+        self._cliente = None
+        self._cliente_async = None
+        self._lock = threading.Lock()
+        self.enviados = 0
+        self.errores = 0
+        self.en_vuelo = 0
+
+    def cliente(self):
+        with self._lock:
+            if self._cliente is None:
+                self._cliente = WhatsAppClient(self.token, self.numero, **self.opciones_cliente)
+            return self._cliente
+
+    def cliente_async(self):
+        # Se crea dentro del event loop
+        if self._cliente_async is None:
+            self._cliente_async = ClienteWhatsAppAsync(self.token, self.numero)
+        return self._cliente_async
+
+    def _contar(self, en_vuelo, enviados=0, errores=0):
+        with self._lock:
+            self.en_vuelo += en_vuelo
+            self.enviados += enviados
+            self.errores += errores
+
+    def enviar(self, telefono, mensaje):
+        self.limitador.esperar()
+        self._contar(1)
+        try:
+            respuesta = self.cliente().enviar(telefono, mensaje)
+        except WhatsAppError:
+            self._contar(-1, errores=1)
+            raise
+        self._contar(-1, enviados=1)
+        return respuesta
+
+    async def enviar_async(self, telefono, mensaje):
+        await self.limitador.esperar_async()
+        self._contar(1)
+        try:
+            respuesta = await self.cliente_async().enviar(telefono, mensaje)
+        except WhatsAppError:
+            self._contar(-1, errores=1)
+            raise
+        self._contar(-1, enviados=1)
+        return respuesta
+
+    def metricas(self):
+        with self._lock:
+            contadores = {"enviados": self.enviados, "errores": self.errores, "en_vuelo": self.en_vuelo}
+        return {**contadores, **self.limitador.estadisticas()}
+
+
+class RemitentesWhatsApp:
+    """Envía cada mensaje por el número que le corresponde al teléfono, con la misma interfaz que WhatsAppClient"""
+
+    def __init__(self, numeros=None, mps=WHATSAPP_MPS / WHATSAPP_PROCESOS, max_concurrencia=8, **opciones_cliente):
+        numeros = numeros or numeros_configurados()
+        self._remitentes = {numero: Remitente(numero, token, mps, opciones_cliente) for numero, token in numeros}
+        self._anillo = AnilloConsistente(list(self._remitentes))
+        self.max_concurrencia = max_concurrencia
+        self._executor = None
+        self.numero_desconocido = 0
+
+    def remitente(self, telefono, numero=None):
+        """El número al que escribió el cliente si está configurado; si no, el que le asigna el anillo"""
+        remitente = self._remitentes.get(numero)
+        if remitente is None:
+            if numero:
+                self.numero_desconocido += 1
+            remitente = self._remitentes[self._anillo.nodo(str(telefono))]
+        return remitente
+
+    def enviar(self, telefono, mensaje, numero=None):
+        """Envia un texto (str) o una Plantilla y devuelve el JSON de la respuesta"""
+        return self.remitente(telefono, numero).enviar(telefono, mensaje)
+
+    async def enviar_async(self, telefono, mensaje, numero=None):
+        """Versión asyncio de enviar"""
+        return await self.remitente(telefono, numero).enviar_async(telefono, mensaje)
+
+    def enviar_texto(self, telefono, mensaje, numero=None):
+        """Envia un mensaje de texto y devuelve el JSON de la respuesta"""
+        return self.enviar(telefono, mensaje, numero)
+
+    async def enviar_texto_async(self, telefono, mensaje, numero=None):
+        """Versión asyncio de enviar_texto"""
+        return await self.enviar_async(telefono, mensaje, numero)
+
+    def enviar_plantilla(self, telefono, plantilla, numero=None):
+        """Envia una Plantilla; es lo que se usa fuera de la ventana de 24 horas (recordatorios)"""
+        return self.enviar(telefono, plantilla, numero)
+
+    async def enviar_plantilla_async(self, telefono, plantilla, numero=None):
+        """Versión asyncio de enviar_plantilla"""
+        return await self.enviar_async(telefono, plantilla, numero)
+
+    def enviar_lote(self, mensajes):
+        """Envia varios (telefono, texto o Plantilla) en paralelo y devuelve resultados o excepciones en orden"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrencia,
+                                                thread_name_prefix="whatsapp-envio")
+        futuros = [self._executor.submit(self.enviar, telefono, mensaje) for telefono, mensaje in mensajes]
+        resultados = []
+        for futuro in futuros:
+            try:
+                resultados.append(futuro.result())
+            except WhatsAppError as e:
+                resultados.append(e)
+        return resultados
+
+    def metricas(self):
+        """Enviados, errores, en vuelo y espera del limitador por número"""
+        return {
+            "numeros": {numero: remitente.metricas() for numero, remitente in self._remitentes.items()},
+            "numero_desconocido": self.numero_desconocido,
+        }
+
+    def cerrar(self):
+        """Cierra los hilos de envío y los clientes de cada número"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        for remitente in self._remitentes.values():
+            if remitente._cliente is not None:
+                remitente._cliente.cerrar()
+                remitente._cliente = None
+
+    async def cerrar_async(self):
+        """Cierra los clientes asyncio de cada número"""
+        for remitente in self._remitentes.values():
+            if remitente._cliente_async is not None:
+                await remitente._cliente_async.cerrar()
+                remitente._cliente_async = None
@@ -0,0 +1,244 @@
+"""
+Retencion de message_log.
+Cada turno agrega filas a message_log y el historial y los analisis la
+recorren, asi que la tabla se particiona por mes de fecha_mensaje (RANGE
+COLUMNS). El mantenimiento crea por adelantado las particiones de los proximos
+meses, copia los meses que salen de la ventana de retencion a la tabla
+comprimida message_log_archivo o a archivos JSONL.gz locales y despues elimina
+esas particiones con DROP PARTITION, que libera el espacio de un mes entero sin
+borrar fila por fila.
+
+Particionar reconstruye la tabla (la clave primaria pasa a ser (id,
+fecha_mensaje), como exige MySQL): se ejecuta una sola vez, fuera de horario.
+
+Uso:
+    python cli.py retencion particionar
+    python cli.py retencion mantener [--dias 180] [--destino tabla|archivos] [--directorio archivo_message_log]
+"""
+
+import datetime
+import gzip
+import logging
+import os
+import threading
+
+from exportacion import TABLAS, Exportacion
+
+logger = logging.getLogger(__name__)
+
+RETENCION_DIAS = int(os.environ.get("MESSAGE_LOG_RETENTION_DAYS", "180"))
+RETENCION_MESES_FUTUROS = int(os.environ.get("MESSAGE_LOG_FUTURE_MONTHS", "3"))
+RETENCION_DESTINO = os.environ.get("MESSAGE_LOG_ARCHIVE", "tabla")
+RETENCION_DIRECTORIO = os.environ.get("MESSAGE_LOG_ARCHIVE_DIR", "archivo_message_log")
+RETENCION_LOTE = int(os.environ.get("MESSAGE_LOG_ARCHIVE_BATCH", "10000"))
+
+DESTINOS = ("tabla", "archivos")
+COLUMNAS = ", ".join(TABLAS["message_log"]["columnas"])
+PARTICION_FUTURO = "pfuturo"
+
+
+def inicio_de_mes(fecha):
+    return datetime.date(fecha.year, fecha.month, 1)
+
+
+def sumar_meses(mes, meses):
+    indice = mes.year * 12 + mes.month - 1 + meses
+    return datetime.date(indice // 12, indice % 12 + 1, 1)
+
+
+def nombre_particion(mes):
+    """Particion con las filas del mes: p202501 guarda enero de 2025"""
+    return f"p{mes:%Y%m}"
+
+
+def definicion_particion(mes):
+    return f"PARTITION {nombre_particion(mes)} VALUES LESS THAN ('{sumar_meses(mes, 1):%Y-%m-%d}')"
+
+
+class RetencionMessageLog:
+    """Particiona message_log por mes, archiva los meses vencidos y elimina sus particiones"""
+
+    def __init__(self, pool, crear_conexion=None, dias=RETENCION_DIAS, destino=RETENCION_DESTINO,
+                 directorio=RETENCION_DIRECTORIO, meses_futuros=RETENCION_MESES_FUTUROS, lote=RETENCION_LOTE):
+        if destino not in DESTINOS:
+            raise ValueError(f"Destino de archivo desconocido: {destino} (disponibles: {', '.join(DESTINOS)})")
+        if destino == "archivos" and crear_conexion is None:
+            raise ValueError("Archivar en archivos requiere crear_conexion")
+        self.pool = pool
+        self.crear_conexion = crear_conexion
+        self.dias = dias
+        self.destino = destino
+        self.directorio = directorio
+        self.meses_futuros = meses_futuros
+        self.lote = lote
+        self._lock = threading.Lock()
+        self.particiones_creadas = 0
+        self.particiones_eliminadas = 0
+        self.filas_archivadas = 0
+        self.fallidas = 0
+
+    def particiones(self, cursor):
+        """Particiones de message_log en orden: (nombre, límite superior o None si es MAXVALUE, filas aproximadas)"""
+        cursor.execute(
+            "SELECT partition_name AS nombre, partition_description AS limite, table_rows AS filas "
+            "FROM information_schema.partitions WHERE table_schema = DATABASE() AND table_name = 'message_log' "
+            "AND partition_name IS NOT NULL ORDER BY partition_ordinal_position"
+        )
+        particiones = []
+        for fila in cursor.fetchall():
+            limite = fila["limite"].strip("'")
+            limite = None if limite == "MAXVALUE" else datetime.datetime.fromisoformat(limite).date()
+            particiones.append((fila["nombre"], limite, fila["filas"]))
+        return particiones
+
+    def particionar(self, hoy=None):
+        """Convierte message_log en una tabla particionada por mes; devuelve False si ya lo estaba"""
+        hoy = hoy or datetime.date.today()
+        with self.pool.conexion() as conn:
+            with conn.cursor() as cursor:
+                if self.particiones(cursor):
+                    logger.info("message_log ya está particionada")
+                    return False
+                cursor.execute("SELECT MIN(fecha_mensaje) AS primera FROM message_log")
+                primera = cursor.fetchone()["primera"]
+                # Los mensajes sin fecha no pueden ir en la clave primaria: quedan en el mes más antiguo
+                cursor.execute("UPDATE message_log SET fecha_mensaje = %s WHERE fecha_mensaje IS NULL", (primera or hoy,))
+                conn.commit()
+
+                mes = inicio_de_mes(primera or hoy)
+                ultimo = sumar_meses(inicio_de_mes(hoy), self.meses_futuros)
+                definiciones = []
+                while mes <= ultimo:
+                    definiciones.append(definicion_particion(mes))
+                    mes = sumar_meses(mes, 1)
+                definiciones.append(f"PARTITION {PARTICION_FUTURO} VALUES LESS THAN (MAXVALUE)")
+                logger.info("Particionando message_log en %s particiones (reconstruye la tabla)...", len(definiciones))
+                cursor.execute(
+                    "ALTER TABLE message_log MODIFY fecha_mensaje DATETIME NOT NULL, "
+                    "DROP PRIMARY KEY, ADD PRIMARY KEY (id, fecha_mensaje) "
+                    f"PARTITION BY RANGE COLUMNS (fecha_mensaje) ({', '.join(definiciones)})"
+                )
+        with self._lock:
+            self.particiones_creadas += len(definiciones)
+        return True
+
+    def crear_particiones_futuras(self, cursor, particiones, hoy):
+        """Separa de pfuturo los meses que faltan hasta hoy + meses_futuros"""
+        limites = [limite for _, limite, _ in particiones if limite is not None]
+        mes = limites[-1] if limites else inicio_de_mes(hoy)
+        ultimo = sumar_meses(inicio_de_mes(hoy), self.meses_futuros)
+        definiciones = []
+        while mes <= ultimo:
+            definiciones.append(definicion_particion(mes))
+            mes = sumar_meses(mes, 1)
+        if definiciones:
+            logger.info("Creando %s particiones de message_log", len(definiciones))
+            cursor.execute(
+                f"ALTER TABLE message_log REORGANIZE PARTITION {PARTICION_FUTURO} INTO "
+                f"({', '.join(definiciones)}, PARTITION {PARTICION_FUTURO} VALUES LESS THAN (MAXVALUE))"
+            )
+        return len(definiciones)
+
+    def vencidas(self, particiones, hoy):
+        """Particiones cuyo mes completo es anterior al corte de retención: (nombre, inicio o None, límite)"""
+        corte = hoy - datetime.timedelta(days=self.dias)
+        vencidas = []
+        inicio = None
+        for nombre, limite, _ in particiones:
+            if limite is None or limite > corte:
+                break
+            vencidas.append((nombre, inicio, limite))
+            inicio = limite
+        return vencidas
+
+    def _contar(self, cursor, sql, parametros=()):
+        cursor.execute(sql, parametros)
+        return cursor.fetchone()["filas"]
+
+    def archivar_en_tabla(self, nombre, inicio, limite):
+        """
+        Copia la particion a message_log_archivo por lotes de id; INSERT IGNORE permite repetir tras un corte.
+        Devuelve cuantas filas de la particion estan en el archivo: se cuentan por id y no por rango de
+        fechas, que tambien incluiria los meses archivados en ejecuciones anteriores.
+        """
+        ultimo = 0
+        while True:
+            with self.pool.conexion() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        f"SELECT MAX(id) AS hasta FROM (SELECT id FROM message_log PARTITION ({nombre}) "
+                        f"WHERE id > %s ORDER BY id LIMIT %s) lote",
+                        (ultimo, self.lote)
+                    )
+                    hasta = cursor.fetchone()["hasta"]
+                    if hasta is None:
+                        break
+                    cursor.execute(
+                        f"INSERT IGNORE INTO message_log_archivo ({COLUMNAS}) "
+                        f"SELECT {COLUMNAS} FROM message_log PARTITION ({nombre}) WHERE id > %s AND id <= %s",
+                        (ultimo, hasta)
+                    )
+                conn.commit()
+            ultimo = hasta
+        with self.pool.conexion() as conn, conn.cursor() as cursor:
+            return self._contar(
+                cursor,
+                f"SELECT COUNT(*) AS filas FROM message_log PARTITION ({nombre}) m "
+                f"JOIN message_log_archivo a ON a.id = m.id AND a.fecha_mensaje = m.fecha_mensaje"
+            )
+
+    def archivar_en_archivo(self, nombre, inicio, limite):
+        """Escribe la particion en <directorio>/message_log_<particion>.jsonl.gz; el archivo aparece completo o no aparece"""
+        os.makedirs(self.directorio, exist_ok=True)
+        ruta = os.path.join(self.directorio, f"message_log_{nombre}.jsonl.gz")
+        exportacion = Exportacion("message_log", desde=inicio, hasta=limite)
+        with gzip.open(ruta + ".parcial", "wt", encoding="utf-8") as archivo:
+            for bloque in exportacion.exportar(self.crear_conexion, lote=self.lote):
+                archivo.write(bloque)
+        os.replace(ruta + ".parcial", ruta)
+        return exportacion.exportadas
+
+    def mantener(self, hoy=None):
+        """Crea las particiones futuras, archiva y elimina las vencidas; devuelve un resumen"""
+        hoy = hoy or datetime.date.today()
+        with self.pool.conexion() as conn, conn.cursor() as cursor:
+            particiones = self.particiones(cursor)
+            if not particiones:
+                raise RuntimeError("message_log no está particionada: ejecute `python cli.py retencion particionar`")
+            creadas = self.crear_particiones_futuras(cursor, particiones, hoy)
+
+        resumen = {"particiones_creadas": creadas, "archivadas": [], "fallidas": []}
+        for nombre, inicio, limite in self.vencidas(particiones, hoy):
+            with self.pool.conexion() as conn, conn.cursor() as cursor:
+                filas = self._contar(cursor, f"SELECT COUNT(*) AS filas FROM message_log PARTITION ({nombre})")
+            if self.destino == "tabla":
+                archivadas = self.archivar_en_tabla(nombre, inicio, limite)
+            else:
+                archivadas = self.archivar_en_archivo(nombre, inicio, limite)
+            # Solo se elimina la particion si el archivo tiene exactamente sus filas
+            if archivadas != filas:
+                logger.error("Partición %s: %s filas y %s archivadas; no se elimina", nombre, filas, archivadas)
+                resumen["fallidas"].append(nombre)
+                continue
+            with self.pool.conexion() as conn, conn.cursor() as cursor:
+                cursor.execute(f"ALTER TABLE message_log DROP PARTITION {nombre}")
+            logger.info("Partición %s archivada (%s filas) y eliminada", nombre, filas)
+            resumen["archivadas"].append(nombre)
+            with self._lock:
+                self.filas_archivadas += filas
+                self.particiones_eliminadas += 1
+
+        with self._lock:
+            self.particiones_creadas += creadas
+            self.fallidas += len(resumen["fallidas"])
+        return resumen
+
+    def estadisticas(self):
+        """Devuelve particiones creadas y eliminadas, filas archivadas y particiones que no se pudieron archivar"""
+        with self._lock:
+            return {
+                "particiones_creadas": self.particiones_creadas,
+                "particiones_eliminadas": self.particiones_eliminadas,
+                "filas_archivadas": self.filas_archivadas,
+                "fallidas": self.fallidas,
+            }
@@ -0,0 +1,155 @@
+"""
+Ruta rapida sin LLM para los pasos predecibles del flujo de recordatorios.
+Reconoce saludos, si/no, intervalos ("dos meses"), nombre de mascota y marca
+de alimento con reglas; si no hay certeza devuelve None y se usa Gemini.
+"""
+
+import os
+import re
+import threading
+import unicodedata
+
+RUTA_RAPIDA_ACTIVA = os.environ.get("FAST_PATH", "1") != "0"
+
+NUMEROS = {
+    "un": 1, "una": 1, "uno": 1, "dos": 2, "tres": 3, "cuatro": 4, "cinco": 5, "seis": 6,
+    "siete": 7, "ocho": 8, "nueve": 9, "diez": 10, "once": 11, "doce": 12, "quince": 15,
+    "veinte": 20, "treinta": 30,
+}
+
+MARCAS = [
+    "royal canin", "pro plan", "proplan", "purina", "dog chow", "cat chow", "pedigree", "whiskas",
+    "hill's", "hills", "eukanuba", "nupec", "acana", "orijen", "taste of the wild", "diamond",
+    "nutrique", "equilibrio", "felix", "friskies", "nutra nuggets", "vital can", "excellent", "agility",
+]
+
+SALUDOS = r"(hola|holi|buenas|buenos dias|buenas tardes|buenas noches|hey|saludos|que tal)"
+AFIRMACIONES = r"(si|claro|dale|ok|okay|bueno|de acuerdo|por supuesto|me gustaria|si me gustaria|perfecto|esta bien)"
+NEGACIONES = r"(no|no gracias|nop|para nada|ahora no)"
+
+RE_SALUDO = re.compile(rf"^{SALUDOS}( {SALUDOS})*$")
+RE_SI = re.compile(rf"^{AFIRMACIONES}( (por favor|gracias|claro|me gustaria|si))*$")
+RE_NO = re.compile(rf"^{NEGACIONES}( (gracias|por ahora))*$")
+RE_INTERVALO = re.compile(
+    r"\b(\d+|" + "|".join(NUMEROS) + r")\s+(dias?|semanas?|mes|meses)\b"
+)
+RE_NOMBRE = re.compile(r"(?:\b(?:se llama|su nombre es|nombre es|le decimos)|^es)\s+([a-z]+(?: [a-z]+)?)$")
+RE_NOMBRE_SOLO = re.compile(r"^[a-z]+( [a-z]+)?$")
+# Palabras que no forman un nombre: respuestas, muletillas, interjecciones y palabras de función.
+# Un mensaje corto con alguna de ellas ("que cosa", "espera", "un momento") se deriva al LLM
+PALABRAS_NO_NOMBRE = {
+    "si", "no", "hola", "gracias", "ok", "okay", "vale", "perro", "perra", "gato", "gata", "mascota", "claro",
+    "bueno", "dale", "que", "cosa", "como", "cual", "quien", "donde", "cuando", "porque", "por", "para",
+    "espera", "esperame", "momento", "un", "una", "el", "la", "los", "las", "lo", "le", "de", "del", "y", "o",
+    "es", "se", "mi", "su", "tu", "ya", "ahora", "luego", "despues", "nada", "nose", "sabe", "creo",
+    "perdon", "disculpa", "ayuda", "eh", "ah", "oh", "mmm", "hmm", "jaja", "jajaja", "ups", "uy", "ey", "hey",
+    "listo", "bien", "mal", "nombre", "llama", "tiene", "tengo", "todavia", "aun", "otra", "otro", "vez",
+}
+# Una marca o un intervalo junto a una negación ("no, pedigree no", "no, en 2 meses no") no es la respuesta
+RE_NEGACION = re.compile(r"\b(no|ni|sin|nunca|tampoco|nada)\b")
+
+RESPUESTA_SALUDO = "¡Hola! Soy el asistente de la tienda de mascotas, ¿Le gustaría que le programemos un recordatorio para su próxima compra?"
+RESPUESTA_INTERVALO = "¡Perfecto! ¿En cuantas semanas le gustaria recibir un recordatorio de su proxima compra?"
+RESPUESTA_NO = "¡Entendido! Si más adelante desea programar un recordatorio, aquí estaré para ayudarle."
+RESPUESTA_NOMBRE = "¡Genial! ¿Cuál es el nombre de su mascota?"
+RESPUESTA_ALIMENTO = "¡Excelente! ¿Qué alimentos le gustan a {nombre}?"
+RESPUESTA_RAZA = "¡Maravilloso! ¿Y cuál es la raza de su mascota?"
+
+
+def normalizar(texto):
+    """Minúsculas, sin acentos, sin signos y con espacios simples"""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r"[^a-z0-9' ]+", " ", texto)
+    return " ".join(texto.split())
+
+
+class RutaRapida:
+    """Responde localmente los pasos 1 a 4 cuando la intención es clara"""
+
+    def __init__(self, convertir_a_semanas, activa=RUTA_RAPIDA_ACTIVA):
+        self.convertir_a_semanas = convertir_a_semanas
+        self.activa = activa
+        self._lock = threading.Lock()
+        self.llm_evitadas = 0
+        self.derivadas_llm = 0
+
+    def responder(self, mensaje, step):
+        """Devuelve un diccionario como el de la IA, o None si hay que consultar al LLM"""
+        if not self.activa:
+            return None
+        try:
+            step = int(step or 0)
+        except (TypeError, ValueError):
+            step = 0
+        texto = normalizar(mensaje)
+        respuesta = self._responder(texto, step) if texto else None
+        with self._lock:
+            if respuesta is None:
+                self.derivadas_llm += 1
+            else:
+                self.llm_evitadas += 1
+        return respuesta
+
+    def _responder(self, texto, step):
+        if step == 0 and RE_SALUDO.match(texto):
+            return {"respuesta": RESPUESTA_SALUDO, "step": 1}
+        if step == 1:
+            if RE_SI.match(texto):
+                return {"respuesta": RESPUESTA_INTERVALO, "step": 2}
+            if RE_NO.match(texto):
+                return {"respuesta": RESPUESTA_NO, "step": 1}
+        if step == 2:
+            intervalo = self.extraer_intervalo(texto)
+            if intervalo:
+                return {"respuesta": RESPUESTA_NOMBRE, "step": 3, "intervalo": intervalo}
+        if step == 3:
+            nombre = self.extraer_nombre(texto)
+            if nombre:
+                return {"respuesta": RESPUESTA_ALIMENTO.format(nombre=nombre), "step": 4, "Nombre_mascota": nombre}
+        if step == 4:
+            marca = self.extraer_marca(texto)
+            if marca:
+                return {"respuesta": RESPUESTA_RAZA, "step": 5, "preferencia": marca}
+        return None
+
+    def extraer_intervalo(self, texto):
+        """Devuelve el intervalo en semanas si el mensaje menciona exactamente uno, sin negaciones"""
+        if RE_NEGACION.search(texto):
+            return None
+        encontrados = RE_INTERVALO.findall(texto)
+        if len(encontrados) != 1:
+            return None
+        cantidad, unidad = encontrados[0]
+        cantidad = int(cantidad) if cantidad.isdigit() else NUMEROS[cantidad]
+        semanas = round(self.convertir_a_semanas(cantidad, unidad))
+        return semanas if semanas > 0 else None
+
+    @staticmethod
+    def extraer_nombre(texto):
+        """Devuelve el nombre de la mascota si se dice explícitamente o el mensaje es solo el nombre"""
+        encontrado = RE_NOMBRE.search(texto)
+        if encontrado:
+            nombre = encontrado.group(1)
+        elif RE_NOMBRE_SOLO.match(texto):
+            nombre = texto
+        else:
+            return None
+        if set(nombre.split()) & PALABRAS_NO_NOMBRE:
+            return None
+        return nombre.title()
+
+    @staticmethod
+    def extraer_marca(texto):
+        """Devuelve la única marca de alimento conocida que aparece en el mensaje, si no hay negaciones"""
+        if RE_NEGACION.search(texto):
+            return None
+        marcas = [marca for marca in MARCAS if re.search(rf"\b{re.escape(marca)}\b", texto)]
+        if len(marcas) != 1:
+            return None
+        return " ".join(palabra.capitalize() for palabra in marcas[0].split())
+
+    def estadisticas(self):
+        """Devuelve cuántos mensajes se respondieron sin LLM"""
+        with self._lock:
+            return {"llm_evitadas": self.llm_evitadas, "derivadas_llm": self.derivadas_llm}
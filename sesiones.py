@@ -0,0 +1,203 @@
+"""
+Almacen de estado de sesiones de WhatsApp indexado por numero de telefono.
+Reemplaza el DataFrame global de app.py: el step actual se obtiene en O(1),
+cada telefono guarda solo sus ultimos mensajes y las conversaciones inactivas
+se eliminan despues de un TTL.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+
+# --- Configuración ---
+MAX_HISTORIAL = int(os.environ.get("SESSION_MAX_HISTORY", "20"))
+TTL_SEGUNDOS = int(os.environ.get("SESSION_TTL", str(24 * 3600)))
+PURGAR_CADA = int(os.environ.get("SESSION_PURGE_EVERY", "1000"))
+
+
+class Sesion:
+    """Estado de una conversacion: step actual e historial acotado"""
+
+    __slots__ = ("telefono", "step", "ultima_actividad", "historial")
+
+    def __init__(self, telefono, max_historial):
+        self.telefono = telefono
+        self.step = None
+        self.ultima_actividad = 0.0
+        self.historial = deque(maxlen=max_historial)
+
+
+# --- Backend en memoria (un solo proceso) ---
+class SesionesEnMemoria:
+    """Sesiones en un dict ordenado por ultima actividad, para un solo proceso"""
+
+    def __init__(self, max_historial=MAX_HISTORIAL, ttl=TTL_SEGUNDOS):
+        self.max_historial = max_historial
+        self.ttl = ttl
+        self._sesiones = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener_step(self, telefono):
+        """Devuelve el ultimo step del telefono o None si no hay sesion activa"""
+        with self._lock:
+            self._purgar(time.time())
+            sesion = self._sesiones.get(telefono)
+            return sesion.step if sesion else None
+
+    def registrar(self, telefono, mensaje, fecha, step):
+        """Guarda un mensaje en la sesion del telefono y actualiza su step"""
+        ahora = time.time()
+        with self._lock:
+            self._purgar(ahora)
+            sesion = self._sesiones.get(telefono)
+            if sesion is None:
+                sesion = Sesion(telefono, self.max_historial)
+                self._sesiones[telefono] = sesion
+            else:
+                self._sesiones.move_to_end(telefono)
+            sesion.step = step
+            sesion.ultima_actividad = ahora
+            sesion.historial.append((mensaje, fecha, step))
+
+    def listar(self, offset=0, limite=50):
+        """Devuelve una pagina de mensajes registrados y el total de sesiones"""
+        with self._lock:
+            self._purgar(time.time())
+            filas = []
+            for sesion in list(self._sesiones.values())[offset:offset + limite]:
+                for mensaje, fecha, step in sesion.historial:
+                    filas.append({"telefono": sesion.telefono, "mensaje": mensaje, "fecha": fecha, "step": step})
+            return filas, len(self._sesiones)
+
+    def purgar_expiradas(self):
+        """Elimina las sesiones inactivas por mas de ttl segundos"""
+        with self._lock:
+            return self._purgar(time.time())
+
+    def _purgar(self, ahora):
+        # Las sesiones estan ordenadas por actividad, las expiradas estan al inicio
+        eliminadas = 0
+        while self._sesiones:
+            telefono, sesion = next(iter(self._sesiones.items()))
+            if ahora - sesion.ultima_actividad < self.ttl:
+                break
+            del self._sesiones[telefono]
+            eliminadas += 1
+        return eliminadas
+
+
+# --- Backend SQLite (varios workers de Gunicorn) ---
+class SesionesSQLite:
+    """Sesiones en un archivo SQLite compartido entre workers del mismo host"""
+
+    def __init__(self, ruta, max_historial=MAX_HISTORIAL, ttl=TTL_SEGUNDOS, purgar_cada=PURGAR_CADA):
+        self.ruta = ruta
+        self.max_historial = max_historial
+        self.ttl = ttl
+        self.purgar_cada = purgar_cada
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._registros = 0
+        conn = self._conexion()
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS sesiones (
+                telefono TEXT PRIMARY KEY,
+                step TEXT,
+                ultima_actividad REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_sesiones_actividad ON sesiones (ultima_actividad);
+            CREATE TABLE IF NOT EXISTS sesion_mensajes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                telefono TEXT,
+                mensaje TEXT,
+                fecha TEXT,
+                step TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_sesion_mensajes_telefono ON sesion_mensajes (telefono, id);
+        ''')
+
+    def _conexion(self):
+        # sqlite3 no permite compartir conexiones entre hilos
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.ruta, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def obtener_step(self, telefono):
+        """Devuelve el ultimo step del telefono o None si no hay sesion activa"""
+        fila = self._conexion().execute(
+            "SELECT step FROM sesiones WHERE telefono = ? AND ultima_actividad > ?",
+            (telefono, time.time() - self.ttl)
+        ).fetchone()
+        return fila[0] if fila else None
+
+    def registrar(self, telefono, mensaje, fecha, step):
+        """Guarda un mensaje en la sesion del telefono y actualiza su step"""
+        conn = self._conexion()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT INTO sesiones (telefono, step, ultima_actividad) VALUES (?, ?, ?) "
+                "ON CONFLICT(telefono) DO UPDATE SET step = excluded.step, ultima_actividad = excluded.ultima_actividad",
+                (telefono, step, time.time())
+            )
+            conn.execute(
+                "INSERT INTO sesion_mensajes (telefono, mensaje, fecha, step) VALUES (?, ?, ?, ?)",
+                (telefono, mensaje, fecha, step)
+            )
+            # Mantener solo los ultimos max_historial mensajes del telefono
+            conn.execute(
+                "DELETE FROM sesion_mensajes WHERE telefono = ? AND id <= ("
+                "SELECT id FROM sesion_mensajes WHERE telefono = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (telefono, telefono, self.max_historial)
+            )
+        # Las sesiones expiradas no se leen pero siguen en el archivo: se borran cada purgar_cada escrituras
+        with self._lock:
+            self._registros += 1
+            purgar = self.purgar_cada > 0 and self._registros % self.purgar_cada == 0
+        if purgar:
+            self.purgar_expiradas()
+
+    def listar(self, offset=0, limite=50):
+        """Devuelve una pagina de mensajes registrados y el total de sesiones"""
+        conn = self._conexion()
+        limite_actividad = time.time() - self.ttl
+        total = conn.execute(
+            "SELECT COUNT(*) FROM sesiones WHERE ultima_actividad > ?", (limite_actividad,)
+        ).fetchone()[0]
+        filas = conn.execute(
+            "SELECT m.telefono, m.mensaje, m.fecha, m.step FROM ("
+            "SELECT telefono, ultima_actividad FROM sesiones WHERE ultima_actividad > ? "
+            "ORDER BY ultima_actividad LIMIT ? OFFSET ?) s "
+            "JOIN sesion_mensajes m ON m.telefono = s.telefono ORDER BY s.ultima_actividad, m.id",
+            (limite_actividad, limite, offset)
+        ).fetchall()
+        return [{"telefono": t, "mensaje": m, "fecha": f, "step": s} for t, m, f, s in filas], total
+
+    def purgar_expiradas(self):
+        """Elimina las sesiones inactivas por mas de ttl segundos"""
+        conn = self._conexion()
+        limite_actividad = time.time() - self.ttl
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "DELETE FROM sesion_mensajes WHERE telefono IN ("
+                "SELECT telefono FROM sesiones WHERE ultima_actividad <= ?)",
+                (limite_actividad,)
+            )
+            cur = conn.execute("DELETE FROM sesiones WHERE ultima_actividad <= ?", (limite_actividad,))
+            return cur.rowcount
+
+
+def crear_almacen_sesiones():
+    """Crea el almacen de sesiones segun SESSION_BACKEND (memory o sqlite)"""
+    backend = os.environ.get("SESSION_BACKEND", "memory").lower()
+    if backend == "sqlite":
+        return SesionesSQLite(os.environ.get("SESSION_DB_PATH", "sesiones.db"))
+    return SesionesEnMemoria()
@@ -0,0 +1,50 @@
+"""
+Corpus de respuestas reales del modelo (benchmarks/respuestas_modelo.json):
+cada texto debe dar exactamente el diccionario esperado, o RespuestaInvalida
+si esperado es null.
+
+Uso:
+    python -m unittest discover tests
+"""
+
+import json
+import os
+import sys
+import unittest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from parser_respuesta import RespuestaInvalida, parsear_respuesta
+
+CORPUS = os.path.join(RAIZ, "benchmarks", "respuestas_modelo.json")
+
+
+class CorpusRespuestasModelo(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with open(CORPUS, encoding="utf-8") as archivo:
+            cls.corpus = json.load(archivo)
+
+    def test_corpus(self):
+        for caso in self.corpus:
+            with self.subTest(texto=caso["texto"][:60]):
+                if caso["esperado"] is None:
+                    with self.assertRaises(RespuestaInvalida):
+                        parsear_respuesta(caso["texto"])
+                else:
+                    self.assertEqual(parsear_respuesta(caso["texto"]).a_dict(), caso["esperado"])
+
+    def test_step_e_intervalo_son_enteros(self):
+        for caso in self.corpus:
+            if caso["esperado"] is None:
+                continue
+            with self.subTest(texto=caso["texto"][:60]):
+                respuesta = parsear_respuesta(caso["texto"])
+                for valor in (respuesta.step, respuesta.intervalo):
+                    self.assertTrue(valor is None or (type(valor) is int and valor > 0))
+
+
+if __name__ == "__main__":
+    unittest.main()